@@ -1,9 +1,15 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Body, Query
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Body, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
-from datetime import datetime
-from database.conn import DatabaseConnection
-import os, re, mimetypes, time, json
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, PlainTextResponse
+from datetime import datetime, date
+from typing import List
+from contextlib import asynccontextmanager
+from database.conn import DatabaseConnection, init_pool, close_pool, pool_status
+from saved_index import SavedIndex
+from metrics import metrics
+from upload_store import receive_multipart, download_path, UploadTooLarge, UnsupportedUpload
+import reevaluate
+import os, re, mimetypes, time, json, asyncio, threading
 from PIL import Image, ImageDraw, ImageFont
 import io
 import textwrap
@@ -14,7 +20,31 @@ dotenv_path = os.path.join(os.path.dirname(__file__), '..', 'src', 'app', 'local
 load_dotenv(dotenv_path=dotenv_path)
 
 
-app = FastAPI(title="Nani Tax Service")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # งานหนักทั้งหมดทำใน background เพื่อให้ /ping และ endpoint ฐานข้อมูลตอบได้ทันทีหลัง start
+    warm_up_task = asyncio.create_task(warm_up())
+    yield
+    warm_up_task.cancel()
+    if WORKFLOW_AVAILABLE:
+        get_queue().shutdown()
+        await typhoon_client.aclose()
+    await asyncio.to_thread(close_pool)
+
+
+async def warm_up():
+    try:
+        # เปิด connection pool ของฐานข้อมูล (ระหว่างนี้/ถ้าต่อไม่ได้ DatabaseConnection จะต่อตรงแบบเดิม)
+        await asyncio.to_thread(init_pool)
+        # import workflow + โหลดโมเดลจัดหมวดหมู่ครั้งเดียวต่อ worker
+        if await workflow_ready():
+            # เริ่ม worker ของ job queue และทำ job ที่ค้างจากรอบก่อนต่อ
+            get_queue().start()
+    except Exception as e:
+        print("[WARM UP ERROR]", repr(e))
+
+
+app = FastAPI(title="Nani Tax Service", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://127.0.0.1:3000", "https://smart-tax-gules.vercel.app"],  # TODO: restrict in production
@@ -26,22 +56,52 @@ app.add_middleware(
 # ---- Settings ----
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+# /api/process รอ OCR/LLM แบบ async บน event loop (0 = ใช้ thread pool แบบเดิม)
+PIPELINE_ASYNC = os.getenv("PIPELINE_ASYNC", "1").lower() in ("1", "true", "yes")
 
 # ---- Optional workflow imports ----
-try:
-    from prepro import FileHandler
-    from ocr_flow import OCRService, TransactionExtractor
-    from extraction import InvoiceExtractor as ex
-    from predict_category import prediction
-    from find_company import FindInvoiceCompany
-    from condition import check_condition
-    WORKFLOW_AVAILABLE = True
-except Exception as e:
-    import traceback
-    print("[WORKFLOW IMPORT ERROR]", repr(e))
-    traceback.print_exc()
-    WORKFLOW_AVAILABLE = False
-    
+# โมดูล workflow (typhoon_ocr, openai, cv2, pythainlp, sklearn, ...) import ช้ามาก
+# จึงโหลดแบบ lazy ผ่าน load_workflow() แทนการ import ตอนโหลด app
+WORKFLOW_AVAILABLE = False
+WORKFLOW_STATE = {"status": "pending", "error": None, "load_seconds": None}  # pending / loading / ready / failed
+_workflow_lock = threading.Lock()
+
+
+def load_workflow() -> bool:
+    """import โมดูล workflow และ warm up โมเดลครั้งเดียวต่อ process (thread อื่นที่เรียกพร้อมกันจะรอ)"""
+    global WORKFLOW_AVAILABLE, FileHandler, DocumentPipeline, split_page_results, page_timings, known_result, remember_result, model_registry, result_cache, get_queue, typhoon_client, BatchProcessor
+    with _workflow_lock:
+        if WORKFLOW_STATE["status"] in ("ready", "failed"):
+            return WORKFLOW_AVAILABLE
+        WORKFLOW_STATE["status"] = "loading"
+        started = time.perf_counter()
+        try:
+            from prepro import FileHandler
+            from pipeline import DocumentPipeline, split_page_results, page_timings, known_result, remember_result
+            import model_registry
+            from result_cache import cache as result_cache
+            from jobs import get_queue
+            import typhoon_client
+            from batch import BatchProcessor
+        except Exception as e:
+            import traceback
+            print("[WORKFLOW IMPORT ERROR]", repr(e))
+            traceback.print_exc()
+            WORKFLOW_STATE.update(status="failed", error=repr(e))
+            return False
+        model_registry.warm_up()
+        WORKFLOW_AVAILABLE = True
+        WORKFLOW_STATE.update(status="ready", load_seconds=round(time.perf_counter() - started, 3))
+        print(f"[WORKFLOW] ready in {WORKFLOW_STATE['load_seconds']}s")
+        return True
+
+
+async def workflow_ready() -> bool:
+    """รอจนโหลด workflow เสร็จ (ถ้ายังไม่เริ่มจะเริ่มโหลดเลย) คืน True ถ้าใช้งานได้"""
+    if WORKFLOW_STATE["status"] in ("ready", "failed"):
+        return WORKFLOW_AVAILABLE
+    return await asyncio.to_thread(load_workflow)
+
 ALLOWED_MIME = {"application/pdf", "image/jpeg", "image/png"}
 MAX_BYTES = 15 * 1024 * 1024  # 15MB
 
@@ -50,13 +110,12 @@ UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
 SAVED_DIR  = os.path.join(BASE_DIR, "saved_records")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(SAVED_DIR, exist_ok=True)
+saved_records_index = SavedIndex(os.path.join(SAVED_DIR, "index.sqlite3"), SAVED_DIR)
 
-def validate_file_upload(file: UploadFile, content: bytes):
-    mt = file.content_type or ""
-    if mt not in ALLOWED_MIME:
-        raise HTTPException(status_code=415, detail=f"Unsupported type: {mt}")
-    if len(content) > MAX_BYTES:
-        raise HTTPException(status_code=413, detail="File too large")
+# endpoint ที่อ่าน body เอง (receive_upload) ยังแสดง field "file" ใน /docs
+UPLOAD_OPENAPI = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}},
+}}}}}
     
 def normalize_page_key(p):
     """Accepts keys like 1, "1", "1/2", "page-3" and returns int page number."""
@@ -70,10 +129,17 @@ def normalize_page_key(p):
     return int(m.group(1)) if m else 1
 
 
+async def run_db(fn):
+    """ยืม connection จาก pool แล้วรัน fn(db) ใน thread แยก ไม่ให้ event loop ค้าง"""
+    def _work():
+        with DatabaseConnection() as db:
+            return fn(db)
+    return await asyncio.to_thread(_work)
+
+
 @app.get("/create/table")
 async def create_table():
-    create_table = DatabaseConnection()
-    return create_table.create_table()
+    return await run_db(lambda db: db.create_table())
 
 @app.post("/api/insert_employee")
 async def insert_employee(
@@ -84,22 +150,19 @@ async def insert_employee(
     password_hash = payload.get("password_hash")
     role = payload.get("role", "user")
 
-    db = DatabaseConnection()
-    emp_id = db.insert_employee(name, email, password_hash, role)
+    emp_id = await run_db(lambda db: db.insert_employee(name, email, password_hash, role))
     if emp_id:
         return {"ok": True, "id": emp_id}
     return {"ok": False}
 
 @app.get("/api/get_employees")
 async def get_employees():
-    db = DatabaseConnection()
-    employees = db.get_employees()
+    employees = await run_db(lambda db: db.get_employees())
     return {"ok": True, "employees": employees}
 
 @app.get("/api/get_pre_employees")
 async def get_pre_employees(email: str, password_hash: str):
-    db = DatabaseConnection()
-    employee = db.get_pre_employee(email, password_hash)
+    employee = await run_db(lambda db: db.get_pre_employee(email, password_hash))
     if employee:
         return {"ok": True, "employee": employee}
     return {"ok": False, "error": "Invalid email or password"}
@@ -112,49 +175,130 @@ async def insert_document(
 ):
     meta = body.get("meta", {})
     result_json = body.get("result_json", {})
-    db = DatabaseConnection()
-    doc_id = db.insert_document(employee_id, member_name, meta, result_json)
+    doc_id = await run_db(lambda db: db.insert_document(employee_id, member_name, meta, result_json))
     return {"ok": bool(doc_id), "id": doc_id}
 
+@app.post("/api/insert_documents")
+async def insert_documents(
+    employee_id: int = Query(...),
+    member_name: str = Query(...),
+    body: dict = Body(...)
+):
+    """
+    บันทึกหลายเอกสารใน transaction เดียว body = {"documents": [{"meta": ..., "result_json": ...}, ...]}
+    คืนผลรายแถวตามลำดับ (แถวที่ผิดมี error แถวอื่นยังบันทึก)
+    """
+    documents = body.get("documents")
+    if not isinstance(documents, list) or not documents:
+        raise HTTPException(status_code=400, detail="documents must be a non-empty list")
+    results = await run_db(lambda db: db.insert_documents_bulk(employee_id, member_name, documents))
+    return {"ok": all(r["ok"] for r in results), "results": results}
+
 @app.get("/api/get_all_document")
 async def get_all_document(
-    employee_id: int = Query(...)
+    employee_id: int = Query(...),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = Query(None),
+    sort: str = Query("created_at", pattern="^(created_at|doc_date)$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    deduction_status: str | None = Query(None),
+    vendor_name: str | None = Query(None),
+    date_from: date | None = Query(None),
+    date_to: date | None = Query(None),
+    include_result_json: bool = Query(False),
 ):
-    db = DatabaseConnection()
-    documents = db.get_all_document(employee_id)
-    return {"ok": True, "documents": documents}
+    """
+    รายการเอกสารของพนักงานแบบแบ่งหน้า ส่ง next_cursor กลับมาเป็น cursor เพื่อดึงหน้าถัดไป
+    ค่าเริ่มต้นไม่รวม result_json — ขอได้ด้วย include_result_json=true
+    """
+    try:
+        page = await run_db(lambda db: db.list_documents(
+            employee_id, limit=limit, cursor=cursor, sort=sort, order=order,
+            deduction_status=deduction_status, vendor_name=vendor_name,
+            date_from=date_from, date_to=date_to, include_result_json=include_result_json,
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ok": True, "documents": page["documents"], "next_cursor": page["next_cursor"]}
 
 @app.get("/api/get_per_document")
 async def get_per_document(doc_id: int):
-    db = DatabaseConnection()
-    document = db.get_per_document(doc_id)
+    document = await run_db(lambda db: db.get_per_document(doc_id))
     if document:
         return {"ok": True, "document": document}
     return {"ok": False}
 
 @app.delete("/api/delete_document")
 async def delete_document(document_id: int):
-    db = DatabaseConnection()
-    ok = db.delete_document(document_id)
+    ok = await run_db(lambda db: db.delete_document(document_id))
     return {"ok": bool(ok)}
 
+@app.post("/api/documents/reevaluate")
+async def start_reevaluate(
+    rules_version: str = Query(reevaluate.RULES_VERSION),
+    employee_id: int | None = Query(None),
+    tax_year: int | None = Query(None, description="ปีภาษี พ.ศ. (ค่าเริ่มต้น: ปีของแต่ละเอกสาร)"),
+    reclassify: bool = Query(True),
+    batch_size: int = Query(reevaluate.REEVALUATE_BATCH_SIZE, ge=1, le=5000),
+    dry_run: bool = Query(False),
+):
+    """
+    ตรวจเงื่อนไขเอกสารที่บันทึกไว้ใหม่ด้วยกฎชุด rules_version (รันใน background ทีละงาน)
+    ติดตามความคืบหน้าได้ที่ GET /api/documents/reevaluate
+    """
+    if reclassify and not await workflow_ready():
+        raise HTTPException(status_code=503, detail="Workflow modules are not available")
+    try:
+        started = reevaluate.start(
+            rules_version=rules_version, employee_id=employee_id, tax_year=tax_year,
+            reclassify=reclassify, batch_size=batch_size, dry_run=dry_run,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not started:
+        raise HTTPException(status_code=409, detail="Re-evaluation is already running")
+    return {"ok": True, "status": reevaluate.status()}
+
+@app.get("/api/documents/reevaluate")
+async def get_reevaluate():
+    return {"ok": True, "status": reevaluate.status()}
+
 
 @app.get("/ping")
 def ping():
     return {"ok": True}
 
 
+@app.get("/ready")
+def ready():
+    """200 เมื่อโหลด workflow เสร็จแล้ว, 503 ระหว่างกำลังโหลดหรือโหลดไม่สำเร็จ (ใช้เป็น readiness probe)"""
+    body = {"ok": WORKFLOW_STATE["status"] == "ready", "workflow": WORKFLOW_STATE}
+    return JSONResponse(body, status_code=200 if body["ok"] else 503)
+
+
 @app.get("/status")
 def status():
     return {
         "ok": True,
         "workflow_available": WORKFLOW_AVAILABLE,
+        "workflow": WORKFLOW_STATE,
+        "models": model_registry.status() if WORKFLOW_AVAILABLE else None,
+        "cache": result_cache.status() if WORKFLOW_AVAILABLE else None,
+        "typhoon": typhoon_client.status() if WORKFLOW_AVAILABLE else None,
+        "stages": metrics.status(),
+        "db_pool": pool_status(),
         "env": {
             "TYPHOON_API_KEY": bool(os.getenv("TYPHOON_OCR_API_KEY"))
         }
     }
 
 
+@app.get("/metrics")
+def prometheus_metrics():
+    """เวลา/CPU/bytes ราย stage ของ pipeline และ latency ของ Typhoon API ในรูปแบบ Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/thumb_text")
 def thumb_text(text: str = Query(...)):
     width, height = 600, 400
@@ -180,13 +324,15 @@ def thumb_text(text: str = Query(...)):
 
 #ดาวน์โหลดไฟล์ต้นฉบับ
 @app.get("/download/{filename}")
-def download_file(filename: str):
+def download_file(filename: str, name: str | None = Query(None, description="ชื่อไฟล์ตอนดาวน์โหลด (ชื่อเดิมที่อัปโหลด)")):
     safe = os.path.basename(filename)
     path = os.path.join(UPLOAD_DIR, safe)
     if not os.path.exists(path):
         raise HTTPException(status_code=404, detail="File not found")
     mt, _ = mimetypes.guess_type(path)
-    return FileResponse(path, media_type=mt or "application/octet-stream", filename=safe)
+    # ไฟล์เก็บเป็น <sha256><ext> — ใช้ชื่อเดิมถ้ารู้
+    original_name = os.path.basename(name or "").strip()
+    return FileResponse(path, media_type=mt or "application/octet-stream", filename=original_name or safe)
 
 # บันทึกสรุปผลสู่ระบบ
 @app.post("/api/save")
@@ -202,31 +348,24 @@ def save_record(payload: dict = Body(...)):
     with open(path, "w", encoding="utf-8") as f:
         # ตรงนี้ใช้ ensure_ascii=False ได้ เพราะเราคุม json.dump เอง
         json.dump(record, f, ensure_ascii=False, indent=2)
+    saved_records_index.add(record)
 
     return JSONResponse({"ok": True, "id": rid, "savedAt": now, "record": record})
 
-# ดึงรายการที่บันทึกทั้งหมด (สรุป)
+# ดึงรายการที่บันทึกทั้งหมด (สรุป) — ตอบจากดัชนี ไม่เปิดไฟล์ record ทีละไฟล์
 @app.get("/api/saved")
-def list_saved():
-    items = []
-    for name in sorted(os.listdir(SAVED_DIR), reverse=True):
-        if not name.endswith(".json"):
-            continue
-        with open(os.path.join(SAVED_DIR, name), "r", encoding="utf-8") as f:
-            data = json.load(f)
-        items.append({
-            "id": data.get("id"),
-            "savedAt": data.get("savedAt"),
-            "fileName": data.get("fileName"),
-            "memberName": data.get("memberName"),
-            "title": data.get("title") or data.get("raw", {}).get("title"),
-            "seller": data.get("seller"),
-            "dateStr": data.get("dateStr"),
-            "total": data.get("total"),
-            "deduction_status": data.get("deduction_status"),
-            "reason": data.get("reason"),
-        })
-    return JSONResponse({"ok": True, "items": items}, ensure_ascii=False)
+def list_saved(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = Query(None),
+    member_name: str | None = Query(None),
+    deduction_status: str | None = Query(None),
+    file_name: str | None = Query(None),
+):
+    page = saved_records_index.list(
+        limit=limit, cursor=cursor, member_name=member_name,
+        deduction_status=deduction_status, file_name=file_name,
+    )
+    return JSONResponse({"ok": True, "items": page["items"], "next_cursor": page["next_cursor"]}, ensure_ascii=False)
 
 # ดึงรายการที่บันทึกตาม id (เต็มก้อน)
 @app.get("/api/saved/{rid}")
@@ -238,32 +377,221 @@ def get_saved(rid: str):
         data = json.load(f)
     return JSONResponse({"ok": True, "record": data}, ensure_ascii=False)
 
-@app.post("/api/process")
-async def process_file(file: UploadFile = File(...)):
+async def receive_upload(request: Request):
+    """
+    อ่าน body multipart ของ request ทีละ chunk แล้วบันทึก field "file" ลง UPLOAD_DIR/<sha256><ext> คืน StoredUpload
+    - ขนาดเกิน (Content-Length หรือระหว่างอ่าน) -> 413 และชนิดไฟล์จาก magic bytes ไม่รองรับ -> 415 ทันทีที่รู้
+      โดยไม่อ่าน body ที่เหลือ ไม่มีไฟล์ทั้งก้อนในหน่วยความจำ
+    - hash ไปพร้อมกับเขียน — meta (ขนาด/mime/sha256) ส่งต่อให้ insert_document ได้เลย
+    """
+    length = request.headers.get("content-length")
+    try:
+        return await receive_multipart(
+            request.stream(), request.headers.get("content-type", ""), UPLOAD_DIR, MAX_BYTES,
+            allowed_mime=ALLOWED_MIME, content_length=int(length) if length and length.isdigit() else None,
+            run_sync=asyncio.to_thread,
+        )
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="File too large")
+    except UnsupportedUpload as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def upload_result(upload, pages: dict, errors: list, cached: bool = False) -> dict:
+    return {
+        "file": upload.original_name,
+        "sha256": upload.sha256,
+        "meta": upload.meta(),
+        "cached": cached,
+        "pages": pages,
+        "errors": errors,
+        "download_path": download_path(upload.stored_name, upload.original_name),
+    }
+
+def cached_result(upload, bypass_cache: bool = False):
+    """ผลเดิมของไฟล์ที่ sha256 ตรงกัน (เคยประมวลผลสำเร็จแล้ว) หรือ None"""
+    if bypass_cache:
+        return None
+    pages = known_result(upload.sha256)
+    return None if pages is None else upload_result(upload, pages, [], cached=True)
+
+def pipeline_result(upload, page_results: list, timings: bool = False) -> dict:
+    pages, errors = split_page_results(page_results)
+    remember_result(upload.sha256, pages, errors)
+    result = upload_result(upload, pages, errors)
+    if timings:
+        result["timings"] = page_timings(page_results)
+    return result
+
+def run_pipeline(upload, on_event=None, bypass_cache: bool = False, timings: bool = False) -> dict:
+    cached = cached_result(upload, bypass_cache)
+    if cached is not None:
+        return cached
+    file_handler = FileHandler(upload.path)
+    page_results = DocumentPipeline(file_handler, on_event=on_event, bypass_cache=bypass_cache).run()
+    return pipeline_result(upload, page_results, timings)
+
+async def arun_pipeline(upload, bypass_cache: bool = False, timings: bool = False) -> dict:
+    cached = await asyncio.to_thread(cached_result, upload, bypass_cache)
+    if cached is not None:
+        return cached
+    file_handler = FileHandler(upload.path)
+    page_results = await DocumentPipeline(file_handler, bypass_cache=bypass_cache).arun()
+    return await asyncio.to_thread(pipeline_result, upload, page_results, timings)
+
+@app.post("/api/jobs", openapi_extra=UPLOAD_OPENAPI)
+async def create_job(request: Request):
+    """
+    รับไฟล์แล้วคืน job id ทันที งานจริงรันใน worker pool
+    ติดตามผลได้ที่ GET /api/jobs/{job_id}
+    """
+    if not await workflow_ready():
+        raise HTTPException(status_code=503, detail="Workflow modules are not available")
+    upload = await receive_upload(request)
+    job_id = await asyncio.to_thread(get_queue().submit, upload.original_name, upload.path)
+    return {"ok": True, "job_id": job_id, "status": "queued", "status_path": f"/api/jobs/{job_id}"}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    if not await workflow_ready():
+        raise HTTPException(status_code=503, detail="Workflow modules are not available")
+    job = await asyncio.to_thread(get_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse({"ok": True, "job": job})
+
+def format_stream_event(event: dict, fmt: str) -> str:
+    data = json.dumps(event, ensure_ascii=False, default=str)
+    if fmt == "ndjson":
+        return data + "\n"
+    return f"event: {event.get('event', 'message')}\ndata: {data}\n\n"
+
+@app.post("/api/process/stream", openapi_extra=UPLOAD_OPENAPI)
+async def process_file_stream(
+    request: Request,
+    format: str = Query("sse", pattern="^(sse|ndjson)$"),
+    bypass_cache: bool = Query(False),
+):
+    """
+    เหมือน /api/process แต่ส่ง event ออกมาทันทีที่แต่ละหน้าผ่านแต่ละ stage
+      - {"event": "stage", "page", "stage"}   stage: rasterised / ocr / extract / classify / verify_company / check_condition
+      - {"event": "page", "page", "ok", ...}  ผลของหน้านั้น (หรือ error)
+      - {"event": "done", "result"}           ผลรวมแบบเดียวกับ /api/process
+    format=sse (ค่าเริ่มต้น) หรือ ndjson
+    bypass_cache=true เรียก LLM extraction ใหม่แม้จะมีผลเดิมใน cache
+    """
+    if not await workflow_ready():
+        raise HTTPException(status_code=503, detail="Workflow modules are not available")
+    upload = await receive_upload(request)
+
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def emit(event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def work():
+        try:
+            emit({"event": "start", "file": upload.original_name})
+            result = run_pipeline(upload, on_event=emit, bypass_cache=bypass_cache)
+            emit({"event": "done", "result": result})
+        except Exception as e:
+            emit({"event": "error", "error": str(e)})
+        finally:
+            emit(None)
+
+    loop.run_in_executor(None, work)
+
+    async def stream():
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield format_stream_event(event, format)
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/event-stream"
+    return StreamingResponse(stream(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/api/process/batch")
+async def process_batch(
+    files: List[UploadFile] = File(...),
+    format: str = Query("json", pattern="^(json|sse|ndjson)$"),
+    bypass_cache: bool = Query(False),
+):
+    """
+    ประมวลผลหลายไฟล์ (PDF/ภาพ หรือ ZIP ที่มีไฟล์เหล่านั้น) ใน request เดียว
+    ไฟล์ที่เนื้อหาซ้ำกันทำครั้งเดียว ทุกหน้าของทุกไฟล์ใช้ worker pool เดียวกัน และ classify รวมทีละชุด
+    format=json (ค่าเริ่มต้น) คืนผลรวม {"files": {ชื่อไฟล์: ผลแบบ /api/process}, "skipped", "stats"}
+    format=sse/ndjson ส่ง event start / stage / page / file / done ระหว่างทำ (ทุก event มี "file")
+    """
+    if not await workflow_ready():
+        raise HTTPException(status_code=503, detail="Workflow modules are not available")
+
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def emit(event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    batch = BatchProcessor(
+        UPLOAD_DIR, MAX_BYTES, on_event=emit if format != "json" else None, bypass_cache=bypass_cache
+    )
+    for file in files:
+        # อ่านจากไฟล์ที่ Starlette spool ไว้ทีละ chunk (ไม่ await file.read() ทั้งไฟล์)
+        try:
+            await asyncio.to_thread(batch.add_file, file.filename, file.file, file.content_type)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if not batch.entries:
+        raise HTTPException(status_code=400, detail="No supported files in batch")
+
+    if format == "json":
+        return JSONResponse({"ok": True, "result": await batch.run()})
+
+    async def work():
+        try:
+            emit({"event": "done", "result": await batch.run()})
+        except Exception as e:
+            emit({"event": "error", "error": str(e)})
+        finally:
+            emit(None)
+
+    task = asyncio.create_task(work())
+
+    async def stream():
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield format_stream_event(event, format)
+        finally:
+            if not task.done():
+                task.cancel()
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/event-stream"
+    return StreamingResponse(stream(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/api/process", openapi_extra=UPLOAD_OPENAPI)
+async def process_file(request: Request, bypass_cache: bool = Query(False), timings: bool = Query(False)):
     """
     Accepts multipart/form-data with fields:
       - file: PDF or image
       - user_name: optional string (buyer name)
+    Query: bypass_cache=true เรียก LLM extraction ใหม่แม้จะมีผลเดิมใน cache
+           timings=true แนบ result.timings (เวลา/CPU/bytes/RSS ราย stage ของแต่ละหน้า ตามเลขหน้า)
+    ไฟล์เนื้อหาเดิม (sha256 ตรงกัน) ที่เคยประมวลผลสำเร็จจะได้ผลเดิมทันที (result.cached = true)
+    result.meta ส่งต่อเป็น meta ของ /api/insert_document ได้เลย
     Returns a normalized JSON suitable for the Next.js frontend.
     """
     try:
-        # Validate
-        if not file or not file.filename or file.filename.strip() == "":
-            raise HTTPException(status_code=400, detail="No file uploaded or empty filename")
-
-        safe_name = os.path.basename(file.filename)
-        save_path = os.path.join(UPLOAD_DIR, safe_name)
-
-        # Persist to disk if downstream expects a path
-        content = await file.read()
-        validate_file_upload(file, content)
-        with open(save_path, "wb") as f:
-            f.write(content)
+        upload = await receive_upload(request)
 
         # Demo path when optional workflow modules aren't installed
-        if not WORKFLOW_AVAILABLE:
+        if not await workflow_ready():
             demo = {
-                "file": safe_name,
+                "file": upload.original_name,
                 "pages": {
                     "1": {
                         "title": "เดโม",
@@ -286,31 +614,15 @@ async def process_file(file: UploadFile = File(...)):
             return {"ok": True, "result": demo}
 
         # --- Real workflow ---
-        file_handler = FileHandler(save_path)
-        ocr_service = OCRService()
-        extractor = TransactionExtractor(ocr_service)
-
-        # Expecting dict like { page: text }
-        ocr_result = extractor.process_document(file_handler)
-
-        pages = {}
-        base = os.path.splitext(safe_name)[0]
-
-        for raw_page, text in ocr_result.items():
-            page = normalize_page_key(raw_page)
-
-            invoice = ex(text)
-            out = invoice.typhoon_extract()  # may return dict or {"json": {...}}
-            payload = out.get("json", out)
-
-            pred = prediction(payload).run()
-            finder = FindInvoiceCompany(input_json=pred, file_name=base, num=page)
-            verified = finder.invoice_company()
-            checked = check_condition(verified, file_name=base, num=page).check()
-
-            pages[str(page)] = checked
-
-        return JSONResponse({"ok": True, "result": {"file": safe_name, "pages": pages, "download_path": f"/download/{safe_name}"}})
+        # ประมวลผลหลายหน้าพร้อมกัน ผลเรียงตามเลขหน้า หน้าที่พังจะอยู่ใน errors
+        # แบบ async: รอ OCR/LLM บน event loop ไม่กิน thread ต่อหน้า (จำกัด request พร้อมกันด้วย semaphore กลาง)
+        # แบบ thread: รันใน thread แยกเพื่อไม่ให้ event loop ค้าง
+        if PIPELINE_ASYNC:
+            result = await arun_pipeline(upload, bypass_cache=bypass_cache, timings=timings)
+        else:
+            result = await asyncio.to_thread(run_pipeline, upload, bypass_cache=bypass_cache, timings=timings)
+
+        return JSONResponse({"ok": True, "result": result})
 
     except HTTPException:
         raise
@@ -0,0 +1,245 @@
+import os, io, asyncio, zipfile, mimetypes
+from typing import Any, Dict, List, Optional
+
+from prepro import FileHandler
+from pipeline import DocumentPipeline, split_page_results, known_result, remember_result
+from concurrency import aordered_map
+from metrics import measure
+from upload_store import HashingWriter, UploadTooLarge, download_path
+import model_registry
+
+# ---- Settings ----
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "100"))
+BATCH_MAX_TOTAL_BYTES = int(os.getenv("BATCH_MAX_TOTAL_BYTES", str(300 * 1024 * 1024)))  # 300MB
+# จำนวนหน้า (รวมทุกไฟล์ใน batch) ที่อยู่ระหว่าง OCR/extraction พร้อมกัน
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "16"))
+# classify หน้าที่ extract เสร็จแล้วทีละกี่หน้า (ไม่ต้องรอให้ครบทุกหน้าของ batch)
+BATCH_CLASSIFY_CHUNK = int(os.getenv("BATCH_CLASSIFY_CHUNK", "32"))
+# อ่านไฟล์ที่อัปโหลด/ไฟล์ใน ZIP ทีละกี่ byte
+BATCH_READ_CHUNK = 1024 * 1024
+
+BATCH_EXTENSIONS = {".pdf", ".jpg", ".jpeg", ".png"}
+ZIP_MIME = {"application/zip", "application/x-zip-compressed"}
+
+
+def is_zip(name: str, content_type: Optional[str] = None) -> bool:
+    return (content_type or "") in ZIP_MIME or os.path.splitext(name or "")[1].lower() == ".zip"
+
+
+class BatchProcessor:
+    """
+    ประมวลผลหลายไฟล์ใน request เดียว
+    - add_file(): รับไฟล์ทีละไฟล์จาก file object (ZIP จะถูกแตกเป็นไฟล์ข้างใน) เขียนลงดิสก์ทีละ chunk
+      พร้อมตรวจขนาดต่อไฟล์และขนาดรวมของ batch ระหว่างอ่าน ไฟล์ที่เนื้อหาเหมือนกัน (SHA-256) ทำครั้งเดียว
+    - run(): ไฟล์ที่เคยประมวลผลสำเร็จแล้ว (known_result) ใช้ผลเดิมเหมือน /api/process ไม่เข้าคิว OCR
+      ที่เหลือ OCR/extraction ทุกหน้าของทุกไฟล์ผ่าน pool เดียวกัน (สูงสุด max_workers หน้าพร้อมกัน)
+      แล้ว classify ด้วย model_registry.classify_batch ทีละ classify_chunk หน้าตามลำดับที่เสร็จ
+      ก่อนตรวจบริษัท/เงื่อนไขรายหน้า
+    ผลรวมเป็น dict ตามชื่อไฟล์ที่อัปโหลด (ชื่อซ้ำได้ key เป็น "x (2).pdf" แต่ meta.original_name เป็นชื่อจริง)
+    """
+
+    def __init__(self, upload_dir: str, max_bytes: int, on_event=None, bypass_cache: bool = False,
+                 max_workers: int = BATCH_WORKERS, max_files: int = BATCH_MAX_FILES,
+                 max_total_bytes: int = BATCH_MAX_TOTAL_BYTES, classify_chunk: int = BATCH_CLASSIFY_CHUNK):
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.on_event = on_event
+        self.bypass_cache = bypass_cache
+        self.max_workers = max_workers
+        self.max_files = max_files
+        self.max_total_bytes = max_total_bytes
+        self.classify_chunk = max(1, classify_chunk)
+        self.entries: List[Dict[str, Any]] = []   # ทุกไฟล์ตามลำดับที่ส่งมา (รวมไฟล์ซ้ำ)
+        self.unique: Dict[str, Dict[str, Any]] = {}  # sha256 -> ไฟล์แรกที่มีเนื้อหานี้
+        self.skipped: List[Dict[str, str]] = []
+        self._total_bytes = 0
+
+    def _emit(self, event: Dict[str, Any]):
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(event)
+        except Exception as e:
+            print("[BATCH] on_event error:", e)
+
+    def add(self, name: str, content: bytes, content_type: Optional[str] = None):
+        """add_file สำหรับข้อมูลที่อยู่ในหน่วยความจำอยู่แล้ว"""
+        self.add_file(name, io.BytesIO(content), content_type)
+
+    def add_file(self, name: str, fileobj, content_type: Optional[str] = None):
+        """
+        เพิ่มไฟล์ที่อัปโหลด (หรือ ZIP) เข้า batch จาก file object (เช่น UploadFile.file ที่ spool ลงดิสก์)
+        ValueError ถ้าเกินขีดจำกัด — ตรวจระหว่างอ่าน จึงไม่ต้องอ่านทั้งไฟล์เข้าหน่วยความจำก่อน
+        """
+        if is_zip(name, content_type):
+            self._add_zip(name, fileobj)
+        else:
+            self._add_stream(os.path.basename(name or ""), fileobj)
+
+    def _add_zip(self, name: str, fileobj):
+        try:
+            # ZipFile อ่านจาก file object ตรง ๆ (seek ไปที่ central directory) ไม่ต้องโหลดทั้ง ZIP
+            archive = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipFile:
+            raise ValueError(f"{name}: invalid ZIP archive")
+        with archive:
+            for info in archive.infolist():
+                member = os.path.basename(info.filename)
+                if info.is_dir() or not member or member.startswith(".") or info.filename.startswith("__MACOSX/"):
+                    continue
+                if os.path.splitext(member)[1].lower() not in BATCH_EXTENSIONS:
+                    self.skipped.append({"file": f"{name}/{info.filename}", "reason": "unsupported type"})
+                    continue
+                # ไม่เชื่อขนาดใน header ของ ZIP — _add_stream นับ byte ที่แตกออกมาจริง
+                with archive.open(info) as f:
+                    self._add_stream(member, f)
+
+    def _copy(self, name: str, fileobj):
+        """เขียน fileobj ลง HashingWriter ทีละ chunk — หยุดทันทีที่เกินขนาดต่อไฟล์หรือขนาดรวมของ batch"""
+        writer = HashingWriter(self.upload_dir, self.max_bytes)
+        try:
+            for chunk in iter(lambda: fileobj.read(BATCH_READ_CHUNK), b""):
+                writer.write(chunk)
+                if self._total_bytes + writer.size > self.max_total_bytes:
+                    raise ValueError("Batch too large")
+        except UploadTooLarge:
+            writer.discard()
+            raise ValueError(f"{name}: file too large")
+        except BaseException:
+            writer.discard()
+            raise
+        self._total_bytes += writer.size
+        return writer.commit(name, mimetypes.guess_type(name)[0] or "application/octet-stream")
+
+    def _add_stream(self, name: str, fileobj):
+        if not name:
+            raise ValueError("No file uploaded or empty filename")
+        if os.path.splitext(name)[1].lower() not in BATCH_EXTENSIONS:
+            self.skipped.append({"file": name, "reason": "unsupported type"})
+            return
+        if len(self.entries) >= self.max_files:
+            raise ValueError(f"Too many files (max {self.max_files})")
+
+        key = name
+        n = 2
+        while any(e["key"] == key for e in self.entries):
+            base, ext = os.path.splitext(name)
+            key = f"{base} ({n}){ext}"
+            n += 1
+
+        # เก็บแบบ content-addressed (<sha256><ext>) — hash ไปพร้อมกับเขียน ไฟล์ชื่อซ้ำไม่ทับกัน
+        upload = self._copy(name, fileobj)
+        first = self.unique.get(upload.sha256)
+        entry = {"key": key, "name": name, "sha256": upload.sha256, "duplicate_of": first["key"] if first else None}
+        self.entries.append(entry)
+        if first is None:
+            entry["saved_name"], entry["path"], entry["meta"] = upload.stored_name, upload.path, upload.meta()
+            self.unique[upload.sha256] = entry
+
+    def _iter_pages(self, pipelines: Dict[str, DocumentPipeline], file_errors: Dict[str, str]):
+        for sha, pipeline in pipelines.items():
+            try:
+                for item in pipeline.extractor.iter_pages(pipeline.file_handler):
+                    yield sha, item
+            except Exception as e:
+                # ไฟล์เสีย (เช่น PDF อ่านไม่ได้) ไม่ควรทำให้ทั้ง batch ล้ม
+                print(f"❌ Batch file {self.unique[sha]['key']} failed: {e}")
+                file_errors[sha] = str(e)
+
+    def _pipeline(self, entry: Dict[str, Any]) -> DocumentPipeline:
+        def on_event(event, key=entry["key"]):
+            self._emit({**event, "file": key})
+        return DocumentPipeline(FileHandler(entry["path"]), on_event=on_event, bypass_cache=self.bypass_cache)
+
+    def _classify(self, pipelines, parts) -> List[Dict[str, Any]]:
+        ok = [(sha, part) for sha, part in parts if part["ok"]]
+        preds = [None] * len(ok)
+        if ok:
+            try:
+                with measure("classify_batch"):
+                    preds = model_registry.classify_batch([part["payload"] for _, part in ok])
+            except Exception as e:
+                # classify ทีละหน้าแทน เพื่อให้ error ผูกกับหน้าที่พังจริง
+                print("[BATCH] classify_batch failed, falling back to per-page:", e)
+                preds = [None] * len(ok)
+        pred_of = {id(part): pred for (_, part), pred in zip(ok, preds)}
+        return [(sha, pipelines[sha].classify_page(part, pred_of.get(id(part)))) for sha, part in parts]
+
+    def _known_results(self) -> Dict[str, Dict[str, Any]]:
+        """ผลเดิมของไฟล์ใน batch ที่เคยประมวลผลสำเร็จแล้ว {sha256: pages}"""
+        if self.bypass_cache:
+            return {}
+        known = {sha: known_result(sha) for sha in self.unique}
+        return {sha: pages for sha, pages in known.items() if pages is not None}
+
+    @staticmethod
+    def _remember(outcome: Dict[str, tuple], shas):
+        # remember_result เก็บเฉพาะไฟล์ที่ทุกหน้าสำเร็จ
+        for sha in shas:
+            remember_result(sha, *outcome[sha])
+
+    async def run(self) -> Dict[str, Any]:
+        known = await asyncio.to_thread(self._known_results)
+        pipelines = {sha: self._pipeline(entry) for sha, entry in self.unique.items() if sha not in known}
+        self._emit({
+            "event": "start",
+            "files": [e["key"] for e in self.entries],
+            "unique": len(self.unique),
+            "cached": [self.unique[sha]["key"] for sha in known],
+            "skipped": self.skipped,
+        })
+
+        async def extract(item):
+            sha, page_item = item
+            return sha, await pipelines[sha].aextract_page(page_item)
+
+        file_errors: Dict[str, str] = {}
+        results, chunk = [], []
+        async for part in aordered_map(extract, self._iter_pages(pipelines, file_errors), max_pending=self.max_workers):
+            chunk.append(part)
+            if len(chunk) >= self.classify_chunk:
+                # หน้าที่ค้างใน aordered_map ยัง OCR/extract ต่อระหว่าง classify ชุดนี้
+                results += await asyncio.to_thread(self._classify, pipelines, chunk)
+                chunk = []
+        if chunk:
+            results += await asyncio.to_thread(self._classify, pipelines, chunk)
+
+        by_file: Dict[str, List[Dict[str, Any]]] = {sha: [] for sha in pipelines}
+        for sha, res in results:
+            by_file[sha].append(res)
+
+        outcome = {sha: (pages, []) for sha, pages in known.items()}
+        for sha, page_results in by_file.items():
+            pages, errors = split_page_results(page_results)
+            if sha in file_errors:
+                errors.insert(0, {"page": None, "stage": "rasterise", "error": file_errors[sha]})
+            outcome[sha] = (pages, errors)
+        await asyncio.to_thread(self._remember, outcome, list(by_file))
+
+        files = {}
+        for entry in self.entries:
+            first = self.unique[entry["sha256"]]
+            pages, errors = outcome[entry["sha256"]]
+            files[entry["key"]] = {
+                "file": entry["key"],
+                "sha256": entry["sha256"],
+                "duplicate_of": entry["duplicate_of"],
+                "meta": {**first["meta"], "original_name": entry["name"]},
+                "cached": entry["sha256"] in known,
+                "pages": pages,
+                "errors": errors,
+                "download_path": download_path(first["saved_name"], entry["name"]),
+            }
+            self._emit({"event": "file", "file": entry["key"], "result": files[entry["key"]]})
+
+        return {
+            "files": files,
+            "skipped": self.skipped,
+            "stats": {
+                "files": len(self.entries),
+                "unique": len(self.unique),
+                "cached": len(known),
+                "pages": len(results),
+                "failed_pages": sum(1 for _, r in results if not r["ok"]),
+            },
+        }
@@ -0,0 +1,83 @@
+"""
+วัดเวลา import ของ app ด้วย python -X importtime ใน process ใหม่ (cold import)
+    python benchmarks/import_time.py [--module app] [--top 25] [--json] [--budget-ms 2000]
+- แสดงโมดูลที่ใช้เวลารวม (cumulative) มากที่สุด
+- เตือนถ้าโมดูลหนักของ workflow ถูก import ตอนโหลด app (ควรโหลดใน background เท่านั้น)
+- exit code 1 ถ้าเกิน --budget-ms หรือเจอโมดูลหนัก (ใช้ใน CI ได้)
+"""
+import os, re, sys, json, time, argparse, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# โมดูลที่ต้องไม่ถูก import ตอน import app (ดู load_workflow ใน app.py)
+HEAVY_MODULES = [
+    "typhoon_ocr", "openai", "cv2", "pdf2image", "pythainlp", "gensim", "sklearn", "rapidfuzz", "joblib",
+]
+
+LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def profile(module: str = "app", python: str = sys.executable):
+    """รัน import ใน subprocess แล้วคืน (wall seconds, รายการ dict ของแต่ละโมดูล)"""
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - started
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = LINE_RE.match(line)
+        if m:
+            rows.append({
+                "module": m.group(4),
+                "self_us": int(m.group(1)),
+                "cumulative_us": int(m.group(2)),
+                "depth": len(m.group(3)) // 2,
+            })
+    return wall, rows
+
+
+def report(module: str, top: int, budget_ms: float = None, as_json: bool = False) -> int:
+    wall, rows = profile(module)
+    target = next((r for r in rows if r["module"] == module), None)
+    total_ms = target["cumulative_us"] / 1000 if target else None
+    loaded = {r["module"].split(".")[0] for r in rows}
+    heavy = [m for m in HEAVY_MODULES if m in loaded]
+    slowest = sorted(rows, key=lambda r: r["cumulative_us"], reverse=True)[:top]
+
+    if as_json:
+        print(json.dumps({
+            "module": module,
+            "wall_seconds": round(wall, 3),
+            "import_ms": total_ms,
+            "modules": len(rows),
+            "heavy_modules": heavy,
+            "slowest": slowest,
+        }, ensure_ascii=False, indent=2))
+    else:
+        print(f"import {module}: {total_ms} ms ({len(rows)} modules, process wall {wall:.2f}s)")
+        print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for r in slowest:
+            print(f"{r['cumulative_us'] / 1000:14.1f} {r['self_us'] / 1000:9.1f}  {'  ' * r['depth']}{r['module']}")
+        if heavy:
+            print("⚠️  heavy workflow modules imported eagerly:", ", ".join(heavy))
+
+    failed = bool(heavy)
+    if budget_ms is not None and total_ms is not None and total_ms > budget_ms:
+        print(f"❌ import {module} took {total_ms} ms (budget {budget_ms} ms)")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile cold import time of the service")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    sys.exit(report(args.module, args.top, args.budget_ms, args.json))
@@ -0,0 +1,128 @@
+"""
+microbenchmark ของส่วนที่ใช้ CPU ใน pipeline (ไม่เรียก API)
+    python benchmarks/microbench.py [--only preprocess,sentence_vector,check_condition] [--repeat 3] [--json]
+- preprocess: ImageProcessor.preprocess_image (เขียนไฟล์) และ preprocess_to_png (ในหน่วยความจำ) กับ output/*.png
+- sentence_vector: prediction.sentence_vector แบบไม่มี cache / มี cache และ sentence_vectors ทั้งชุด
+  ประโยคมาจาก title/seller/ชื่อรายการใน json/*.json (ต้องมีโมเดลใน MODEL_DIR)
+- check_condition: check_condition(...).check() กับ json/*.json (เขียนผลลง ./json ของโฟลเดอร์ชั่วคราว)
+"""
+import os, sys, json, glob, math, time, argparse, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCHMARKS = ("preprocess", "sentence_vector", "check_condition")
+
+
+def measure(name, fn, inputs, repeat: int):
+    """เรียก fn(x) กับทุก x ใน inputs ซ้ำ repeat รอบ คืนสถิติต่อการเรียกหนึ่งครั้ง"""
+    from metrics import current_rss_bytes
+    times = []
+    rss_before = current_rss_bytes()
+    for _ in range(repeat):
+        for x in inputs:
+            started = time.perf_counter()
+            fn(x)
+            times.append(time.perf_counter() - started)
+    times.sort()
+    total = sum(times)
+    return {
+        "name": name,
+        "calls": len(times),
+        "ops_per_second": round(len(times) / total, 2) if total else None,
+        "mean_ms": round(total / len(times) * 1000, 3),
+        "p50_ms": round(times[max(0, math.ceil(0.5 * len(times)) - 1)] * 1000, 3),
+        "p95_ms": round(times[max(0, math.ceil(0.95 * len(times)) - 1)] * 1000, 3),
+        "rss_delta_bytes": (current_rss_bytes() or 0) - (rss_before or 0),
+    }
+
+
+def load_documents():
+    docs = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "json", "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            docs.append(json.load(f))
+    return docs
+
+
+def bench_preprocess(repeat: int):
+    from prepro import ImageProcessor
+    images = sorted(glob.glob(os.path.join(ROOT, "output", "*.png")))
+    out_path = os.path.join(tempfile.mkdtemp(prefix="bench_"), "pre.png")
+    return [
+        measure("preprocess_image", lambda p: ImageProcessor.preprocess_image(p, out_path), images, repeat),
+        measure("preprocess_to_png", ImageProcessor.preprocess_to_png, images, repeat),
+    ]
+
+
+def bench_sentence_vector(repeat: int):
+    import model_registry
+    from predict_category import prediction
+    from embeddings import sentence_cache
+
+    sentences = []
+    for doc in load_documents():
+        sentences += [doc.get("title"), doc.get("seller")] + [it.get("name") for it in doc.get("items") or []]
+    sentences = [s for s in dict.fromkeys(sentences) if s]
+    pred = prediction(None, models=model_registry.registry.get())
+
+    maxsize = sentence_cache.maxsize
+    sentence_cache.maxsize = 0  # put() ไม่เก็บ = วัดแบบไม่มี cache
+    try:
+        cold = measure("sentence_vector (no cache)", pred.sentence_vector, sentences, repeat)
+        batch = measure("sentence_vectors (batch, no cache)", pred.sentence_vectors, [sentences], repeat)
+    finally:
+        sentence_cache.maxsize = maxsize
+    for s in sentences:
+        pred.sentence_vector(s)
+    warm = measure("sentence_vector (cached)", pred.sentence_vector, sentences, repeat)
+    return [cold, batch, warm]
+
+
+def bench_check_condition(repeat: int):
+    from condition import check_condition
+    docs = load_documents()
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    os.makedirs(os.path.join(workdir, "json"))
+    os.chdir(workdir)
+    try:
+        # check() แก้ dict ที่ส่งเข้าไป จึงสร้างสำเนาใหม่ทุกครั้ง (เวลาที่รายงานรวม json.loads ด้วย)
+        return [measure(
+            "check_condition", lambda d: check_condition(json.loads(d), file_name="bench", num=1).check(),
+            [json.dumps(d, ensure_ascii=False) for d in docs], repeat,
+        )]
+    finally:
+        os.chdir(cwd)
+
+
+def main(args) -> int:
+    selected = [b.strip() for b in args.only.split(",")]
+    results, failed = [], False
+    for name in selected:
+        fn = globals().get(f"bench_{name}")
+        if fn is None or name not in BENCHMARKS:
+            print(f"unknown benchmark {name} (choose from {', '.join(BENCHMARKS)})")
+            return 1
+        try:
+            results += fn(args.repeat)
+        except Exception as e:
+            print(f"❌ {name} failed: {e!r}")
+            failed = True
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(f"{'benchmark':<36} {'calls':>6} {'ops/s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'RSS +MB':>8}")
+        for r in results:
+            print(f"{r['name']:<36} {r['calls']:>6} {r['ops_per_second'] or 0:>9.2f} {r['mean_ms']:>9.3f} "
+                  f"{r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} {r['rss_delta_bytes'] / 2 ** 20:>8.1f}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks for CPU-bound pipeline stages")
+    parser.add_argument("--only", default=",".join(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,256 @@
+"""
+Typhoon OCR/LLM ปลอมสำหรับ benchmark แบบ offline (ไม่เสีย quota)
+    python benchmarks/mock_typhoon.py --port 8765 --ocr-latency-ms 800 --extract-latency-ms 300
+    TYPHOON_BASE_URL=http://127.0.0.1:8765/v1 uvicorn app:app
+- ตอบ POST /v1/chat/completions ในรูปแบบเดียวกับ OpenAI chat completions
+- request ที่มีภาพ = OCR: ตอบ {"natural_text": markdown} ของเอกสารตัวอย่างใน json/*.json
+  (ใช้ไฟล์ <ชื่อ>.md ใน --markdown-dir ถ้ามี ไม่งั้นสร้าง markdown จาก field ของเอกสาร)
+- request ข้อความ = extraction: ตอบ JSON ของ field ที่ LLM ต้องดึง ของเอกสารที่ markdown ตรงกับใน prompt
+- หน่วงเวลาตาม --*-latency-ms (+ jitter) และสุ่มตอบ 503 ตาม --error-rate ได้
+"""
+import os, sys, json, time, base64, random, hashlib, argparse, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# field ที่ prompt ของ extraction.InvoiceExtractor ขอจาก LLM
+LLM_FIELDS = (
+    "title", "invoice_type", "seller", "seller_address", "buyer", "buyer_address", "tax_id", "date",
+    "invoice_no", "items", "subtotal", "vat", "total", "amount_text", "warranty_period", "name_company",
+)
+
+
+def _address(addr) -> str:
+    if not isinstance(addr, dict):
+        return addr or ""
+    return " ".join(str(v) for v in addr.values() if v)
+
+
+def render_markdown(doc: dict) -> str:
+    """สร้าง markdown แบบที่ OCR น่าจะได้จาก field ของเอกสาร (ใช้เมื่อไม่มี markdown ที่บันทึกไว้)"""
+    date = doc.get("date") or {}
+    lines = [f"# {doc.get('title') or 'ใบเสร็จรับเงิน'}", ""]
+    if doc.get("seller"):
+        lines.append(f"**{doc['seller']}**")
+    if doc.get("seller_address"):
+        lines.append(_address(doc["seller_address"]))
+    if doc.get("tax_id"):
+        lines.append(f"เลขประจำตัวผู้เสียภาษี {doc['tax_id']}")
+    if doc.get("invoice_no"):
+        lines.append(f"เลขที่ {doc['invoice_no']}")
+    if date.get("day"):
+        lines.append(f"วันที่ {date.get('day')}/{date.get('month')}/{date.get('year')}")
+    if doc.get("buyer"):
+        lines.append(f"ชื่อลูกค้า {doc['buyer']} {_address(doc.get('buyer_address'))}".rstrip())
+    items = doc.get("items") or []
+    if items:
+        lines += ["", "| รายการ | จำนวน | ราคาต่อหน่วย | จำนวนเงิน |", "|---|---|---|---|"]
+        for it in items:
+            lines.append(
+                f"| {it.get('name') or ''} | {it.get('quantity') or ''} | {it.get('unit_price') or ''} | {it.get('total_price') or ''} |"
+            )
+    lines.append("")
+    for label, key in (("รวมเงิน", "subtotal"), ("ภาษีมูลค่าเพิ่ม", "vat"), ("รวมทั้งสิ้น", "total")):
+        if doc.get(key) is not None:
+            lines.append(f"{label} {doc[key]}")
+    if doc.get("amount_text"):
+        lines.append(f"({doc['amount_text']})")
+    return "\n".join(lines)
+
+
+class Fixture:
+    def __init__(self, name: str, doc: dict, markdown: str):
+        self.name = name
+        self.doc = doc
+        self.markdown = markdown
+        self.extraction = json.dumps({k: doc.get(k) for k in LLM_FIELDS}, ensure_ascii=False)
+
+
+def load_fixtures(json_dir: str = os.path.join(ROOT, "json"), markdown_dir: str = None):
+    """เอกสารตัวอย่างทั้งหมดใน json_dir (เรียงตามชื่อไฟล์)"""
+    fixtures = []
+    for fname in sorted(os.listdir(json_dir)):
+        if not fname.endswith(".json"):
+            continue
+        name = fname[:-len(".json")]
+        with open(os.path.join(json_dir, fname), encoding="utf-8") as f:
+            doc = json.load(f)
+        md_path = os.path.join(markdown_dir, name + ".md") if markdown_dir else None
+        if md_path and os.path.exists(md_path):
+            with open(md_path, encoding="utf-8") as f:
+                markdown = f.read()
+        else:
+            markdown = render_markdown(doc)
+        fixtures.append(Fixture(name, doc, markdown))
+    if not fixtures:
+        raise ValueError(f"no fixtures in {json_dir}")
+    return fixtures
+
+
+def fixture_name(png_name: str) -> str:
+    """ชื่อ fixture ของภาพตัวอย่าง: output/<doc>_page_<n>.png -> json/<doc>_output_page_<n>.json"""
+    base = os.path.splitext(os.path.basename(png_name))[0]
+    doc, _, page = base.rpartition("_page_")
+    return f"{doc}_output_page_{page}"
+
+
+def _image_bytes(messages) -> bytes:
+    for msg in messages:
+        content = msg.get("content")
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if part.get("type") == "image_url":
+                url = part["image_url"]["url"]
+                return base64.b64decode(url.split(",", 1)[1])
+    return None
+
+
+def _prompt_text(messages) -> str:
+    parts = []
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts += [p.get("text", "") for p in content if p.get("type") == "text"]
+    return "\n".join(parts)
+
+
+class MockTyphoon:
+    """
+    server ปลอมที่รันใน thread (ใช้ใน benchmark) หรือ process แยก (main ด้านล่าง)
+    bind(sha256 ของ PNG, ชื่อ fixture) ผูกภาพที่ pipeline ส่งมากับเอกสารตัวอย่าง
+    ภาพที่ไม่ได้ผูกจะได้ fixture ตาม hash ของภาพ (คงที่ทุกครั้ง)
+    """
+
+    def __init__(self, fixtures, host: str = "127.0.0.1", port: int = 0,
+                 ocr_latency: float = 0.8, extract_latency: float = 0.3, jitter: float = 0.2,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.fixtures = fixtures
+        self.by_name = {fx.name: fx for fx in fixtures}
+        self.by_image = {}
+        self.latency = {"ocr": ocr_latency, "extract": extract_latency}
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = {"ocr": 0, "extract": 0, "errors": 0}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def bind(self, png_sha256: str, name: str):
+        self.by_image[png_sha256] = self.by_name[name]
+
+    def _fixture_for_image(self, image: bytes) -> Fixture:
+        sha = hashlib.sha256(image).hexdigest()
+        return self.by_image.get(sha) or self.fixtures[int(sha, 16) % len(self.fixtures)]
+
+    def _fixture_for_prompt(self, prompt: str) -> Fixture:
+        # markdown ยาวสุดก่อน เผื่อเอกสารหนึ่งเป็นส่วนหนึ่งของอีกเอกสาร
+        for fx in sorted(self.fixtures, key=lambda f: len(f.markdown), reverse=True):
+            if fx.markdown in prompt:
+                return fx
+        return self.fixtures[int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16) % len(self.fixtures)]
+
+    def respond(self, body: dict):
+        """คืน (status, dict) ของ request หนึ่งครั้ง (หน่วงเวลาแล้ว)"""
+        messages = body.get("messages") or []
+        image = _image_bytes(messages)
+        kind = "ocr" if image is not None else "extract"
+        with self._lock:
+            self.requests[kind] += 1
+            failed = self._random.random() < self.error_rate
+            delay = self.latency[kind] * (1 + self._random.uniform(-self.jitter, self.jitter))
+        time.sleep(max(0.0, delay))
+        if failed:
+            with self._lock:
+                self.requests["errors"] += 1
+            return 503, {"error": {"message": "mock overloaded", "type": "server_error"}}
+
+        if kind == "ocr":
+            content = json.dumps({"natural_text": self._fixture_for_image(image).markdown}, ensure_ascii=False)
+        else:
+            content = self._fixture_for_prompt(_prompt_text(messages)).extraction
+        return 200, {
+            "id": f"mock-{kind}-{self.requests[kind]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive เหมือน API จริง
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    return self._send(400, {"error": {"message": "invalid JSON"}})
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    return self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+                self._send(*mock.respond(body))
+
+            def _send(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "MockTyphoon":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-typhoon", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def add_latency_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--ocr-latency-ms", type=float, default=800)
+    parser.add_argument("--extract-latency-ms", type=float, default=300)
+    parser.add_argument("--jitter", type=float, default=0.2, help="สัดส่วนความคลาดเคลื่อนของเวลาหน่วง (0.2 = ±20%%)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="สัดส่วน request ที่ตอบ 503")
+    parser.add_argument("--markdown-dir", default=None, help="โฟลเดอร์ markdown จาก OCR จริง (<ชื่อ fixture>.md)")
+
+
+def from_args(args, port: int = 0) -> MockTyphoon:
+    return MockTyphoon(
+        load_fixtures(markdown_dir=args.markdown_dir), port=port,
+        ocr_latency=args.ocr_latency_ms / 1000, extract_latency=args.extract_latency_ms / 1000,
+        jitter=args.jitter, error_rate=args.error_rate,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Typhoon OCR/LLM API")
+    parser.add_argument("--port", type=int, default=8765)
+    add_latency_args(parser)
+    args = parser.parse_args()
+    mock = from_args(args, port=args.port)
+    print(f"mock Typhoon on {mock.base_url} ({len(mock.fixtures)} fixtures) — set TYPHOON_BASE_URL to this")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
@@ -0,0 +1,206 @@
+"""
+วัด throughput ของ pipeline แบบ offline กับ Typhoon ปลอม (benchmarks/mock_typhoon.py)
+    python benchmarks/pipeline_throughput.py [--modes serial,threads,async] [--workers 8] [--repeat 3]
+                                            [--ocr-latency-ms 800] [--extract-latency-ms 300] [--no-classify] [--json]
+- เอกสารตัวอย่าง = output/*.png (OCR/LLM ตอบด้วยข้อมูลของ json/*.json ที่ชื่อตรงกัน)
+- serial: ทีละเอกสาร ทีละหน้า / threads: --workers เอกสารพร้อมกันผ่าน thread pool (เหมือน PIPELINE_ASYNC=0)
+  async: --workers เอกสารพร้อมกันบน event loop เดียว (เหมือน PIPELINE_ASYNC=1)
+- แต่ละ mode รันใน process ใหม่ (หน่วยความจำไม่ปนกัน) ปิด result cache และ rate limiter
+- รายงาน pages/sec, latency ต่อหน้า/ต่อเอกสาร (p50/p95) และ RSS (หลัง warm up / สูงสุด)
+"""
+import os, sys, json, glob, math, time, asyncio, argparse, tempfile, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_typhoon import add_latency_args, from_args, fixture_name
+
+MODES = ("serial", "threads", "async")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def page_latency_of(page):
+    """เวลาของหน้าจาก timings (--no-classify ได้แค่ผลครึ่งแรกของหน้า ซึ่งยังไม่มี timings รวม จึงใช้ผลรวมราย stage)"""
+    if page.get("timings"):
+        return page["timings"]["wall_seconds"]
+    stages = (page.get("state") or {}).get("timings")
+    return sum(t["wall_seconds"] for t in stages.values()) if stages else None
+
+
+# ---- child: รันใน process ที่ตั้ง TYPHOON_BASE_URL ไปที่ mock แล้ว ----
+
+def run_mode(mode: str, paths, workers: int, classify: bool):
+    from prepro import FileHandler
+    from pipeline import DocumentPipeline
+    from concurrency import ordered_map, aordered_map
+    from metrics import current_rss_bytes, peak_rss_bytes
+    import model_registry
+
+    if classify:
+        model_registry.warm_up()
+
+    def pipeline(path, max_workers):
+        return DocumentPipeline(FileHandler(path), max_workers=max_workers)
+
+    def process(path, max_workers=1):
+        started = time.perf_counter()
+        p = pipeline(path, max_workers)
+        if classify:
+            pages = p.run()
+        else:
+            pages = list(ordered_map(p.extract_page, p.extractor.iter_pages(p.file_handler), max_workers=max_workers))
+        return time.perf_counter() - started, pages
+
+    async def aprocess(path):
+        started = time.perf_counter()
+        p = pipeline(path, workers)
+        if classify:
+            pages = await p.arun()
+        else:
+            pages = [r async for r in aordered_map(p.aextract_page, p.extractor.iter_pages(p.file_handler), max_pending=workers)]
+        return time.perf_counter() - started, pages
+
+    async def arun_all():
+        sem = asyncio.Semaphore(workers)
+
+        async def one(path):
+            async with sem:
+                return await aprocess(path)
+        return await asyncio.gather(*(one(path) for path in paths))
+
+    rss_before = current_rss_bytes()
+    started = time.perf_counter()
+    if mode == "serial":
+        docs = [process(path) for path in paths]
+    elif mode == "threads":
+        docs = list(ordered_map(process, paths, max_workers=workers))
+    elif mode == "async":
+        docs = asyncio.run(arun_all())
+    else:
+        raise ValueError(f"unknown mode {mode}")
+    wall = time.perf_counter() - started
+
+    pages = [page for _, doc in docs for page in doc]
+    page_latency = [lat for lat in map(page_latency_of, pages) if lat is not None]
+    failed = [page for page in pages if not page["ok"]]
+    return {
+        "mode": mode,
+        "workers": 1 if mode == "serial" else workers,
+        "documents": len(docs),
+        "pages": len(pages),
+        "failed_pages": len(failed),
+        "first_error": f"{failed[0]['stage']}: {failed[0]['error']}" if failed else None,
+        "wall_seconds": round(wall, 3),
+        "pages_per_second": round(len(pages) / wall, 3) if wall else None,
+        "page_latency_p50": percentile(page_latency, 0.5),
+        "page_latency_p95": percentile(page_latency, 0.95),
+        "document_latency_p95": percentile([lat for lat, _ in docs], 0.95),
+        "rss_before_bytes": rss_before,
+        "rss_after_bytes": current_rss_bytes(),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+# ---- parent: เปิด mock แล้วรันแต่ละ mode ใน subprocess ----
+
+def bind_fixtures(mock, paths):
+    """ผูก PNG หลัง preprocess ของแต่ละภาพกับ fixture ที่ชื่อตรงกัน (ภาพที่ไม่มี fixture ใช้ตาม hash)"""
+    import hashlib
+    from prepro import ImageProcessor
+    for path in paths:
+        name = fixture_name(path)
+        if name in mock.by_name:
+            png, _ = ImageProcessor.preprocess_to_png(path)
+            mock.bind(hashlib.sha256(png).hexdigest(), name)
+
+
+def spawn(mode: str, args, base_url: str, paths):
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    os.makedirs(os.path.join(workdir, "json"))  # check_condition เขียนผลลง ./json
+    env = {
+        **os.environ,
+        "TYPHOON_BASE_URL": base_url,
+        "TYPHOON_OCR_API_KEY": "mock",
+        "HOST_RATE_LIMIT": str(args.rate_limit),
+        "RESULT_CACHE_ENABLED": "0",
+        "CACHE_DIR": os.path.join(workdir, "cache"),
+        "LOCAL_EXTRACTION": "1" if args.local_extraction else "0",
+        "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])),
+    }
+    cmd = [
+        sys.executable, os.path.abspath(__file__), "--child", mode, "--workers", str(args.workers),
+        "--paths-json", json.dumps(paths),
+    ] + (["--no-classify"] if args.no_classify else [])
+    proc = subprocess.run(cmd, cwd=workdir, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        # returncode -9 มักเป็น OOM killer — ลด --workers
+        raise RuntimeError(f"{mode} failed (exit {proc.returncode}):\n{proc.stderr[-3000:]}")
+    # บรรทัดสุดท้ายของ stdout คือผล (ก่อนหน้าเป็น print ของ pipeline)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _fmt(v, scale=1.0, digits=3):
+    return "-" if v is None else f"{v / scale:.{digits}f}"
+
+
+def main(args) -> int:
+    paths = sorted(glob.glob(args.inputs))
+    if not paths:
+        print(f"no input files match {args.inputs}")
+        return 1
+    paths = paths * args.repeat
+
+    mock = from_args(args).start()
+    try:
+        bind_fixtures(mock, sorted(set(paths)))
+        results = []
+        for mode in args.modes.split(","):
+            before = dict(mock.requests)
+            res = spawn(mode.strip(), args, mock.base_url, paths)
+            res["mock_requests"] = {k: v - before[k] for k, v in mock.requests.items()}
+            results.append(res)
+    finally:
+        mock.stop()
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return 0 if all(r["failed_pages"] == 0 for r in results) else 1
+
+    print(f"{len(paths)} documents, mock latency ocr {args.ocr_latency_ms}ms / extract {args.extract_latency_ms}ms")
+    print(f"{'mode':<8} {'workers':>7} {'pages':>6} {'failed':>6} {'pages/s':>8} {'page p50':>9} {'page p95':>9} "
+          f"{'doc p95':>8} {'RSS MB':>8} {'peak MB':>8}")
+    for r in results:
+        print(f"{r['mode']:<8} {r['workers']:>7} {r['pages']:>6} {r['failed_pages']:>6} {_fmt(r['pages_per_second'], digits=2):>8} "
+              f"{_fmt(r['page_latency_p50']):>9} {_fmt(r['page_latency_p95']):>9} {_fmt(r['document_latency_p95']):>8} "
+              f"{_fmt(r['rss_after_bytes'], 2 ** 20, 1):>8} {_fmt(r['peak_rss_bytes'], 2 ** 20, 1):>8}")
+        if r["first_error"]:
+            print(f"   first error: {r['first_error']}")
+    return 0 if all(r["failed_pages"] == 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline pipeline throughput benchmark against a mock Typhoon API")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=1, help="ส่งชุดเอกสารตัวอย่างซ้ำกี่รอบ")
+    parser.add_argument("--inputs", default=os.path.join(ROOT, "output", "*.png"))
+    parser.add_argument("--no-classify", action="store_true", help="วัดแค่ OCR + extraction (ไม่โหลดโมเดลจัดหมวดหมู่)")
+    parser.add_argument("--local-extraction", action="store_true", help="เปิด LOCAL_EXTRACTION (ข้าม LLM เมื่อแม่แบบครบ)")
+    parser.add_argument("--rate-limit", type=float, default=0, help="HOST_RATE_LIMIT ของ child (0 = ไม่จำกัด)")
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--paths-json", default=None, help=argparse.SUPPRESS)
+    add_latency_args(parser)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_mode(args.child, json.loads(args.paths_json), args.workers, not args.no_classify)
+        print(json.dumps(result))
+        sys.exit(0)
+    sys.exit(main(args))
@@ -0,0 +1,257 @@
+"""
+วัดหน่วยความจำสูงสุดของ server ตอนรับไฟล์อัปโหลดขนาดใหญ่พร้อมกันหลายไฟล์
+    python benchmarks/upload_memory.py [--modes buffered,spooled,streaming] [--concurrency 8] [--size-mb 15] [--json]
+- buffered: UploadFile + await file.read() แล้วเขียนลงดิสก์ (แบบเดิมของ /api/process)
+- spooled: UploadFile (Starlette spool ลง temp file) แล้ว copy ทีละ chunk
+- streaming: อ่าน request.stream() ผ่าน upload_store.receive_multipart (แบบปัจจุบันของ /api/process)
+- แต่ละ mode รัน server (uvicorn) ใน process ใหม่ ส่ง --concurrency ไฟล์ PNG ขนาด --size-mb พร้อมกัน
+  แล้วส่งไฟล์ที่เกิน MAX_BYTES อีกชุดเพื่อดูว่าปฏิเสธ (413) ได้เร็วแค่ไหน
+- รายงาน RSS สูงสุดของ server ระหว่างแต่ละชุด (เทียบกับก่อนเริ่มชุด สุ่มวัดทุก 5ms) และ latency p50/p95
+"""
+import os, sys, json, math, time, socket, argparse, tempfile, subprocess, http.client
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ("buffered", "spooled", "streaming")
+MAX_BYTES = 15 * 1024 * 1024  # เท่ากับ app.MAX_BYTES
+ALLOWED_MIME = {"application/pdf", "image/jpeg", "image/png"}
+BOUNDARY = "benchmarkboundary7f3a"
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+# ---- child: server ที่มี endpoint เดียวตาม mode ----
+
+def serve(mode: str, port: int, upload_dir: str):
+    import asyncio, threading
+    import uvicorn
+    from fastapi import FastAPI, File, UploadFile, Request, HTTPException
+    from metrics import current_rss_bytes
+    from upload_store import receive_multipart, HashingWriter, UploadTooLarge, UnsupportedUpload
+
+    server = FastAPI()
+
+    if mode == "buffered":
+        def store(content, file):
+            writer = HashingWriter(upload_dir)
+            try:
+                writer.write(content)
+            except BaseException:
+                writer.discard()
+                raise
+            return writer.commit(file.filename, file.content_type)
+
+        @server.post("/upload")
+        async def upload(file: UploadFile = File(...)):
+            content = await file.read()
+            if len(content) > MAX_BYTES:
+                raise HTTPException(status_code=413, detail="File too large")
+            return (await asyncio.to_thread(store, content, file)).meta()
+    elif mode == "spooled":
+        def copy(file):
+            writer = HashingWriter(upload_dir, MAX_BYTES)
+            try:
+                for chunk in iter(lambda: file.file.read(1024 * 1024), b""):
+                    writer.write(chunk)
+            except UploadTooLarge:
+                writer.discard()
+                raise
+            return writer.commit(file.filename, file.content_type)
+
+        @server.post("/upload")
+        async def upload(file: UploadFile = File(...)):
+            try:
+                return (await asyncio.to_thread(copy, file)).meta()
+            except UploadTooLarge:
+                raise HTTPException(status_code=413, detail="File too large")
+    elif mode == "streaming":
+        @server.post("/upload")
+        async def upload(request: Request):
+            length = request.headers.get("content-length")
+            try:
+                stored = await receive_multipart(
+                    request.stream(), request.headers.get("content-type", ""), upload_dir, MAX_BYTES,
+                    allowed_mime=ALLOWED_MIME, content_length=int(length) if length else None,
+                    run_sync=asyncio.to_thread,
+                )
+            except UploadTooLarge:
+                raise HTTPException(status_code=413, detail="File too large")
+            except UnsupportedUpload as e:
+                raise HTTPException(status_code=415, detail=str(e))
+            return stored.meta()
+    else:
+        raise ValueError(f"unknown mode {mode}")
+
+    # ru_maxrss รวมช่วง import ตอน start ด้วย จึงสุ่มวัด RSS เองทุก 5ms แล้วเก็บค่าสูงสุดของแต่ละช่วง
+    window = {"peak": current_rss_bytes()}
+
+    def sample():
+        while True:
+            window["peak"] = max(window["peak"], current_rss_bytes())
+            time.sleep(0.005)
+    threading.Thread(target=sample, daemon=True).start()
+
+    @server.get("/rss")
+    def rss(reset: bool = False):
+        body = {"rss_bytes": current_rss_bytes(), "window_peak_rss_bytes": window["peak"]}
+        if reset:
+            window["peak"] = body["rss_bytes"]
+        return body
+
+    uvicorn.run(server, host="127.0.0.1", port=port, log_level="warning")
+
+
+# ---- parent: เปิด server แล้วยิง upload พร้อมกัน ----
+
+def multipart_body(size: int, seed: int) -> bytes:
+    # PNG signature + ข้อมูลสุ่ม (แต่ละไฟล์ต่างกัน ไม่ชนกันใน uploads/<sha256>)
+    content = b"\x89PNG\r\n\x1a\n" + seed.to_bytes(8, "big") + os.urandom(max(0, size - 16))
+    head = (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"bench_{seed}.png\"\r\n"
+        f"Content-Type: image/png\r\n\r\n"
+    ).encode()
+    return head + content + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def post(port: int, body: bytes):
+    """คืน (status หรือ None ถ้า server ตัด connection ก่อนส่งครบ, วินาที)"""
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    try:
+        conn.request("POST", "/upload", body=body, headers={
+            "Content-Type": f"multipart/form-data; boundary={BOUNDARY}",
+            "Content-Length": str(len(body)),
+        })
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status, time.perf_counter() - started
+    except (BrokenPipeError, ConnectionResetError):
+        return None, time.perf_counter() - started
+    finally:
+        conn.close()
+
+
+def get_json(port: int, path: str):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        conn.request("GET", path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(proc, port: int, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}")
+        try:
+            return get_json(port, "/rss")
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def burst(port: int, bodies):
+    with ThreadPoolExecutor(max_workers=len(bodies)) as pool:
+        started = time.perf_counter()
+        results = list(pool.map(lambda b: post(port, b), bodies))
+        wall = time.perf_counter() - started
+    latencies = [lat for _, lat in results]
+    statuses = {}
+    for status, _ in results:
+        key = str(status) if status is not None else "reset"
+        statuses[key] = statuses.get(key, 0) + 1
+    return {
+        "wall_seconds": round(wall, 3),
+        "latency_p50": round(percentile(latencies, 0.5), 3),
+        "latency_p95": round(percentile(latencies, 0.95), 3),
+        "statuses": statuses,
+    }
+
+
+def run_mode(mode: str, accept_bodies, reject_bodies):
+    port = free_port()
+    upload_dir = tempfile.mkdtemp(prefix="bench_uploads_")
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", mode, "--port", str(port), "--upload-dir", upload_dir]
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))}
+    proc = subprocess.Popen(cmd, env=env)
+    try:
+        wait_ready(proc, port)
+        baseline = get_json(port, "/rss?reset=true")
+        accepted = burst(port, accept_bodies)
+        after_accept = get_json(port, "/rss?reset=true")
+        rejected = burst(port, reject_bodies) if reject_bodies else None
+        after_reject = get_json(port, "/rss?reset=true")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+    return {
+        "mode": mode,
+        "concurrency": len(accept_bodies),
+        "baseline_rss_bytes": baseline["rss_bytes"],
+        "accept": {**accepted, "peak_rss_delta_bytes": after_accept["window_peak_rss_bytes"] - baseline["rss_bytes"]},
+        "reject": rejected and {
+            **rejected, "peak_rss_delta_bytes": after_reject["window_peak_rss_bytes"] - after_accept["rss_bytes"],
+        },
+        "peak_rss_bytes": max(after_accept["window_peak_rss_bytes"], after_reject["window_peak_rss_bytes"]),
+    }
+
+
+def _mb(v):
+    return "-" if v is None else f"{v / 2 ** 20:.1f}"
+
+
+def main(args) -> int:
+    size = int(args.size_mb * 1024 * 1024)
+    accept_bodies = [multipart_body(min(size, MAX_BYTES), i) for i in range(args.concurrency)]
+    reject_size = int(args.reject_mb * 1024 * 1024)
+    reject_bodies = [multipart_body(reject_size, 1000 + i) for i in range(args.concurrency)] if reject_size else []
+
+    results = [run_mode(mode.strip(), accept_bodies, reject_bodies) for mode in args.modes.split(",")]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"{args.concurrency} concurrent uploads of {min(size, MAX_BYTES) / 2 ** 20:.1f} MB"
+          + (f", then {args.concurrency} x {args.reject_mb} MB (over limit)" if reject_bodies else ""))
+    print(f"{'mode':<10} {'case':<7} {'wall s':>7} {'p50 s':>7} {'p95 s':>7} {'peak +MB':>9}  statuses")
+    for r in results:
+        for case in ("accept", "reject"):
+            c = r[case]
+            if c is None:
+                continue
+            print(f"{r['mode']:<10} {case:<7} {c['wall_seconds']:>7.3f} {c['latency_p50']:>7.3f} {c['latency_p95']:>7.3f} "
+                  f"{_mb(c['peak_rss_delta_bytes']):>9}  {c['statuses']}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak server RSS under concurrent large uploads")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--size-mb", type=float, default=15)
+    parser.add_argument("--reject-mb", type=float, default=40, help="ขนาดไฟล์ที่เกินขีดจำกัด (0 = ไม่ทดสอบการปฏิเสธ)")
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--upload-dir", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        serve(args.child, args.port, args.upload_dir)
+        sys.exit(0)
+    sys.exit(main(args))
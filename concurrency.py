@@ -0,0 +1,107 @@
+import os, time, asyncio, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+# ---- Settings ----
+TYPHOON_BASE_URL = os.getenv("TYPHOON_BASE_URL", "https://api.opentyphoon.ai/v1")
+TYPHOON_HOST = urlparse(TYPHOON_BASE_URL).hostname
+# จำนวน request ต่อวินาทีต่อ host และจำนวนที่ยิงติดกันได้ (burst)
+HOST_RATE_LIMIT = float(os.getenv("HOST_RATE_LIMIT", "2"))
+HOST_RATE_BURST = int(os.getenv("HOST_RATE_BURST", "4"))
+# จำนวนหน้าที่ประมวลผลพร้อมกันต่อเอกสาร
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "4"))
+
+
+class HostRateLimiter:
+    """
+    Token bucket แยกตาม host ใช้ร่วมกันทุก thread ใน process
+    acquire() จะ block จนกว่าจะมี token ให้ยิง request ไปยัง host นั้น
+    rate <= 0 คือไม่จำกัด
+    """
+
+    def __init__(self, rate: float = HOST_RATE_LIMIT, burst: int = HOST_RATE_BURST):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._lock = threading.Lock()
+        self._buckets = {}  # host -> [tokens, last_refill]
+
+    def _take(self, host: str) -> float:
+        """ใช้ token หนึ่งตัวถ้ามี (คืน 0) ถ้าไม่มีคืนจำนวนวินาทีที่ต้องรอก่อนลองใหม่"""
+        with self._lock:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(host, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[host] = (tokens - 1, now)
+                return 0.0
+            self._buckets[host] = (tokens, now)
+            return (1 - tokens) / self.rate
+
+    def acquire(self, host: str):
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._take(host)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, host: str):
+        """เหมือน acquire() แต่รอด้วย asyncio.sleep ไม่ block event loop"""
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._take(host)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+# limiter กลางของ process
+limiter = HostRateLimiter()
+
+
+def ordered_map(fn, items, max_workers: int = PIPELINE_WORKERS, max_pending: int = None):
+    """
+    เหมือน map(fn, items) แต่รัน fn หลายตัวพร้อมกันใน thread pool
+    - คืนผลตามลำดับของ items เสมอ
+    - ดึง items ทีละตัวแบบ lazy และมีงานค้างไม่เกิน max_pending (ค่าเริ่มต้น = max_workers)
+      เพื่อให้หน่วยความจำขึ้นกับความลึกของ pipeline ไม่ใช่จำนวนหน้า
+    fn ควรจัดการ exception เอง ถ้าหลุดออกมาจะถูก raise ตอนดึงผลของตัวนั้น
+    """
+    max_workers = max(1, int(max_workers or 1))
+    max_pending = max(max_workers, int(max_pending or max_workers))
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+async def aordered_map(afn, items, max_pending: int = PIPELINE_WORKERS):
+    """
+    ordered_map สำหรับ coroutine: afn(item) รันเป็น task บน event loop เดียวกัน
+    items เป็น iterator ธรรมดา (เช่น rasterise หน้า PDF) จึงดึงทีละตัวใน thread เพื่อไม่ block loop
+    คืนผลตามลำดับของ items และมีงานค้างไม่เกิน max_pending
+    """
+    max_pending = max(1, int(max_pending or 1))
+    iterator = iter(items)
+    done = object()
+    pending = deque()
+    try:
+        while True:
+            item = await asyncio.to_thread(next, iterator, done)
+            if item is done:
+                break
+            pending.append(asyncio.ensure_future(afn(item)))
+            if len(pending) >= max_pending:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -1,123 +1,227 @@
 from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import os
 import json
 
+# ---- Settings ----
+# ชุดกฎที่ใช้ตรวจเงื่อนไขลดหย่อน (ต้องเป็น key ใน RULE_SETS) บันทึกไว้ใน result_json["rules_version"] ทุกครั้ง
+RULES_VERSION = os.getenv("RULES_VERSION", "2025.1")
+
+DEDUCTIBLE = "สามารถลดหย่อนได้"
+NOT_DEDUCTIBLE = "ไม่สามารถลดหย่อนได้"
+PASSED = "ผ่านเงื่อนไขเบื้องต้น"
+
+# ปีในกฎเป็น พ.ศ. ถ้าเป็นค่าติดลบ/ศูนย์ = ปีสัมพัทธ์กับปีภาษีที่ตรวจ (0 = ปีภาษีนั้น, -1 = ปีก่อนหน้า)
+# เอกสารต้องลงวันที่ในปีภาษีที่ตรวจ (RuleEngine.reason) ช่วงวันที่ของกฎจึงอยู่ในปีเดียวกัน
+TAX_YEAR = 0
+
+
+class DeductionRule:
+    """
+    กฎลดหย่อนของรายการหนึ่งชนิด (เลือกด้วย sub_category หรือ category)
+    - min_warranty: warranty_period ขั้นต่ำ (ปี)
+    - date_from / date_to: ช่วงวันที่ของเอกสาร (วัน, เดือน, ปี พ.ศ.) รวมปลายทั้งสองด้าน ถ้ากำหนดต้องมีวันที่ครบ
+    - invoice_type: ประเภทใบกำกับที่ต้องเป็น (เช่น Easy E-Receipt ต้องเป็น Full Invoice)
+    """
+
+    def __init__(self, sub_category: str = None, category: str = None, min_warranty: int = None,
+                 date_from: Tuple[int, int, int] = None, date_to: Tuple[int, int, int] = None,
+                 invoice_type: str = None):
+        if bool(sub_category) == bool(category):
+            raise ValueError("DeductionRule needs exactly one of sub_category / category")
+        self.sub_category = sub_category
+        self.category = category
+        self.min_warranty = min_warranty
+        self.date_from = date_from
+        self.date_to = date_to
+        self.invoice_type = invoice_type
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return ("sub_category", self.sub_category) if self.sub_category else ("category", self.category)
+
+
+RULE_SETS: Dict[str, List[DeductionRule]] = {
+    "2025.1": [
+        DeductionRule(sub_category="เบี้ยประกันชีวิต", min_warranty=10),
+        DeductionRule(sub_category="เบี้ยประกันชีวิตแบบบำนาญ", min_warranty=10),
+        DeductionRule(sub_category="ค่าซื้อหน่วยลงทุนเพื่อการเลี้ยงชีพ (RMF)", min_warranty=5),
+        DeductionRule(sub_category="ค่าซื้อหน่วยลงทุนในกองทุนรวมเพื่อการออม SSF", min_warranty=10, date_from=(1, 1, 2563)),
+        DeductionRule(sub_category="ค่าซื้อหน่วยลงทุนในกองทุนรวมไทยเพื่อความยั่งยืน (Thai ESG)", date_from=(1, 1, TAX_YEAR)),
+        DeductionRule(sub_category="เงินบริจาคพรรคการเมือง", date_from=(1, 1, 2561)),
+        DeductionRule(sub_category="ค่าท่องเที่ยวภายในประเทศ", date_from=(1, 5, TAX_YEAR), date_to=(30, 11, TAX_YEAR)),
+        DeductionRule(
+            sub_category="ค่าจ้างก่อสร้างอาคารเพื่ออยู่อาศัยขึ้นใหม่ให้แก่ผู้รับจ้างซึ่งเป็นผู้ประกอบการจดทะเบียนภาษีมูลค่าเพิ่ม",
+            date_from=(9, 4, TAX_YEAR), date_to=(31, 12, TAX_YEAR),
+        ),
+        DeductionRule(sub_category="ค่าซ่อมบ้านจากอุทกภัย", date_from=(16, 8, TAX_YEAR), date_to=(31, 12, TAX_YEAR)),
+        DeductionRule(sub_category="ค่าซ่อมรถจากอุทกภัย", date_from=(16, 8, TAX_YEAR), date_to=(31, 12, TAX_YEAR)),
+        DeductionRule(
+            category="Easy E-Receipt", date_from=(1, 1, TAX_YEAR), date_to=(15, 2, TAX_YEAR),
+            invoice_type="Full Invoice",
+        ),
+    ],
+}
+
+
+def _safe_int(x, default=None):
+    try:
+        return int(x)
+    except Exception:
+        return default
+
+
+def _resolve(bound, tax_year: int):
+    """(วัน, เดือน, ปี) -> (ปี, เดือน, วัน) สำหรับเทียบแบบ tuple (แปลงปีสัมพัทธ์เป็น พ.ศ. จริง)"""
+    if bound is None:
+        return None
+    d, m, y = bound
+    return (tax_year + y if y <= 0 else y, m, d)
+
+
+def current_tax_year(now: datetime = None) -> int:
+    """ปีภาษี (พ.ศ.) ตามเวลาจริง"""
+    return (now or datetime.now()).year + 543
+
+
+class CompiledRules:
+    """
+    กฎของ version หนึ่งสำหรับปีภาษีหนึ่ง: ปีสัมพัทธ์ถูกแปลงแล้ว และเก็บใน dict ตาม (sub_category / category)
+    ตรวจรายการด้วยการค้น dict ครั้งเดียว แทนการเทียบ string ทีละเงื่อนไข
+    """
+
+    def __init__(self, version: str, tax_year: int):
+        if version not in RULE_SETS:
+            raise ValueError(f"Unknown rules version {version}")
+        self.version = version
+        self.tax_year = tax_year
+        self.table: Dict[Tuple[str, str], Tuple[DeductionRule, Optional[tuple], Optional[tuple]]] = {}
+        for rule in RULE_SETS[version]:
+            self.table[rule.key] = (rule, _resolve(rule.date_from, tax_year), _resolve(rule.date_to, tax_year))
+
+    def lookup(self, item: Dict[str, Any]):
+        # sub_category มาก่อน category เหมือนลำดับของกฎเดิม
+        return self.table.get(("sub_category", item.get("sub_category"))) or self.table.get(("category", item.get("category")))
+
+    def item_status(self, item: Dict[str, Any], doc_date: Optional[tuple], warranty: int, invoice_type) -> str:
+        found = self.lookup(item)
+        if found is None:
+            return DEDUCTIBLE
+        rule, date_from, date_to = found
+        if rule.min_warranty is not None and warranty < rule.min_warranty:
+            return NOT_DEDUCTIBLE
+        if date_from is not None or date_to is not None:
+            if doc_date is None:
+                return NOT_DEDUCTIBLE
+            if (date_from is not None and doc_date < date_from) or (date_to is not None and doc_date > date_to):
+                return NOT_DEDUCTIBLE
+        if rule.invoice_type is not None and invoice_type != rule.invoice_type:
+            return NOT_DEDUCTIBLE
+        return DEDUCTIBLE
+
+
+@lru_cache(maxsize=64)
+def compile_rules(version: str = RULES_VERSION, tax_year: int = None) -> CompiledRules:
+    """CompiledRules ของ version/ปีภาษี พ.ศ. (cache ไว้ — สร้างใหม่เมื่อเปลี่ยนปีเท่านั้น)"""
+    return CompiledRules(version, tax_year if tax_year is not None else current_tax_year())
+
+
+class RuleEngine:
+    """
+    ตรวจเงื่อนไขลดหย่อนของเอกสาร (ผลจาก FindInvoiceCompany) สำหรับปีภาษีหนึ่ง
+    - เอกสาร: ต้องยืนยันบริษัทได้ และปีของเอกสารต้องเป็นปีภาษีที่ตรวจ ไม่งั้นไม่สามารถลดหย่อนได้ทั้งฉบับ
+    - รายการ: ทุกรายการได้ deduction_status ของตัวเองในรอบเดียว ตามกฎใน RULE_SETS[version]
+    ปีภาษี = tax_year ถ้ากำหนด ไม่งั้นปีของ now (ค่าเริ่มต้นคือเวลาจริง)
+    แก้ dict ที่ส่งเข้ามาและคืน dict เดิม โดยเติม rules_version และ tax_year
+    """
+
+    def __init__(self, version: str = RULES_VERSION, now: datetime = None, tax_year: int = None):
+        self.now = now
+        self.version = version
+        self.tax_year = tax_year
+
+    def rules_for(self, tax_year: int = None) -> CompiledRules:
+        if tax_year is None:
+            tax_year = self.tax_year if self.tax_year is not None else current_tax_year(self.now)
+        return compile_rules(self.version, tax_year)
+
+    @property
+    def rules(self) -> CompiledRules:
+        return self.rules_for()
+
+    def evaluate(self, data: Dict[str, Any], tax_year: int = None) -> Dict[str, Any]:
+        return self._evaluate(data, self.rules_for(tax_year))
+
+    def evaluate_many(self, documents: Iterable[Dict[str, Any]], tax_years: Iterable[int] = None) -> List[Dict[str, Any]]:
+        """
+        ตรวจหลายเอกสาร (เช่นตอนตรวจเอกสารที่บันทึกไว้ใหม่หลังกฎเปลี่ยน)
+        tax_years: ปีภาษีของแต่ละเอกสารตามลำดับ (None = ปีภาษีของ engine ทุกฉบับ)
+        """
+        documents = list(documents)
+        years = list(tax_years) if tax_years is not None else [None] * len(documents)
+        return [self._evaluate(doc, self.rules_for(year)) for doc, year in zip(documents, years)]
+
+    @staticmethod
+    def document_date(data: Dict[str, Any]) -> Optional[tuple]:
+        date_obj = data.get("date") or {}
+        d, m, y = (_safe_int(date_obj.get(k)) for k in ("day", "month", "year"))
+        return (y, m, d) if None not in (d, m, y) else None
+
+    def reason(self, data: Dict[str, Any], rules: CompiledRules = None) -> str:
+        """เหตุผลที่ไม่ผ่านเงื่อนไขระดับเอกสาร ("" = ผ่าน)"""
+        rules = rules or self.rules
+        verified = data.get("verified_seller_name") or {}
+        if not verified.get("matched"):
+            return "ไม่สามารถยืนยันชื่อบริษัทกับฐานข้อมูล"
+        if _safe_int((data.get("date") or {}).get("year")) != rules.tax_year:
+            return f"ปีภาษีไม่ตรง (ต้องเป็น {rules.tax_year})"
+        return ""
+
+    def _evaluate(self, data: Dict[str, Any], rules: CompiledRules) -> Dict[str, Any]:
+        data["rules_version"] = rules.version
+        data["tax_year"] = rules.tax_year
+        reason = self.reason(data, rules)
+        if reason:
+            data["deduction_status"] = NOT_DEDUCTIBLE
+            data["reason"] = f"ไม่สามารถลดหย่อนได้ เพราะ  {reason}"
+            return data
+
+        doc_date = self.document_date(data)
+        warranty = _safe_int(data.get("warranty_period"), 0)
+        invoice_type = data.get("invoice_type")
+        for it in data.get("items") or []:
+            it["deduction_status"] = rules.item_status(it, doc_date, warranty, invoice_type)
+
+        data["deduction_status"] = PASSED
+        # ผลเดิมของเอกสาร (ตอนตรวจซ้ำด้วยกฎใหม่) ไม่ควรค้างอยู่
+        data.pop("reason", None)
+        return data
+
+
 class check_condition:
-    def __init__(self, input_json: dict, file_name: str, num: int):
+    def __init__(self, input_json: dict, file_name: str, num: int, rules_version: str = RULES_VERSION):
         self.input_json_raw = input_json or {}
         self.file_name = file_name
         self.page = num
-
-    @staticmethod
-    def _safe_int(x, default=None):
-        try:
-            return int(x)
-        except Exception:
-            return default
+        self.engine = RuleEngine(rules_version)
 
     def _write_out(self):
         with open(f"./json/{self.file_name}_output_page_{self.page}.json", "w", encoding="utf-8") as f:
             json.dump(self.input_json_raw, f, ensure_ascii=False, indent=2)
 
     def check(self) -> dict:
-        now = datetime.now()
         data = self.input_json_raw
+        print("ปีที่ลดหย่อน:", (data.get("date") or {}).get("year"),
+              "ชื่อบริษัท:", (data.get("verified_seller_name") or {}).get("matched"),
+              "วันที่รับเอกสาร:", data.get("date"),
+              "rules:", self.engine.version)
 
-        verified = data.get("verified_seller_name") or {}
-        comfirm_company = verified.get("matched")
-
-        date_obj = data.get("date") or {}
-        d = self._safe_int(date_obj.get("day"))
-        m = self._safe_int(date_obj.get("month"))
-        y = self._safe_int(date_obj.get("year"))
-
-        print("ปีที่ลดหย่อน:", y,
-              "ชื่อบริษัท:", comfirm_company,
-              "วันที่รับเอกสาร:", date_obj,
-              "ปีที่เป็นพ.ศ ", now.year + 543)
-
-        reason = ""
-
-        # เทียบการยืนยันบริษัท
-        if not comfirm_company:
-            reason = "ไม่สามารถยืนยันชื่อบริษัทกับฐานข้อมูล"
-        # เทียบปี (ระวังชนิดข้อมูลให้เป็น int ทั้งคู่)
-        elif y != (now.year + 543):
-            reason = f"ปีภาษีไม่ตรง (ต้องเป็น {now.year + 543})"
-
-        # กรณีผ่านเงื่อนไขพื้นฐาน
-        if not reason:
-            # ป้องกัน crash ถ้าไม่มี items หรือ warranty_period เป็นค่าว่าง
-            items = data.get("items") or []
-            wp = self._safe_int(data.get("warranty_period"), 0)
-
-            for it in items:
-                sub = it.get("sub_category")
-                cat = it.get("category")  # อาจไม่มี ให้ใช้ .get เพื่อลดโอกาส KeyError
-
-                # *** หมายเหตุ: ตรรกะช่วงวัน/เดือนตามโค้ดเดิม อาจต้องทบทวนวงเล็บ ***
-                if sub == "เบี้ยประกันชีวิต" and not (wp >= 10):
-                    it["deduction_status"] = "ไม่สามารถลดหย่อนได้"
-                    break
-                elif sub == "เบี้ยประกันชีวิตแบบบำนาญ" and not (wp >= 10):
-                    it["deduction_status"] = "ไม่สามารถลดหย่อนได้"
-                    break
-                elif sub == "ค่าซื้อหน่วยลงทุนเพื่อการเลี้ยงชีพ (RMF)" and not (wp >= 5):
-                    it["deduction_status"] = "ไม่สามารถลดหย่อนได้"
-                    break
-                elif sub == "ค่าซื้อหน่วยลงทุนในกองทุนรวมเพื่อการออม SSF" and not (wp >= 10 and d is not None and m is not None and y is not None and d >= 1 and m >= 1 and y >= 2563):
-                    # เดิมคุณตั้งให้ not(...) -> "สามารถลดหย่อนได้" ซึ่งกลับขั้ว
-                    it["deduction_status"] = "ไม่สามารถลดหย่อนได้"
-                    break
-                elif sub == "ค่าซื้อหน่วยลงทุนในกองทุนรวมไทยเพื่อความยั่งยืน (Thai ESG)" and not (d is not None and m is not None and y is not None and d >= 1 and m >= 1 and y >= (now.year + 542)):
-                    it["deduction_status"] = "ไม่สามารถลดหย่อนได้"
-                    break
-                elif sub == "เงินบริจาคพรรคการเมือง" and not (d is not None and m is not None and y is not None and d >= 1 and m >= 1 and y >= 2561):
-                    it["deduction_status"] = "ไม่สามารถลดหย่อนได้"
-                    break
-                elif sub == "ค่าท่องเที่ยวภายในประเทศ" and (
-                    (not (d is not None and m is not None and y is not None and d >= 1 and m >= 5 and y >= (now.year + 542)))
-                    or (d is not None and m is not None and y is not None and d <= 30 and m <= 11 and y <= (now.year + 542))
-                ):
-                    it["deduction_status"] = "ไม่สามารถลดหย่อนได้"
-                    break
-                elif sub == "ค่าจ้างก่อสร้างอาคารเพื่ออยู่อาศัยขึ้นใหม่ให้แก่ผู้รับจ้างซึ่งเป็นผู้ประกอบการจดทะเบียนภาษีมูลค่าเพิ่ม" and (
-                    (not (d is not None and m is not None and y is not None and d >= 9 and m >= 4 and y >= (now.year + 542)))
-                    or (d is not None and m is not None and y is not None and d <= 31 and m <= 12 and y <= (now.year + 542))
-                ):
-                    it["deduction_status"] = "ไม่สามารถลดหย่อนได้"
-                    break
-                elif sub == "ค่าซ่อมบ้านจากอุทกภัย" and (
-                    (not (d is not None and m is not None and y is not None and d >= 16 and m >= 8 and y == (now.year + 542)))
-                    or (d is not None and m is not None and y is not None and d <= 31 and m <= 12 and y == (now.year + 542))
-                ):
-                    it["deduction_status"] = "ไม่สามารถลดหย่อนได้"
-                    break
-                elif sub == "ค่าซ่อมรถจากอุทกภัย" and (
-                    (not (d is not None and m is not None and y is not None and d >= 16 and m >= 8 and y == (now.year + 542)))
-                    or (d is not None and m is not None and y is not None and d <= 31 and m <= 12 and y == (now.year + 542))
-                ):
-                    it["deduction_status"] = "ไม่สามารถลดหย่อนได้"
-                    break
-                elif cat == "Easy E-Receipt" and (
-                    (not (d is not None and m is not None and y is not None and d >= 1 and m >= 1 and y == (now.year + 542)))
-                    and (d is not None and m is not None and y is not None and d <= 15 and m <= 2 and y == (now.year + 542) and data["invoice_type"] != "Full Invoice")
-                ):
-                    it["deduction_status"] = "ไม่สามารถลดหย่อนได้"
-                    break
-                else:
-                    it["deduction_status"] = "สามารถลดหย่อนได้"
-
-            # (ตัวอย่างนี้) ให้เอกสาร “ผ่านเบื้องต้น”
-            data["deduction_status"] = "ผ่านเงื่อนไขเบื้องต้น"
-            self._write_out()
+        self.engine.evaluate(data)
+        self._write_out()
+        if data["deduction_status"] == PASSED:
             print("✅ สามารถลดหย่อนได้")
-            print("="*20)
-
         else:
-            data["deduction_status"] = "ไม่สามารถลดหย่อนได้"
-            data["reason"] = f"ไม่สามารถลดหย่อนได้ เพราะ  {reason}"
-            self._write_out()
-            print(f"❌ ไม่สามารถลดหย่อนได้ เพราะ: {reason}")
-            print("="*20)
-
+            print(f"❌ {data['reason']}")
+        print("="*20)
         return data
@@ -1,11 +1,20 @@
 import psycopg2 as pg
-import json, os, hashlib, mimetypes, re
-from datetime import date
+import psycopg2.errors
+import json, os, hashlib, mimetypes, re, threading, base64
+from datetime import date, datetime
 from decimal import Decimal
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extensions import TRANSACTION_STATUS_UNKNOWN
 from dotenv import load_dotenv
 
 load_dotenv()
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# สร้าง extension/ตารางตอนเปิด pool (ครั้งเดียวต่อ process) แทนที่จะทำทุก request
+DB_INIT_SCHEMA = os.getenv("DB_INIT_SCHEMA", "1").lower() in ("1", "true", "yes")
 # --------------------------
 # Helpers: TH month / date / money / file meta
 # --------------------------
@@ -118,42 +127,216 @@ def normalize_from_result_json(result_json: dict):
         "deduction_reason": deduction_reason,
     }
 
+# --------------------------
+# Document listing (keyset pagination)
+# --------------------------
+DOCUMENT_SUMMARY_COLUMNS = [
+    "id", "employee_id", "member_name", "original_name", "file_path", "mime_type",
+    "file_size_bytes", "sha256", "created_at",
+    "vendor_name", "buyer_name", "tax_id", "invoice_no", "doc_date", "total_amount",
+    "deduction_status", "deduction_reason",
+]
+DOCUMENT_SORT_KEYS = {"created_at", "doc_date"}
+DOCUMENT_UNIQUE_INDEX = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_document_emp_sha ON document(employee_id, sha256)"
+)
+# ตารางเดิม (ก่อนมี unique index) อาจมีเอกสารซ้ำ employee_id+sha256 — สร้าง index ไม่ได้จนกว่าจะรวมแถวซ้ำ
+# ซึ่งทำผ่านคำสั่ง migration เท่านั้น (python dedupe_documents.py) ไม่ทำเองตอน startup
+DOCUMENT_DUPLICATES = """
+    SELECT employee_id, sha256, array_agg(id ORDER BY id) AS ids
+    FROM document {where}
+    GROUP BY employee_id, sha256 HAVING count(*) > 1
+    ORDER BY employee_id, sha256
+"""
+# เก็บแถวล่าสุด (id มากสุด): ย้าย history ของแถวซ้ำไปที่แถวที่เก็บ, เก็บทั้งแถวที่ลบเป็น history
+# stage 'dedupe' (to_jsonb ของทั้งแถว กู้คืนได้) แล้วลบแถวซ้ำ
+DOCUMENT_DEDUPE = (
+    """WITH ranked AS (
+        SELECT id, max(id) OVER (PARTITION BY employee_id, sha256) AS keep_id FROM document
+    )
+    UPDATE document_result_history h SET document_id = r.keep_id
+    FROM ranked r WHERE h.document_id = r.id AND r.id <> r.keep_id""",
+    """WITH ranked AS (
+        SELECT id, max(id) OVER (PARTITION BY employee_id, sha256) AS keep_id FROM document
+    )
+    INSERT INTO document_result_history (document_id, stage, result_json, status, reason)
+    SELECT r.keep_id, 'dedupe', to_jsonb(d), d.deduction_status, 'merged duplicate document ' || d.id
+    FROM document d JOIN ranked r ON d.id = r.id WHERE r.id <> r.keep_id""",
+    """WITH ranked AS (
+        SELECT id, max(id) OVER (PARTITION BY employee_id, sha256) AS keep_id FROM document
+    )
+    DELETE FROM document d USING ranked r WHERE d.id = r.id AND r.id <> r.keep_id""",
+)
+# มี unique index แล้วหรือยัง (None = ยังไม่รู้) — ไม่มีก็บันทึกแบบ INSERT ธรรมดาแทน ON CONFLICT
+_document_unique_index = None
+DOCUMENT_LIST_MAX_LIMIT = 200
+
+def encode_cursor(sort: str, order: str, value, row_id: int) -> str:
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    raw = json.dumps([sort, order, value, row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor: str, sort: str, order: str):
+    """คืน (value, id) ของแถวสุดท้ายในหน้าก่อน — cursor ต้องมาจาก sort/order เดียวกัน"""
+    # cursor มาจาก client — อ่านไม่ได้แบบไหนก็ต้องเป็น ValueError (400) ไม่ใช่ 500
+    try:
+        c_sort, c_order, value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("invalid cursor")
+    if c_sort != sort or c_order != order:
+        raise ValueError("cursor does not match sort/order")
+    try:
+        if value is not None:
+            value = date.fromisoformat(value) if sort == "doc_date" else datetime.fromisoformat(value)
+        return value, int(row_id)
+    except (TypeError, ValueError):
+        raise ValueError("invalid cursor")
+
+# --------------------------
+# Connection pool
+# --------------------------
+def _connect_params():
+    # --- Read database connection details from environment variables ---
+    return dict(
+        host=os.getenv("SUPABASE_DB_HOST"),
+        port=int(os.getenv("SUPABASE_DB_PORT", "5432")),
+        database=os.getenv("SUPABASE_DB_NAME", "postgres"),
+        user=os.getenv("SUPABASE_DB_USER"),
+        password=os.getenv("SUPABASE_DB_PASSWORD"),
+        connect_timeout=int(os.getenv("DB_CONNECT_TIMEOUT", "10")),
+    )
+
+_pool = None
+_pool_slots = None  # จำกัดจำนวน checkout ให้ไม่เกิน maxconn (รอแทนที่จะ PoolError)
+
+
+def _checkout(pool):
+    """
+    ยืม connection จาก pool ที่ยังใช้ได้จริง — connection.closed ไม่รู้ว่า server ตัดไปแล้ว
+    (restart/idle timeout) จึงลอง SELECT 1 ก่อน ตัวที่เสียปิดทิ้งแล้วขอใหม่ (สูงสุดเท่าจำนวน connection ใน pool)
+    """
+    for _ in range(pool.maxconn):
+        conn = pool.getconn()
+        try:
+            if not conn.closed:
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                return conn
+        except (pg.OperationalError, pg.InterfaceError) as e:
+            print("Discarding broken pooled connection:", e)
+        pool.putconn(conn, close=True)
+    # ทุกตัวเสีย (เช่น server เพิ่ง restart) — ตัวที่ต่อใหม่ล่าสุดยังเสีย ให้ error ไปถึงผู้เรียก
+    return pool.getconn()
+
+def init_pool(minconn: int = DB_POOL_MIN, maxconn: int = DB_POOL_MAX, init_schema: bool = DB_INIT_SCHEMA) -> bool:
+    """เปิด connection pool ของทั้ง process (เรียกครั้งเดียวตอน startup)"""
+    global _pool, _pool_slots
+    if _pool is not None:
+        return True
+    try:
+        params = _connect_params()
+        print("DB HOST:", params["host"])
+        print("DB USER:", params["user"])
+        print("DB NAME:", params["database"])
+        pool = ThreadedConnectionPool(minconn, maxconn, **params)
+        # init_pool รันใน background ขณะรับ request แล้ว — ตั้ง semaphore ก่อนเปิดให้ใช้ pool
+        _pool_slots = threading.BoundedSemaphore(maxconn)
+        _pool = pool
+        print(f"database pool ready ({minconn}-{maxconn})")
+    except Exception as e:
+        print("Error creating database pool:", e)
+        _pool = None
+        return False
+
+    if init_schema:
+        db = DatabaseConnection()
+        try:
+            # เปิดใช้งาน pgcrypto และสร้างตาราง/index ถ้ายังไม่มี (รันครั้งเดียวพอ)
+            try:
+                db.cursor.execute("CREATE EXTENSION IF NOT EXISTS pgcrypto;")
+            except Exception:
+                pass
+            db.create_table()
+        finally:
+            db.close()
+    return True
+
+def close_pool():
+    global _pool, _pool_slots
+    if _pool is not None:
+        try:
+            _pool.closeall()
+        except Exception as e:
+            print("Error closing database pool:", e)
+    _pool = None
+    _pool_slots = None
+
+def pool_status():
+    if _pool is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "minconn": _pool.minconn,
+        "maxconn": _pool.maxconn,
+        "in_use": len(_pool._used),
+        "idle": len(_pool._pool),
+    }
+
 # --------------------------
 # Database
 # --------------------------
 class DatabaseConnection:
+    """
+    ถ้าเปิด pool ไว้แล้ว (init_pool) จะยืม connection จาก pool และคืนตอน close()
+    ถ้ายังไม่มี pool จะต่อฐานข้อมูลตรงแบบเดิม
+    ใช้ได้ทั้งแบบ db = DatabaseConnection() ... db.close() และ with DatabaseConnection() as db:
+    """
     def __init__(self):
+        self.connection = None
+        self.cursor = None
+        self._pool = None
+        self._slots = None
         try:
-            # --- Read database connection details from environment variables ---
-            host = os.getenv("SUPABASE_DB_HOST")
-            port = int(os.getenv("SUPABASE_DB_PORT", "5432"))
-            db   = os.getenv("SUPABASE_DB_NAME", "postgres")
-            user = os.getenv("SUPABASE_DB_USER")
-            pwd  = os.getenv("SUPABASE_DB_PASSWORD")
-
-            print("DB HOST:", host)
-            print("DB USER:", user)
-            print("DB NAME:", db)
-
-            # --- Establish the connection ---
-            self.connection = pg.connect(
-                host=host,
-                database=db,
-                user=user,
-                password=pwd,
-                port=port
-            )
+            pool, slots = _pool, _pool_slots
+            if pool is not None:
+                slots.acquire()
+                try:
+                    self.connection = _checkout(pool)
+                except Exception:
+                    slots.release()
+                    raise
+                self._pool, self._slots = pool, slots
+            else:
+                # --- Establish the connection ---
+                self.connection = pg.connect(**_connect_params())
+                print("database now")
             self.connection.autocommit = True
             self.cursor = self.connection.cursor()
-            print("database now")
-            # เปิดใช้งาน JSONB ถ้ายังไม่ได้สร้าง extension (รันครั้งเดียวพอ)
-            try:
-                self.cursor.execute("CREATE EXTENSION IF NOT EXISTS pgcrypto;")
-            except Exception:
-                pass
         except Exception as e:
             print("Error connecting to the database:", e)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    @contextmanager
+    def transaction(self):
+        """รันหลายคำสั่งเป็น transaction เดียว (ปกติ connection เป็น autocommit) — rollback ถ้ามี exception"""
+        self.connection.autocommit = False
+        try:
+            yield self.cursor
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            self.connection.autocommit = True
+
     def create_table(self):
         # แยกคำสั่งเป็นทีละ query (psycopg2 ปลอดภัยกว่า)
         stmts = [
@@ -196,6 +379,9 @@ class DatabaseConnection:
                 "CREATE INDEX IF NOT EXISTS idx_document_status     ON document(deduction_status)",
                 "CREATE INDEX IF NOT EXISTS idx_document_vendor     ON document(vendor_name)",
                 "CREATE INDEX IF NOT EXISTS idx_document_result_gin ON document USING GIN (result_json)",
+                # keyset pagination ของ list_documents (employee_id + sort key + id)
+                "CREATE INDEX IF NOT EXISTS idx_document_emp_created ON document(employee_id, created_at, id)",
+                "CREATE INDEX IF NOT EXISTS idx_document_emp_docdate ON document(employee_id, doc_date, id)",
             """CREATE TABLE IF NOT EXISTS document_result_history (
                 id            SERIAL PRIMARY KEY,
                 document_id   INTEGER NOT NULL REFERENCES document(id) ON DELETE CASCADE,
@@ -212,10 +398,64 @@ class DatabaseConnection:
         try:
             for sql in stmts:
                 self.cursor.execute(sql)
-            return "create table success"
         except Exception as e:
             print("Error creating table:", e)
             return "create table failed"
+        try:
+            # ON CONFLICT (employee_id, sha256) ของ insert_document(s) ต้องมี unique index จริง
+            self.ensure_document_unique_index()
+        except Exception as e:
+            print("Error creating unique index:", e)
+            return "create table failed"
+        return "create table success"
+
+    def ensure_document_unique_index(self) -> bool:
+        """
+        สร้าง unique index (employee_id, sha256) ถ้าทำได้ — ไม่ลบข้อมูลใด ๆ
+        ถ้ามีเอกสารซ้ำอยู่ จะแจ้ง error แล้วคืน False (insert_document(s) ใช้ INSERT ธรรมดาแทน ON CONFLICT)
+        """
+        global _document_unique_index
+        try:
+            self.cursor.execute(DOCUMENT_UNIQUE_INDEX)
+        except pg.errors.UniqueViolation as e:
+            print("❌ Cannot create unique index uq_document_emp_sha: duplicate (employee_id, sha256) documents exist.",
+                  "Inserts fall back to plain INSERT; run `python dedupe_documents.py` to review and merge them.", e)
+            _document_unique_index = False
+            return False
+        _document_unique_index = True
+        return True
+
+    def has_document_unique_index(self) -> bool:
+        """มี unique index แล้ว (cache เมื่อมีแล้วเท่านั้น — ถ้ายังไม่มีจะตรวจใหม่ เผื่อเพิ่งรัน migration)"""
+        global _document_unique_index
+        if _document_unique_index:
+            return True
+        self.cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = 'uq_document_emp_sha'")
+        _document_unique_index = self.cursor.fetchone() is not None
+        return _document_unique_index
+
+    def find_duplicate_documents(self, employee_id=None):
+        """เอกสารซ้ำ [{"employee_id", "sha256", "ids": [id น้อยไปมาก]}] — แถวที่ id มากสุดคือแถวที่ dedupe จะเก็บไว้"""
+        where, params = "", []
+        if employee_id is not None:
+            where, params = "WHERE employee_id = %s", [employee_id]
+        self.cursor.execute(DOCUMENT_DUPLICATES.format(where=where), params)
+        return [{"employee_id": e, "sha256": sha, "ids": list(ids)} for e, sha, ids in self.cursor.fetchall()]
+
+    def dedupe_documents(self) -> int:
+        """
+        migration (เรียกเองเท่านั้น): รวมเอกสารซ้ำตาม DOCUMENT_DEDUPE แล้วสร้าง unique index
+        ใน transaction เดียวพร้อม lock ตาราง ไม่ให้มีแถวซ้ำแทรกเข้ามาระหว่างทาง คืนจำนวนแถวที่ลบ
+        """
+        global _document_unique_index
+        with self.transaction() as cur:
+            cur.execute("LOCK TABLE document IN SHARE ROW EXCLUSIVE MODE")
+            for sql in DOCUMENT_DEDUPE:
+                cur.execute(sql)
+            removed = cur.rowcount
+            cur.execute(DOCUMENT_UNIQUE_INDEX)
+        _document_unique_index = True
+        return removed
 
     # --------------------------
     # Employees
@@ -262,87 +502,146 @@ class DatabaseConnection:
     # Documents
     # --------------------------
     def insert_document(self, employee_id, member_name, meta, result_json, rules_version=None, add_hist=True):
-        sha = _normalize_sha(meta.get("sha256"), meta.get("file_path"))
-        meta = {**meta, "sha256": sha}
-
-        try:
-            ensure_file_meta(meta)
-            fields = normalize_from_result_json(result_json)
-
-            # 1) พยายามแทรก
-            sql = sql = """
-                INSERT INTO document (
-                    employee_id, member_name, original_name, file_path, mime_type,
-                    file_size_bytes, sha256,
-                    vendor_name, buyer_name, tax_id, invoice_no, doc_date, total_amount,
-                    deduction_status, deduction_reason,
-                    result_json
-                )
-                VALUES (%s,%s,%s,%s,%s, %s,%s, %s,%s,%s,%s,%s,%s, %s,%s, %s)
-                RETURNING id
-                """
-
-            values = (
-                employee_id, member_name, meta["original_name"], meta["file_path"],
-                meta["mime_type"], meta["file_size_bytes"], meta["sha256"],
-                fields["vendor_name"], fields["buyer_name"], fields["tax_id"],
-                fields["invoice_no"], fields["doc_date"], fields["total_amount"],
-                fields["deduction_status"], fields["deduction_reason"],
-                json.dumps(result_json, ensure_ascii=False),
+        """insert หรืออัปเดตเอกสารเดิม (employee_id+sha256 ซ้ำ) คืน id หรือ None ถ้าไม่สำเร็จ"""
+        row = self.insert_documents_bulk(
+            employee_id, member_name, [{"meta": meta, "result_json": result_json}],
+            rules_version=rules_version, add_hist=add_hist,
+        )[0]
+        if not row["ok"]:
+            print("DB insert error:", row["error"])
+        return row["id"]
+
+    def _document_row(self, employee_id, member_name, meta, result_json):
+        meta = {**meta, "sha256": _normalize_sha(meta.get("sha256"), meta.get("file_path"))}
+        ensure_file_meta(meta)
+        if not re.fullmatch(r"[0-9a-f]{64}", meta["sha256"]):
+            raise ValueError(f"invalid sha256 for {meta.get('original_name')}")
+        fields = normalize_from_result_json(result_json)
+        return (
+            employee_id, member_name, meta["original_name"], meta["file_path"],
+            meta["mime_type"], meta["file_size_bytes"], meta["sha256"],
+            fields["vendor_name"], fields["buyer_name"], fields["tax_id"],
+            fields["invoice_no"], fields["doc_date"], fields["total_amount"],
+            fields["deduction_status"], fields["deduction_reason"],
+            json.dumps(result_json, ensure_ascii=False),
+        )
+
+    def _upsert_documents(self, cur, rows, page_size):
+        """INSERT หลายแถว ON CONFLICT (employee_id, sha256) DO UPDATE คืน {sha256: id}"""
+        returned = execute_values(cur, """
+            INSERT INTO document (
+                employee_id, member_name, original_name, file_path, mime_type,
+                file_size_bytes, sha256,
+                vendor_name, buyer_name, tax_id, invoice_no, doc_date, total_amount,
+                deduction_status, deduction_reason,
+                result_json
             )
-            self.cursor.execute(sql, values)
-            row = self.cursor.fetchone()
-
-            if row:
-                doc_id = row[0]  # insert ใหม่สำเร็จ
-            else:
-                # 2) มีอยู่แล้ว (ชนคีย์คู่ employee_id+sha256) → ดึง id เดิม
-                self.cursor.execute(
-                    "SELECT id FROM document WHERE employee_id = %s AND sha256 = %s",
-                    (employee_id, meta["sha256"])
-                )
-                found = self.cursor.fetchone()
-                if not found:
-                    return None
-                doc_id = found[0]
-
-                # (ออปชัน) อยากอัปเดตฟิลด์สรุป/ผลล่าสุด ก็ทำ UPDATE เพิ่มได้:
-                self.cursor.execute("""
-                    UPDATE document
-                    SET member_name = %s,
-                        vendor_name = COALESCE(%s, vendor_name),
-                        buyer_name  = COALESCE(%s, buyer_name),
-                        tax_id      = COALESCE(%s, tax_id),
-                        invoice_no  = COALESCE(%s, invoice_no),
-                        doc_date    = COALESCE(%s, doc_date),
-                        total_amount= COALESCE(%s, total_amount),
-                        deduction_status = %s,
-                        deduction_reason = %s,
-                        result_json = %s
-                    WHERE id = %s
-                """, (
-                    member_name,
-                    fields["vendor_name"], fields["buyer_name"], fields["tax_id"],
-                    fields["invoice_no"], fields["doc_date"], fields["total_amount"],
-                    fields["deduction_status"], fields["deduction_reason"],
-                    json.dumps(result_json, ensure_ascii=False),
-                    doc_id
-                ))
-
-            if add_hist:
-                self.add_history(
-                    document_id=doc_id, stage="final",
-                    result_json=result_json,
-                    status=fields["deduction_status"], reason=fields["deduction_reason"],
-                    rules_version=rules_version
-                )
-            return doc_id
-
+            VALUES %s
+            ON CONFLICT (employee_id, sha256) DO UPDATE
+            SET member_name = EXCLUDED.member_name,
+                vendor_name = COALESCE(EXCLUDED.vendor_name, document.vendor_name),
+                buyer_name  = COALESCE(EXCLUDED.buyer_name, document.buyer_name),
+                tax_id      = COALESCE(EXCLUDED.tax_id, document.tax_id),
+                invoice_no  = COALESCE(EXCLUDED.invoice_no, document.invoice_no),
+                doc_date    = COALESCE(EXCLUDED.doc_date, document.doc_date),
+                total_amount= COALESCE(EXCLUDED.total_amount, document.total_amount),
+                deduction_status = EXCLUDED.deduction_status,
+                deduction_reason = EXCLUDED.deduction_reason,
+                result_json = EXCLUDED.result_json
+            RETURNING sha256, id
+        """, rows, template="(%s,%s,%s,%s,%s, %s,%s, %s,%s,%s,%s,%s,%s, %s,%s, %s::jsonb)",
+            page_size=page_size, fetch=True)
+        return {sha: doc_id for sha, doc_id in returned}
+
+    def _insert_documents_plain(self, cur, rows, page_size):
+        """INSERT หลายแถวแบบไม่มี ON CONFLICT (ยังไม่มี unique index) — ไฟล์ซ้ำได้แถวใหม่แบบเดิม คืน {sha256: id}"""
+        returned = execute_values(cur, """
+            INSERT INTO document (
+                employee_id, member_name, original_name, file_path, mime_type,
+                file_size_bytes, sha256,
+                vendor_name, buyer_name, tax_id, invoice_no, doc_date, total_amount,
+                deduction_status, deduction_reason,
+                result_json
+            )
+            VALUES %s
+            RETURNING sha256, id
+        """, rows, template="(%s,%s,%s,%s,%s, %s,%s, %s,%s,%s,%s,%s,%s, %s,%s, %s::jsonb)",
+            page_size=page_size, fetch=True)
+        return {sha: doc_id for sha, doc_id in returned}
+
+    def _insert_history_bulk(self, cur, rows, ids, rules_versions, page_size):
+        execute_values(cur, """
+            INSERT INTO document_result_history (document_id, stage, result_json, status, reason, rules_version)
+            VALUES %s
+        """, [
+            (ids[row[6]], "final", row[15], row[13], row[14], rules_versions[row[6]]) for row in rows
+        ], template="(%s, %s, %s::jsonb, %s, %s, %s)", page_size=page_size)
+
+    def insert_documents_bulk(self, employee_id, member_name, documents, rules_version=None,
+                              add_hist=True, page_size=500):
+        """
+        บันทึกหลายเอกสาร [{"meta": ..., "result_json": ...}] ใน transaction เดียว
+        INSERT หลายแถว ON CONFLICT (employee_id, sha256) DO UPDATE ... RETURNING id + แถว history ชุดเดียวกัน
+        (ถ้ายังไม่มี unique index — มีเอกสารซ้ำเดิมอยู่ — ใช้ INSERT ธรรมดา)
+        คืนผลรายแถวตามลำดับ [{"index", "ok", "id", "sha256", "error"}]
+        - แถวที่ meta/result_json ใช้ไม่ได้ได้ error ของแถวนั้น แถวอื่นยังบันทึก
+        - ไฟล์เดียวกันซ้ำใน batch = แถวหลังสุดชนะ ทุกแถวได้ id เดียวกัน
+        - ถ้าคำสั่งรวมล้ม จะลองใหม่ทีละแถว (savepoint) เพื่อบอกว่าแถวไหนผิด
+        """
+        results, prepared = [], {}
+        for i, doc in enumerate(documents):
+            res = {"index": i, "ok": False, "id": None, "sha256": None, "error": None}
+            results.append(res)
+            try:
+                result_json = doc.get("result_json") or {}
+                row = self._document_row(employee_id, member_name, dict(doc.get("meta") or {}), result_json)
+                version = rules_version or doc.get("rules_version") or result_json.get("rules_version")
+            except Exception as e:
+                res["error"] = f"{type(e).__name__}: {e}"
+                continue
+            res["sha256"] = row[6]
+            prepared.pop(row[6], None)  # ให้แถวหลังสุดอยู่ท้าย dict
+            prepared[row[6]] = (row, version)
+        if not prepared:
+            return results
+
+        rows = [row for row, _ in prepared.values()]
+        versions = {sha: version for sha, (_, version) in prepared.items()}
+        ids, errors = {}, {}
+        write = self._upsert_documents if self.has_document_unique_index() else self._insert_documents_plain
+        try:
+            with self.transaction() as cur:
+                ids = write(cur, rows, page_size)
+                if add_hist:
+                    self._insert_history_bulk(cur, rows, ids, versions, page_size)
         except Exception as e:
-            import traceback
-            print("DB insert error:", e)
-            traceback.print_exc()
-            return None
+            print("DB bulk insert error, retrying row by row:", e)
+            ids = {}
+            try:
+                with self.transaction() as cur:
+                    for row in rows:
+                        cur.execute("SAVEPOINT doc_row")
+                        try:
+                            got = write(cur, [row], page_size)
+                            if add_hist:
+                                self._insert_history_bulk(cur, [row], got, versions, page_size)
+                            cur.execute("RELEASE SAVEPOINT doc_row")
+                            ids.update(got)
+                        except Exception as row_error:
+                            cur.execute("ROLLBACK TO SAVEPOINT doc_row")
+                            errors[row[6]] = f"{type(row_error).__name__}: {row_error}"
+            except Exception as e:
+                # connection ใช้ไม่ได้ทั้งก้อน — ไม่มีแถวไหนถูกบันทึก
+                ids, errors = {}, {sha: f"{type(e).__name__}: {e}" for sha in prepared}
+
+        for res in results:
+            sha = res["sha256"]
+            if sha is None:
+                continue
+            res["id"] = ids.get(sha)
+            res["ok"] = res["id"] is not None
+            res["error"] = errors.get(sha) if not res["ok"] else None
+        return results
 
     def get_all_document(self, employee_id):
         try:
@@ -354,6 +653,73 @@ class DatabaseConnection:
             print("Error fetching documents:", e)
             return []
 
+    def list_documents(self, employee_id, limit=50, cursor=None, sort="created_at", order="desc",
+                       deduction_status=None, vendor_name=None, date_from=None, date_to=None,
+                       include_result_json=False):
+        """
+        รายการเอกสารแบบแบ่งหน้า (keyset) เรียงตาม created_at หรือ doc_date แล้วตาม id
+        คืน {"documents": [...], "next_cursor": str | None}
+        ไม่ดึง result_json (JSONB ก้อนใหญ่) ยกเว้น include_result_json=True
+        """
+        if sort not in DOCUMENT_SORT_KEYS:
+            raise ValueError(f"sort must be one of {sorted(DOCUMENT_SORT_KEYS)}")
+        order = order.lower()
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be asc or desc")
+        limit = max(1, min(int(limit), DOCUMENT_LIST_MAX_LIMIT))
+
+        cols = DOCUMENT_SUMMARY_COLUMNS + (["result_json"] if include_result_json else [])
+        where, params = ["employee_id = %s"], [employee_id]
+        if deduction_status:
+            where.append("deduction_status = %s")
+            params.append(deduction_status)
+        if vendor_name:
+            where.append("vendor_name = %s")
+            params.append(vendor_name)
+        if date_from:
+            where.append("doc_date >= %s")
+            params.append(date_from)
+        if date_to:
+            where.append("doc_date <= %s")
+            params.append(date_to)
+
+        # NULL อยู่ท้ายเสมอ (doc_date อาจเป็น NULL, created_at ไม่มีทางเป็น NULL)
+        cmp = "<" if order == "desc" else ">"
+        if cursor:
+            value, last_id = decode_cursor(cursor, sort, order)
+            if value is None:
+                where.append(f"({sort} IS NULL AND id {cmp} %s)")
+                params.append(last_id)
+            elif sort == "created_at":
+                # row comparison ใช้ index (employee_id, created_at, id) ได้ตรง ๆ
+                where.append(f"(created_at, id) {cmp} (%s, %s)")
+                params.extend([value, last_id])
+            else:
+                where.append(f"((doc_date, id) {cmp} (%s, %s) OR doc_date IS NULL)")
+                params.extend([value, last_id])
+
+        sql = (
+            f"SELECT {', '.join(cols)} FROM document WHERE {' AND '.join(where)} "
+            f"ORDER BY {sort} {order.upper()} NULLS LAST, id {order.upper()} LIMIT %s"
+        )
+        params.append(limit + 1)
+
+        try:
+            cur = self.connection.cursor(cursor_factory=RealDictCursor)
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            cur.close()
+        except Exception as e:
+            print("Error listing documents:", e)
+            return {"documents": [], "next_cursor": None}
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(sort, order, last[sort], last["id"])
+        return {"documents": rows, "next_cursor": next_cursor}
+
     def get_per_document(self, document_id):
         try:
             self.cursor.execute(""" SELECT jsonb_build_object(
@@ -408,16 +774,90 @@ class DatabaseConnection:
             print("Error inserting history:", e)
             return False
 
+    # --------------------------
+    # Bulk re-evaluation
+    # --------------------------
+    def iter_result_batches(self, batch_size=500, employee_id=None):
+        """
+        yield list ของ (document_id, result_json, created_at) ทีละ batch ตามลำดับ id ผ่าน server-side named cursor
+        Postgres ส่งมาครั้งละ batch_size แถว จึงไม่ต้องโหลดทั้งตาราง
+        cursor ต้องอยู่ใน transaction — connection นี้ใช้อ่านอย่างเดียวจนกว่าจะอ่านจบ (เขียนผลด้วย connection อื่น)
+        """
+        where, params = "", []
+        if employee_id is not None:
+            where = "WHERE employee_id = %s"
+            params.append(employee_id)
+        self.connection.autocommit = False
+        try:
+            with self.connection.cursor(name="reevaluate_documents") as cur:
+                cur.itersize = batch_size
+                cur.execute(f"SELECT id, result_json, created_at FROM document {where} ORDER BY id", params)
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        return
+                    yield [
+                        (doc_id, result if isinstance(result, dict) else json.loads(result), created_at)
+                        for doc_id, result, created_at in rows
+                    ]
+        finally:
+            self.connection.rollback()
+            self.connection.autocommit = True
+
+    def update_results_bulk(self, results, rules_version=None, stage="reevaluate", page_size=500):
+        """
+        เขียนผลที่ตรวจใหม่ [(document_id, result_json)] กลับด้วย execute_values
+        อัปเดต deduction_status/deduction_reason/result_json และเพิ่มแถว document_result_history
+        (ติด rules_version) ใน transaction เดียว คืนจำนวนเอกสาร
+        """
+        rows = []
+        for doc_id, result_json in results:
+            fields = normalize_from_result_json(result_json)
+            rows.append((
+                doc_id, fields["deduction_status"], fields["deduction_reason"],
+                json.dumps(result_json, ensure_ascii=False),
+            ))
+        if not rows:
+            return 0
+        with self.transaction() as cur:
+            execute_values(cur, """
+                UPDATE document AS d
+                SET deduction_status = v.status,
+                    deduction_reason = v.reason,
+                    result_json = v.result_json
+                FROM (VALUES %s) AS v(id, status, reason, result_json)
+                WHERE d.id = v.id
+            """, rows, template="(%s, %s, %s, %s::jsonb)", page_size=page_size)
+            execute_values(cur, """
+                INSERT INTO document_result_history (document_id, stage, result_json, status, reason, rules_version)
+                VALUES %s
+            """, [(doc_id, stage, result, status, reason, rules_version) for doc_id, status, reason, result in rows],
+                template="(%s, %s, %s::jsonb, %s, %s, %s)", page_size=page_size)
+        return len(rows)
+
     def close(self):
         if self.connection:
             try:
                 self.cursor.close()
             except Exception:
                 pass
-            try:
-                self.connection.close()
-            except Exception:
-                pass
+            if self._pool is not None:
+                # คืน connection ให้ pool (ปิดทิ้งถ้าเสียไปแล้ว หรือหลุดกลาง transaction จนไม่รู้สถานะ)
+                try:
+                    broken = bool(self.connection.closed) or \
+                        self.connection.info.transaction_status == TRANSACTION_STATUS_UNKNOWN
+                    self._pool.putconn(self.connection, close=broken)
+                except Exception:
+                    pass
+                finally:
+                    self._slots.release()
+                    self._pool = None
+            else:
+                try:
+                    self.connection.close()
+                except Exception:
+                    pass
+            self.connection = None
 
     def ping(self):
         try:
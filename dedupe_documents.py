@@ -0,0 +1,37 @@
+"""
+migration: รวมเอกสารซ้ำ (employee_id, sha256) แล้วสร้าง unique index uq_document_emp_sha
+    python dedupe_documents.py [--employee-id 3]     # รายงานเอกสารซ้ำเท่านั้น (ไม่แก้ข้อมูล)
+    python dedupe_documents.py --apply               # รวมจริง: เก็บแถว id มากสุด ย้าย history มาไว้ที่แถวนั้น
+ทุกแถวที่ถูกลบถูกเก็บทั้งแถวเป็น document_result_history stage 'dedupe' ของแถวที่เก็บไว้
+ระหว่างที่ยังไม่มี index แอปบันทึกเอกสารด้วย INSERT ธรรมดา (ไฟล์ซ้ำได้แถวใหม่)
+"""
+import json, argparse
+
+from database.conn import DatabaseConnection
+
+
+def report(db: DatabaseConnection, employee_id=None):
+    groups = db.find_duplicate_documents(employee_id)
+    return {
+        "groups": len(groups),
+        "rows_to_remove": sum(len(g["ids"]) - 1 for g in groups),
+        "duplicates": [{**g, "keep_id": g["ids"][-1]} for g in groups],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report and merge duplicate (employee_id, sha256) documents")
+    parser.add_argument("--employee-id", type=int, default=None, help="รายงานเฉพาะพนักงานคนนี้ (ใช้กับ --apply ไม่ได้)")
+    parser.add_argument("--apply", action="store_true", help="รวมเอกสารซ้ำทั้งตารางแล้วสร้าง unique index")
+    args = parser.parse_args()
+    if args.apply and args.employee_id is not None:
+        parser.error("--apply merges the whole table; drop --employee-id")
+
+    with DatabaseConnection() as db:
+        if db.connection is None:
+            raise SystemExit("database unavailable")
+        found = report(db, args.employee_id)
+        print(json.dumps(found, ensure_ascii=False, indent=2))
+        if args.apply:
+            removed = db.dedupe_documents()
+            print(f"merged {found['groups']} groups, removed {removed} rows, created uq_document_emp_sha")
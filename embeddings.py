@@ -0,0 +1,153 @@
+import os, json, threading, argparse
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+# ---- Settings ----
+EMBEDDINGS_DIR = os.getenv("EMBEDDINGS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model"))
+EMBEDDINGS_NAME = "thai2fit_wv"
+# float32 = ผลเหมือน gensim ทุกประการ, float16 = ใช้หน่วยความจำครึ่งเดียว
+EMBEDDINGS_DTYPE = os.getenv("EMBEDDINGS_DTYPE", "float32")
+SENTENCE_VECTOR_CACHE_SIZE = int(os.getenv("SENTENCE_VECTOR_CACHE_SIZE", "10000"))
+
+
+def _paths(directory: str, name: str = EMBEDDINGS_NAME):
+    return os.path.join(directory, f"{name}.npy"), os.path.join(directory, f"{name}.vocab.json")
+
+
+class EmbeddingTable:
+    """
+    ตาราง word vector แบบกะทัดรัด: matrix (.npy แบบ memory-map) + dict token -> แถว
+    ใช้แทน gensim KeyedVectors ได้ในส่วนที่ prediction ใช้ (in, [], vector_size, key_to_index, vectors)
+    หลาย worker ที่ mmap ไฟล์เดียวกันจะใช้หน้าหน่วยความจำชุดเดียวกันผ่าน OS page cache
+    """
+
+    def __init__(self, vectors: np.ndarray, key_to_index: Dict[str, int], cache_key: Optional[str] = None):
+        self.vectors = vectors
+        self.key_to_index = key_to_index
+        self.vector_size = vectors.shape[1]
+        # ชื่อคงที่ของตาราง (path + mtime ของไฟล์) สำหรับ SentenceVectorCache
+        self.cache_key = cache_key
+
+    def __contains__(self, word) -> bool:
+        return word in self.key_to_index
+
+    def __getitem__(self, word) -> np.ndarray:
+        return self.vectors[self.key_to_index[word]]
+
+    def __len__(self) -> int:
+        return len(self.key_to_index)
+
+    @classmethod
+    def load(cls, directory: str = EMBEDDINGS_DIR, name: str = EMBEDDINGS_NAME) -> "EmbeddingTable":
+        npy_path, vocab_path = _paths(directory, name)
+        vectors = np.load(npy_path, mmap_mode="r")
+        with open(vocab_path, "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        cache_key = f"{os.path.abspath(npy_path)}:{os.stat(npy_path).st_mtime_ns}:{vectors.dtype}"
+        return cls(vectors, {w: i for i, w in enumerate(vocab)}, cache_key)
+
+    @staticmethod
+    def export(kv, directory: str = EMBEDDINGS_DIR, name: str = EMBEDDINGS_NAME, dtype: str = EMBEDDINGS_DTYPE):
+        """แปลง gensim KeyedVectors เป็น .npy + vocab.json (เขียนไฟล์ชั่วคราวก่อนแล้วค่อย rename)"""
+        npy_path, vocab_path = _paths(directory, name)
+        os.makedirs(directory, exist_ok=True)
+        vectors = np.asarray(kv.vectors, dtype=dtype)
+        tmp_npy, tmp_vocab = npy_path + f".{os.getpid()}.tmp", vocab_path + f".{os.getpid()}.tmp"
+        with open(tmp_npy, "wb") as f:
+            np.save(f, vectors)
+        with open(tmp_vocab, "w", encoding="utf-8") as f:
+            json.dump(list(kv.index_to_key), f, ensure_ascii=False)
+        os.replace(tmp_npy, npy_path)
+        os.replace(tmp_vocab, vocab_path)
+        return npy_path, vocab_path
+
+
+def _load_gensim_model():
+    from pythainlp import word_vector
+    return word_vector.WordVector(model_name="thai2fit_wv").get_model()
+
+
+def load_word_vectors(directory: str = EMBEDDINGS_DIR, dtype: str = EMBEDDINGS_DTYPE):
+    """
+    คืน EmbeddingTable แบบ mmap ถ้ามีไฟล์แล้ว ถ้ายังไม่มีจะสร้างจาก thai2fit ครั้งแรก
+    ถ้าสร้าง/เขียนไฟล์ไม่ได้ (เช่นดิสก์อ่านอย่างเดียว) จะคืน gensim model แบบเดิม
+    """
+    npy_path, vocab_path = _paths(directory)
+    if os.path.exists(npy_path) and os.path.exists(vocab_path):
+        return EmbeddingTable.load(directory)
+
+    kv = _load_gensim_model()
+    try:
+        EmbeddingTable.export(kv, directory, dtype=dtype)
+        print(f"[EMBEDDINGS] exported thai2fit to {npy_path} ({dtype})")
+        return EmbeddingTable.load(directory)
+    except Exception as e:
+        print("[EMBEDDINGS] export failed, using gensim model:", repr(e))
+        return kv
+
+
+def model_key(kv) -> str:
+    """
+    ชื่อคงที่ของตาราง vector สำหรับ key ของ cache — ไม่ใช้ id(kv) เพราะ id ถูกใช้ซ้ำได้หลังตารางเดิมถูกทิ้ง
+    EmbeddingTable ใช้ path + mtime ของไฟล์ ส่วน gensim model (thai2fit จาก pythainlp) ใช้ชื่อโมเดล
+    """
+    return getattr(kv, "cache_key", None) or f"{type(kv).__name__}:{EMBEDDINGS_NAME}"
+
+
+class SentenceVectorCache:
+    """LRU ของ (ตาราง vector ตาม model_key, ประโยคที่ทำความสะอาดแล้ว) -> sentence vector ใช้ร่วมกันทุก thread"""
+
+    def __init__(self, maxsize: int = SENTENCE_VECTOR_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kv, sentence: str) -> Optional[np.ndarray]:
+        key = (model_key(kv), sentence)
+        with self._lock:
+            vec = self._data.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, kv, sentence: str, vec: np.ndarray):
+        if self.maxsize <= 0:
+            return
+        key = (model_key(kv), sentence)
+        vec = np.array(vec, copy=True)
+        vec.setflags(write=False)
+        with self._lock:
+            self._data[key] = vec
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def status(self) -> Dict[str, Any]:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+# cache กลางของ process
+sentence_cache = SentenceVectorCache()
+
+
+if __name__ == "__main__":
+    # python embeddings.py build [--dtype float16] [--dir model]
+    parser = argparse.ArgumentParser(description="Export thai2fit word vectors to a compact mmap table")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--dir", default=EMBEDDINGS_DIR)
+    parser.add_argument("--dtype", default=EMBEDDINGS_DTYPE, choices=["float32", "float16"])
+    args = parser.parse_args()
+
+    npy, vocab = EmbeddingTable.export(_load_gensim_model(), args.dir, dtype=args.dtype)
+    print(f"wrote {npy} and {vocab}")
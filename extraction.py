@@ -1,16 +1,321 @@
-import os, re, json
-from openai import OpenAI
-from dotenv import load_dotenv
+import os, re, json, asyncio
+from typing import Dict, Optional
 from json.decoder import JSONDecodeError
+from typhoon_client import get_client, get_async_client, call, acall
+from result_cache import cache, make_key
+
+EXTRACT_MODEL = "typhoon-v2.1-12b-instruct"
+# เปลี่ยนค่านี้ทุกครั้งที่แก้ bulid_prompt() เพื่อไม่ให้ใช้ผลเก่าใน cache
+PROMPT_VERSION = "1"
+# deterministic = temperature 0: markdown เดิมได้ผลเดิมเสมอ ใช้ผลจาก cache แทนการเรียก LLM ซ้ำได้เต็มที่
+EXTRACT_DETERMINISTIC = os.getenv("EXTRACT_DETERMINISTIC", "0").lower() in ("1", "true", "yes")
+EXTRACT_TEMPERATURE = 0.0 if EXTRACT_DETERMINISTIC else 0.5
+# อายุของผล extraction ใน cache (วินาที, 0 = ไม่หมดอายุ) ขนาดรวมคุมโดย RESULT_CACHE_MAX_BYTES
+EXTRACT_CACHE_TTL = float(os.getenv("EXTRACT_CACHE_TTL", str(30 * 24 * 3600)))
+# ไม่อ่านผลจาก cache เลย (ยังเขียนผลใหม่ทับให้)
+EXTRACT_CACHE_BYPASS = os.getenv("EXTRACT_CACHE_BYPASS", "0").lower() in ("1", "true", "yes")
+
+
+def extraction_cache_key(markdown: str, temperature: float = EXTRACT_TEMPERATURE) -> str:
+    """key = hash(markdown + prompt version + model + temperature)"""
+    return make_key(markdown, PROMPT_VERSION, EXTRACT_MODEL, repr(float(temperature)))
+
+
+def _cacheable(out: dict) -> bool:
+    # ไม่เก็บผลที่ parse JSON ไม่ได้ จะได้ลองใหม่ครั้งหน้า
+    data = out.get("json")
+    return not (isinstance(data, dict) and data.get("_parse_error"))
+
+
+# ---- Local (regex/template) extraction ----
+# เปิด/ปิดการดึงข้อมูลด้วย regex ก่อนเรียก LLM
+LOCAL_EXTRACTION = os.getenv("LOCAL_EXTRACTION", "1").lower() in ("1", "true", "yes")
+# ถ้าดึงได้ครบและผ่านการตรวจ ไม่ต้องเรียก LLM เลย
+# name_company ไม่อยู่ในนี้ — regex ดึงไม่ได้ (ต้องค้นจาก tax_id) ได้จาก LLM เฉพาะเมื่อเรียก LLM อยู่แล้ว
+REQUIRED_FIELDS = ("title", "seller", "tax_id", "date", "total")
+# โครง JSON เดียวกับที่ bulid_prompt() ขอจาก LLM
+EXTRACT_FIELDS = (
+    "title", "invoice_type", "seller", "seller_address", "buyer", "buyer_address", "tax_id", "date",
+    "invoice_no", "items", "subtotal", "vat", "total", "amount_text", "warranty_period", "name_company",
+)
+
+THAI_MONTHS = {
+    "มกราคม": 1, "กุมภาพันธ์": 2, "มีนาคม": 3, "เมษายน": 4, "พฤษภาคม": 5, "มิถุนายน": 6,
+    "กรกฎาคม": 7, "สิงหาคม": 8, "กันยายน": 9, "ตุลาคม": 10, "พฤศจิกายน": 11, "ธันวาคม": 12,
+    "ม.ค.": 1, "ก.พ.": 2, "มี.ค.": 3, "เม.ย.": 4, "พ.ค.": 5, "มิ.ย.": 6,
+    "ก.ค.": 7, "ส.ค.": 8, "ก.ย.": 9, "ต.ค.": 10, "พ.ย.": 11, "ธ.ค.": 12,
+}
+_MONTH_RE = "|".join(re.escape(m) for m in sorted(THAI_MONTHS, key=len, reverse=True))
+
+TAX_ID_LABEL_RE = re.compile(r"(?:เลขประจำตัวผู้เสียภาษี(?:อากร)?|เลขที่ผู้เสียภาษี|เลขทะเบียนนิติบุคคล|Tax\s*ID|TAX\s*I\.?D\.?)", re.I)
+TAX_ID_RE = re.compile(r"(?<!\d)(\d(?:[ -]?\d){12})(?!\d)")
+INVOICE_NO_RE = re.compile(
+    r"(?:เลขที่ใบกำกับ(?:ภาษี)?|เลขที่ใบเสร็จ(?:รับเงิน)?|เลขที่เอกสาร|Invoice\s*No\.?|Receipt\s*No\.?|เลขที่)"
+    r"\s*[:：]?\s*([A-Z0-9][A-Z0-9\-/]{2,})", re.I
+)
+DATE_LABEL_RE = re.compile(r"(?:วันที่|ณ\s*วันที่|Date)", re.I)
+DATE_NUMERIC_RE = re.compile(r"(?<!\d)(\d{1,2})[/.\-](\d{1,2})[/.\-](\d{4}|\d{2})(?!\d)")
+DATE_THAI_RE = re.compile(rf"(?<!\d)(\d{{1,2}})\s*({_MONTH_RE})\s*(\d{{4}}|\d{{2}})(?!\d)")
+AMOUNT = r"([\d,]+\.\d{2})"
+TOTAL_LABELS = (
+    "ยอดรวมสุทธิ", "รวมทั้งสิ้น", "จำนวนเงินรวมทั้งสิ้น", "ยอดชำระ", "จำนวนเงินที่ชำระ",
+    "จำนวนเงินรวม", "รวมเงิน", "Grand\\s*Total", "Total\\s*Amount", "Total",
+)
+SUBTOTAL_RE = re.compile(r"(?:รวมเงิน(?:ก่อนภาษี)?|มูลค่าสินค้า|Sub\s*Total)\s*[:：]?\s*(?:THB|บาท|฿)?\s*" + AMOUNT, re.I)
+VAT_RE = re.compile(r"(?:ภาษีมูลค่าเพิ่ม|VAT)\s*(?:7\s*%)?\s*[:：]?\s*(?:THB|บาท|฿)?\s*" + AMOUNT, re.I)
+SELLER_RE = re.compile(r"(บริษัท\s*[^\n|]{2,80}?\s*จำกัด(?:\s*\(มหาชน\))?)")
+WARRANTY_RE = re.compile(r"(?:ระยะเวลา(?:เอา)?ประกัน(?:ภัย)?|ระยะเวลาชำระเบี้ย|อายุสัญญา|ระยะเวลาการถือครอง)\s*[:：]?\s*(\d{1,2})\s*ปี")
+
+
+def valid_tax_id(tax_id) -> bool:
+    """เลขประจำตัวผู้เสียภาษี 13 หลักพร้อม check digit (หลักที่ 13 = (11 - sum(d_i * (13 - i)) % 11) % 10)"""
+    digits = re.sub(r"\D", "", str(tax_id or ""))
+    if len(digits) != 13:
+        return False
+    total = sum(int(d) * (13 - i) for i, d in enumerate(digits[:12]))
+    return (11 - total % 11) % 10 == int(digits[12])
+
+
+def _to_be_year(year: int) -> int:
+    """แปลงปีเป็น พ.ศ. (รองรับ ค.ศ. และปี 2 หลัก)"""
+    if year < 100:
+        # 2 หลัก: 60-99 ถือเป็น พ.ศ. 25xx, นอกนั้นเป็น ค.ศ. 20xx
+        return 2500 + year if year >= 60 else 2000 + year + 543
+    return year + 543 if year < 2400 else year
+
+
+def _date_dict(day: int, month: int, year: int) -> Optional[dict]:
+    if not (1 <= day <= 31 and 1 <= month <= 12):
+        return None
+    return {"day": f"{day:02d}", "month": f"{month:02d}", "year": str(_to_be_year(year))}
+
+
+def valid_date(date) -> bool:
+    if not isinstance(date, dict):
+        return False
+    try:
+        return int(date["day"]) >= 1 and 1 <= int(date["month"]) <= 12 and 2400 <= int(date["year"]) <= 2700
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def _valid_amount(value) -> bool:
+    try:
+        return float(str(value).replace(",", "")) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+# ตรวจความถูกต้องของ field ก่อนยอมรับผลจาก regex (field ที่ไม่อยู่ในนี้แค่ต้องไม่ว่าง)
+FIELD_VALIDATORS = {
+    "tax_id": valid_tax_id,
+    "date": valid_date,
+    "total": _valid_amount,
+}
+
+
+def field_ok(field: str, value) -> bool:
+    if value in (None, "", [], {}):
+        return False
+    check = FIELD_VALIDATORS.get(field)
+    return check(value) if check else True
+
+
+class DocumentTemplate:
+    """
+    แม่แบบของเอกสาร layout คงที่ (กองทุน SSF/RMF, PVD, Easy E-Receipt, ...)
+    - keywords: ถ้าเจอคำใดคำหนึ่งใน markdown ถือว่าเป็นเอกสารชนิดนี้ (ทั้งคำ — "SSF" ไม่นับใน "SSFX")
+    - title_keywords: บรรทัดแรกที่มีคำเหล่านี้ใช้เป็น title (ค่าเริ่มต้น = keywords)
+    - patterns: regex เฉพาะของแม่แบบ field -> pattern (group 1 คือค่า) ใช้ก่อน regex ทั่วไป
+    """
+
+    def __init__(self, name: str, keywords, title_keywords=None, patterns: Dict[str, str] = None):
+        self.name = name
+        self.keywords = tuple(keywords)
+        self.title_keywords = tuple(title_keywords or keywords)
+        self.patterns = {f: re.compile(p, re.I) for f, p in (patterns or {}).items()}
+        # \b ใช้กับภาษาไทยไม่ได้ (อักษรไทยนับเป็น \w) จึงกันเฉพาะตัวอักษร/ตัวเลขละตินที่ติดกัน
+        self._keyword_re = re.compile(
+            "|".join(rf"(?<![A-Za-z0-9]){re.escape(k)}(?![A-Za-z0-9])" for k in self.keywords), re.I
+        )
+
+    def match(self, text: str) -> bool:
+        return self._keyword_re.search(text) is not None
+
+    def find_title(self, text: str) -> Optional[str]:
+        for line in text.splitlines():
+            if any(k.lower() in line.lower() for k in self.title_keywords):
+                title = re.sub(r"<[^>]+>|[#*|_`]", " ", line)
+                title = re.sub(r"\s+", " ", title).strip()
+                if title:
+                    return title
+        return None
+
+
+DOCUMENT_TEMPLATES = [
+    DocumentTemplate(
+        "ssf_rmf",
+        keywords=("กองทุนรวมเพื่อการออม", "กองทุนรวมเพื่อการเลี้ยงชีพ", "SSF", "RMF"),
+        title_keywords=("หนังสือรับรอง", "กองทุนรวมเพื่อการออม", "กองทุนรวมเพื่อการเลี้ยงชีพ"),
+        patterns={"total": r"(?:จำนวนเงินที่ซื้อ|มูลค่าการซื้อ|จำนวนเงินลงทุน|ยอดซื้อรวม)[^\d\n]{0,20}" + AMOUNT},
+    ),
+    DocumentTemplate(
+        "pvd",
+        keywords=("กองทุนสำรองเลี้ยงชีพ", "Provident Fund"),
+        title_keywords=("หนังสือรับรอง", "กองทุนสำรองเลี้ยงชีพ", "Provident Fund"),
+        patterns={"total": r"(?:เงินสะสม(?:ของสมาชิก)?|เงินสะสมส่วนของลูกจ้าง)[^\d\n]{0,20}" + AMOUNT},
+    ),
+    DocumentTemplate(
+        "insurance_premium",
+        keywords=("หนังสือรับรองการชำระเบี้ยประกัน",),
+        patterns={"total": r"(?:รวมเบี้ยประกัน(?:ภัย)?|เบี้ยประกันภัยรวม|รวมทั้งสิ้น)[^\d\n]{0,20}" + AMOUNT},
+    ),
+    DocumentTemplate(
+        "easy_e_receipt",
+        keywords=("e-Tax Invoice", "e-Receipt", "ใบกำกับภาษีอิเล็กทรอนิกส์", "ใบรับอิเล็กทรอนิกส์"),
+        title_keywords=("ใบกำกับภาษี", "ใบเสร็จรับเงิน", "ใบรับ", "e-Tax Invoice", "e-Receipt"),
+    ),
+]
+
+
+def register_template(template: DocumentTemplate, first: bool = False):
+    """เพิ่มแม่แบบใหม่ (first=True ให้ถูกตรวจก่อนแม่แบบเดิม)"""
+    if first:
+        DOCUMENT_TEMPLATES.insert(0, template)
+    else:
+        DOCUMENT_TEMPLATES.append(template)
+
+
+class LocalExtractor:
+    """ดึง field จาก OCR markdown ด้วยแม่แบบ + regex แบบเดียวกับ TransactionExtractor.extract_transaction_id"""
+
+    def __init__(self, templates=None):
+        self.templates = DOCUMENT_TEMPLATES if templates is None else templates
+
+    def match(self, text: str) -> Optional[DocumentTemplate]:
+        return next((t for t in self.templates if t.match(text)), None)
+
+    @staticmethod
+    def find_tax_id(text: str) -> Optional[str]:
+        # เลขที่อยู่หลังป้าย "เลขประจำตัวผู้เสียภาษี" ก่อน แล้วค่อยเลขอื่นที่ checksum ผ่าน
+        labelled = []
+        for m in TAX_ID_LABEL_RE.finditer(text):
+            found = TAX_ID_RE.search(text, m.end(), m.end() + 40)
+            if found:
+                labelled.append(found.group(1))
+        for candidate in labelled + TAX_ID_RE.findall(text):
+            digits = re.sub(r"\D", "", candidate)
+            if valid_tax_id(digits):
+                return digits
+        return None
+
+    @staticmethod
+    def find_date(text: str) -> Optional[dict]:
+        # วันที่ที่อยู่หลังป้าย "วันที่" ก่อน แล้วค่อยวันที่แรกในเอกสาร
+        spans = [text[m.end():m.end() + 40] for m in DATE_LABEL_RE.finditer(text)] + [text]
+        for span in spans:
+            m = DATE_THAI_RE.search(span)
+            if m:
+                date = _date_dict(int(m.group(1)), THAI_MONTHS[m.group(2)], int(m.group(3)))
+                if date:
+                    return date
+            m = DATE_NUMERIC_RE.search(span)
+            if m:
+                date = _date_dict(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+                if date:
+                    return date
+        return None
+
+    @staticmethod
+    def find_total(text: str) -> Optional[str]:
+        # ยอดรวมมักอยู่ท้ายเอกสาร — ใช้ป้ายที่เจาะจงที่สุดที่เจอ และตัวเลขตัวสุดท้ายของป้ายนั้น
+        for label in TOTAL_LABELS:
+            found = re.findall(rf"{label}\s*[:：]?\s*(?:THB|บาท|฿)?\s*{AMOUNT}", text, re.I)
+            if found:
+                return found[-1]
+        return None
+
+    @staticmethod
+    def _first(regex, text: str) -> Optional[str]:
+        m = regex.search(text)
+        return m.group(1).strip() if m else None
+
+    def extract(self, markdown: str, invoice_type: str = "Unknown"):
+        """
+        คืน (data, sources, template) — data มีทุก field ตาม EXTRACT_FIELDS (ไม่เจอ = None)
+        sources[field] = "local" สำหรับ field ที่ดึงได้ ถ้าไม่เข้าแม่แบบใดเลยคืน template = None
+        """
+        template = self.match(markdown)
+        data = {field: None for field in EXTRACT_FIELDS}
+        data["invoice_type"] = invoice_type
+        if template is None:
+            return data, {}, None
+
+        data.update({
+            "title": template.find_title(markdown),
+            "seller": self._first(SELLER_RE, markdown),
+            "tax_id": self.find_tax_id(markdown),
+            "date": self.find_date(markdown),
+            "invoice_no": self._first(INVOICE_NO_RE, markdown),
+            "subtotal": self._first(SUBTOTAL_RE, markdown),
+            "vat": self._first(VAT_RE, markdown),
+            "total": self.find_total(markdown),
+            "warranty_period": self._first(WARRANTY_RE, markdown),
+        })
+        for field, regex in template.patterns.items():
+            value = self._first(regex, markdown)
+            if value:
+                data[field] = value
+
+        sources = {f: "local" for f, v in data.items() if f != "invoice_type" and field_ok(f, v)}
+        for field in list(data):
+            if field not in sources and field != "invoice_type":
+                data[field] = None
+        if sources.get("title") and sources.get("total"):
+            # รายการเดียวจาก title/total — merge_extraction ใช้ก็ต่อเมื่อ LLM ไม่ได้ items มา
+            data["items"] = [{"name": data["title"], "quantity": None, "unit_price": None, "total_price": data["total"]}]
+            sources["items"] = "local"
+        # name_company ไม่ดึงเอง (เว้นแต่แม่แบบมี pattern ของมัน): FindInvoiceCompany เทียบกับ seller
+        # ถ้าเอามาจาก seller จะผ่านเสมอ
+        return data, sources, template
+
+
+local_extractor = LocalExtractor()
+
+
+# field ที่ค่าจาก regex เป็นแค่ค่าสำรอง — ใช้เมื่อ LLM ไม่ได้ค่ามา (items ของ LLM แยกรายการครบกว่า)
+LOCAL_FALLBACK_FIELDS = ("items",)
+
+
+def merge_extraction(local: dict, local_sources: Dict[str, str], llm: dict):
+    """รวมผล: field ที่ regex ดึงได้และผ่านการตรวจใช้ค่าจาก regex ที่เหลือใช้ค่าจาก LLM"""
+    if not isinstance(llm, dict) or llm.get("_parse_error"):
+        llm = {}
+    merged, sources = dict(llm), {}
+    for field in EXTRACT_FIELDS:
+        if field == "invoice_type":
+            merged[field] = local.get(field) or llm.get(field)
+            continue
+        if field in LOCAL_FALLBACK_FIELDS and _llm_source(field, llm.get(field)):
+            sources[field] = _llm_source(field, llm.get(field))
+        elif field in local_sources:
+            merged[field] = local[field]
+            sources[field] = "local"
+        else:
+            sources[field] = _llm_source(field, llm.get(field))
+    return merged, sources
+
+
+def _llm_source(field: str, value) -> Optional[str]:
+    if value in (None, "", [], {}):
+        return None
+    # ค่าจาก LLM ที่ไม่ผ่านการตรวจ (เช่น tax id checksum ผิด) ยังคงไว้แต่ระบุให้รู้
+    return "llm" if field_ok(field, value) else "llm_unverified"
 
 
 class InvoiceExtractor:
     def __init__(self, markdown):
-        load_dotenv()
-        self.client = OpenAI(
-            api_key=os.getenv("TYPHOON_OCR_API_KEY"),
-            base_url="https://api.opentyphoon.ai/v1"
-        )
+        self.client = get_client()
         self.markdown = markdown
         self.invoice_type = self.detect_invoice_type()  # ตรวจชนิดก่อน
 
@@ -69,16 +374,99 @@ class InvoiceExtractor:
                 return json.loads(m.group())
             raise
         
+    def _request(self) -> dict:
+        return {
+            "model": EXTRACT_MODEL,
+            "messages": [{"role": "user", "content": self.bulid_prompt()}],
+            "temperature": EXTRACT_TEMPERATURE,
+            "max_tokens": 1024,
+        }
+
     def typhoon_extract(self) -> dict:
-        prompt = self.bulid_prompt()
-        resp = self.client.chat.completions.create(
-            model="typhoon-v2.1-12b-instruct",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.5,
-            max_tokens=1024,
-        )
-        raw = resp.choices[0].message.content
+        request = self._request()
+        resp = call("extract", lambda: self.client.chat.completions.create(**request))
+        return self._parse_response(resp.choices[0].message.content)
+
+    async def atyphoon_extract(self) -> dict:
+        """typhoon_extract แบบ async ผ่าน AsyncOpenAI (จำกัดจำนวน request พร้อมกันด้วย semaphore กลาง)"""
+        request = self._request()
+        client = get_async_client()
+        resp = await acall("extract", lambda: client.chat.completions.create(**request))
+        return self._parse_response(resp.choices[0].message.content)
+
+    def cached_extract(self, bypass_cache: bool = EXTRACT_CACHE_BYPASS) -> dict:
+        """typhoon_extract ที่ใช้ผลจาก cache ถ้า markdown นี้เคยถูก extract ด้วย prompt/model เดียวกันแล้ว"""
+        key = extraction_cache_key(self.markdown)
+        out = None if bypass_cache else cache.get("extract", key, ttl=EXTRACT_CACHE_TTL)
+        if out is None:
+            out = self.typhoon_extract()
+            if _cacheable(out):
+                cache.put("extract", key, out)
+        return out
+
+    async def acached_extract(self, bypass_cache: bool = EXTRACT_CACHE_BYPASS) -> dict:
+        # cache เป็น SQLite (sync) — อ่าน/เขียนใน thread ไม่บล็อก event loop
+        key = extraction_cache_key(self.markdown)
+        out = None if bypass_cache else await asyncio.to_thread(cache.get, "extract", key, ttl=EXTRACT_CACHE_TTL)
+        if out is None:
+            out = await self.atyphoon_extract()
+            if _cacheable(out):
+                await asyncio.to_thread(cache.put, "extract", key, out)
+        return out
+
+    def _local(self):
+        """ผลจากแม่แบบ/regex (data, sources, template) หรือ None ถ้าปิดไว้/ไม่เข้าแม่แบบใด"""
+        if not LOCAL_EXTRACTION:
+            return None
+        data, sources, template = local_extractor.extract(self.markdown, self.invoice_type)
+        return (data, sources, template) if template is not None else None
+
+    @staticmethod
+    def _complete(local) -> bool:
+        return local is not None and all(f in local[1] for f in REQUIRED_FIELDS)
+
+    def extract(self, bypass_cache: bool = EXTRACT_CACHE_BYPASS) -> dict:
+        """
+        ลองแม่แบบ/regex ก่อน ถ้าได้ field ที่จำเป็น (REQUIRED_FIELDS) ครบและผ่านการตรวจจะไม่เรียก LLM
+        ไม่งั้นเรียก LLM (ผ่าน cache) แล้วรวมผล โดย json["extraction"]["field_sources"] บอกที่มาของแต่ละ field
+        """
+        local = self._local()
+        if self._complete(local):
+            return self._result(local, None)
+        return self._result(local, self.cached_extract(bypass_cache))
+
+    async def aextract(self, bypass_cache: bool = EXTRACT_CACHE_BYPASS) -> dict:
+        local = self._local()
+        if self._complete(local):
+            return self._result(local, None)
+        return self._result(local, await self.acached_extract(bypass_cache))
+
+    def _result(self, local, out) -> dict:
+        if out is None:
+            data, sources, template = local
+            data = dict(data)
+            data["extraction"] = {
+                "path": "local",
+                "template": template.name,
+                "field_sources": {f: sources.get(f) for f in EXTRACT_FIELDS if f != "invoice_type"},
+            }
+            return {"invoice_type": self.invoice_type, "raw": None, "fixed": None, "json": data}
+
+        llm = out.get("json")
+        if not isinstance(llm, dict) or (local is None and llm.get("_parse_error")):
+            return out
+        if local is not None:
+            merged, sources = merge_extraction(local[0], local[1], llm)
+            path, template = ("local+llm" if any(v == "local" for v in sources.values()) else "llm"), local[2].name
+        else:
+            merged = dict(llm)
+            sources = {f: _llm_source(f, llm.get(f)) for f in EXTRACT_FIELDS}
+            path, template = "llm", None
+        sources.pop("invoice_type", None)
+        merged["extraction"] = {"path": path, "template": template, "field_sources": sources}
+        return {**out, "json": merged}
 
+    def _parse_response(self, raw: str) -> dict:
         fixed = re.sub(
             r'(?<=:\s)(\d{1,3}(?:,\d{3})+(?:\.\d+)?)(?=,|\n|\})',
             lambda m: m.group(1).replace(',', ''),
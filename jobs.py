@@ -0,0 +1,263 @@
+import os, json, uuid, socket, sqlite3, threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from prepro import FileHandler
+from pipeline import DocumentPipeline
+from upload_store import download_path
+
+# ---- Settings ----
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs", "jobs.sqlite3"))
+# จำนวนเอกสารที่ประมวลผลพร้อมกัน (แต่ละเอกสารยังแยกหน้าขนานกันเองตาม PIPELINE_WORKERS)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    """owner = "<host>:<pid>:<token>" ของ JobQueue ที่ claim job — process นั้นยังอยู่ไหม (เครื่องอื่นถือว่ายังอยู่)"""
+    try:
+        host, pid, _ = owner.split(":")
+        pid = int(pid)
+    except (AttributeError, ValueError):
+        return False
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """เก็บสถานะ job และผลรายหน้าไว้ใน SQLite เพื่อให้อยู่รอดหลัง restart"""
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id          TEXT PRIMARY KEY,
+            status      TEXT NOT NULL,          -- queued / running / done / failed
+            owner       TEXT,                   -- JobQueue ที่ claim ไปรัน
+            file_name   TEXT NOT NULL,
+            file_path   TEXT NOT NULL,
+            total_pages INTEGER,
+            done_pages  INTEGER NOT NULL DEFAULT 0,
+            error       TEXT,
+            created_at  TEXT NOT NULL,
+            updated_at  TEXT NOT NULL
+        )""")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS job_pages (
+            job_id  TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+            page    INTEGER NOT NULL,
+            ok      INTEGER NOT NULL,
+            stage   TEXT,
+            result  TEXT,
+            error   TEXT,
+            PRIMARY KEY (job_id, page)
+        )""")
+        # ไฟล์ฐานข้อมูลเดิมที่ยังไม่มีคอลัมน์ owner
+        if "owner" not in {r["name"] for r in self._db.execute("PRAGMA table_info(jobs)")}:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+        self._db.commit()
+
+    def _exec(self, sql: str, params=()):
+        with self._lock:
+            self._db.execute(sql, params)
+            self._db.commit()
+
+    def create(self, file_name: str, file_path: str) -> str:
+        job_id = uuid.uuid4().hex
+        now = _now()
+        self._exec(
+            "INSERT INTO jobs (id, status, file_name, file_path, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+            (job_id, file_name, file_path, now, now)
+        )
+        return job_id
+
+    def claim(self, job_id: str, owner: str) -> bool:
+        """
+        จอง job ที่ยัง queued ให้ owner แบบ atomic (หลาย worker/process ใช้ไฟล์เดียวกันได้)
+        คืน True ถ้า owner นี้ได้ job ไป — ต้องรันเฉพาะ job ที่ claim ได้เท่านั้น
+        """
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, updated_at = ? WHERE id = ? AND status = 'queued'",
+                (owner, _now(), job_id)
+            )
+            self._db.commit()
+        return cur.rowcount == 1
+
+    def requeue_orphans(self) -> int:
+        """job ที่ค้าง running แต่ owner ตายไปแล้ว (process ล่ม/restart) กลับเป็น queued ให้ claim ใหม่"""
+        with self._lock:
+            rows = self._db.execute("SELECT id, owner FROM jobs WHERE status = 'running'").fetchall()
+        count = 0
+        for r in rows:
+            if _owner_alive(r["owner"]):
+                continue
+            with self._lock:
+                # เทียบ owner เดิมด้วย — ถ้ามี worker อื่น requeue/claim ไปก่อนจะไม่ทับกัน
+                cur = self._db.execute(
+                    "UPDATE jobs SET status = 'queued', owner = NULL, updated_at = ? "
+                    "WHERE id = ? AND status = 'running' AND owner IS ?",
+                    (_now(), r["id"], r["owner"])
+                )
+                self._db.commit()
+            count += cur.rowcount
+        return count
+
+    def start(self, job_id: str, total_pages: Optional[int]):
+        with self._lock:
+            # เริ่มใหม่ทั้ง job (กรณี resume หลัง restart) — หน้าที่เคยทำแล้วจะได้ผลจาก result cache
+            self._db.execute("DELETE FROM job_pages WHERE job_id = ?", (job_id,))
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', total_pages = ?, done_pages = 0, error = NULL, updated_at = ? WHERE id = ?",
+                (total_pages, _now(), job_id)
+            )
+            self._db.commit()
+
+    def add_page(self, job_id: str, page_result: Dict[str, Any]):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO job_pages (job_id, page, ok, stage, result, error) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    job_id, page_result["page"], int(page_result["ok"]), page_result.get("stage"),
+                    json.dumps(page_result.get("result"), ensure_ascii=False) if page_result["ok"] else None,
+                    page_result.get("error"),
+                )
+            )
+            self._db.execute(
+                "UPDATE jobs SET done_pages = done_pages + 1, updated_at = ? WHERE id = ?", (_now(), job_id)
+            )
+            self._db.commit()
+
+    def finish(self, job_id: str, error: Optional[str] = None):
+        self._exec(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            ("failed" if error else "done", error, _now(), job_id)
+        )
+
+    def file_path(self, job_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT file_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["file_path"] if row else None
+
+    def pending(self):
+        """job ที่ยังรอคิว (เรียก requeue_orphans ก่อน เพื่อรวม job ที่ค้างตอน process ตาย)"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at"
+            ).fetchall()
+        return [r["id"] for r in rows]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            rows = self._db.execute(
+                "SELECT page, ok, stage, result, error FROM job_pages WHERE job_id = ? ORDER BY page", (job_id,)
+            ).fetchall()
+
+        pages, errors = {}, []
+        for r in rows:
+            if r["ok"]:
+                pages[str(r["page"])] = json.loads(r["result"])
+            else:
+                errors.append({"page": r["page"], "stage": r["stage"], "error": r["error"]})
+
+        job = dict(job)
+        job.pop("owner", None)
+        file_name = job.pop("file_name")
+        stored_name = os.path.basename(job.pop("file_path"))
+        job["progress"] = {"done": job.pop("done_pages"), "total": job.pop("total_pages")}
+        job["result"] = {
+            "file": file_name,
+            "pages": pages,
+            "errors": errors,
+            "download_path": download_path(stored_name, file_name),
+        }
+        return job
+
+
+class JobQueue:
+    """
+    รัน DocumentPipeline ใน thread pool แยกจาก event loop และบันทึกความคืบหน้าลง JobStore
+    รันเฉพาะ job ที่ claim ได้ (JobStore.claim) — หลาย worker ที่ใช้ JobStore เดียวกันไม่รัน job ซ้ำกัน
+    """
+
+    def __init__(self, store: JobStore = None, max_workers: int = JOB_WORKERS):
+        self.store = store or JobStore()
+        self.max_workers = max_workers
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._pool = None
+
+    def _claim_and_submit(self, job_id: str) -> bool:
+        if not self.store.claim(job_id, self.owner):
+            return False
+        self._pool.submit(self._run, job_id)
+        return True
+
+    def start(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        # ทำ job ที่ค้างจากรอบก่อนต่อ (เฉพาะที่ worker นี้ claim ได้)
+        self.store.requeue_orphans()
+        for job_id in self.store.pending():
+            self._claim_and_submit(job_id)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def submit(self, file_name: str, file_path: str) -> str:
+        job_id = self.store.create(file_name, file_path)
+        if self._pool is None:
+            self.start()
+        else:
+            self._claim_and_submit(job_id)
+        return job_id
+
+    def _run(self, job_id: str):
+        file_path = self.store.file_path(job_id)
+        if file_path is None:
+            return
+        try:
+            file_handler = FileHandler(file_path)
+            total = file_handler.count_pages() if file_handler.check_file_type() == "pdf" else 1
+            self.store.start(job_id, total)
+            for page_result in DocumentPipeline(file_handler).iter_results():
+                self.store.add_page(job_id, page_result)
+            self.store.finish(job_id)
+        except Exception as e:
+            print(f"❌ Job {job_id} failed: {e}")
+            self.store.finish(job_id, error=str(e))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+
+# queue กลางของ process — สร้างเมื่อเรียกใช้ครั้งแรก
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
@@ -0,0 +1,234 @@
+import os, sys, math, time, bisect, threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+# ---- Settings ----
+# จำนวนค่าล่าสุดต่อ stage ที่ใช้คำนวณ p50/p95/p99
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "2048"))
+# ขอบบนของแต่ละช่องใน histogram (วินาที)
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Resident set size ของ process ปัจจุบัน (bytes) หรือ None ถ้าอ่านไม่ได้"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        pass
+    return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """RSS สูงสุดตั้งแต่ process เริ่ม (bytes)"""
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS รายงานเป็น bytes, Linux เป็น KB
+        return rss if sys.platform == "darwin" else rss * 1024
+    except Exception:
+        return None
+
+
+class LatencyHistogram:
+    """histogram ของเวลา (ช่องสุดท้ายคือเกิน bucket สูงสุด) + ค่าล่าสุดสำหรับคำนวณ percentile"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window: int = METRICS_WINDOW):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.retries = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds: float, ok: bool = True):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.recent.append(seconds)
+        if not ok:
+            self.errors += 1
+
+    def quantiles(self) -> Dict[float, Optional[float]]:
+        values = sorted(self.recent)
+        if not values:
+            return {q: None for q in QUANTILES}
+        # nearest-rank
+        return {q: values[max(0, math.ceil(q * len(values)) - 1)] for q in QUANTILES}
+
+    def cumulative(self):
+        """[(le, จำนวนสะสม)] แบบ Prometheus"""
+        out, running = [], 0
+        for le, n in zip(list(self.buckets) + ["+Inf"], self.counts):
+            running += n
+            out.append((le, running))
+        return out
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "retries": self.retries,
+            "sum_seconds": round(self.total, 3),
+            "mean_seconds": round(self.total / self.count, 3) if self.count else None,
+            "p50": self.quantiles()[0.5],
+            "p95": self.quantiles()[0.95],
+            "p99": self.quantiles()[0.99],
+            "buckets": {f"le_{le}": n for le, n in self.cumulative()},
+        }
+
+
+class StageStats(LatencyHistogram):
+    def __init__(self):
+        super().__init__()
+        self.cpu_total = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+class PipelineMetrics:
+    """สถิติราย stage ของทั้ง process (ocr / extract / classify / ...) ใช้ร่วมกันทุก thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, StageStats] = {}
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def observe(self, stage: str, wall: float, cpu: Optional[float] = None,
+                bytes_in: Optional[int] = None, bytes_out: Optional[int] = None, ok: bool = True):
+        with self._lock:
+            st = self._stages.get(stage)
+            if st is None:
+                st = self._stages[stage] = StageStats()
+            st.observe(wall, ok)
+            st.cpu_total += cpu or 0.0
+            st.bytes_in += bytes_in or 0
+            st.bytes_out += bytes_out or 0
+
+    def register_collector(self, fn: Callable[[], List[str]]):
+        """fn() คืนบรรทัด Prometheus เพิ่มเติม (เช่น latency ของ Typhoon API)"""
+        self._collectors.append(fn)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                name: {**st.snapshot(), "cpu_seconds": round(st.cpu_total, 3),
+                       "bytes_in": st.bytes_in, "bytes_out": st.bytes_out}
+                for name, st in self._stages.items()
+            }
+
+    def render(self) -> str:
+        """ข้อความสำหรับ GET /metrics (Prometheus text format 0.0.4)"""
+        lines = []
+        with self._lock:
+            stages = list(self._stages.items())
+            lines += histogram_lines("pipeline_stage_duration_seconds", "Wall time per pipeline stage", "stage", stages)
+            lines += [
+                "# HELP pipeline_stage_cpu_seconds_total CPU time spent in each stage (thread time)",
+                "# TYPE pipeline_stage_cpu_seconds_total counter",
+            ] + [f'pipeline_stage_cpu_seconds_total{{stage="{n}"}} {st.cpu_total}' for n, st in stages]
+            lines += [
+                "# HELP pipeline_stage_bytes_total Bytes consumed and produced by each stage",
+                "# TYPE pipeline_stage_bytes_total counter",
+            ]
+            for n, st in stages:
+                lines.append(f'pipeline_stage_bytes_total{{stage="{n}",direction="in"}} {st.bytes_in}')
+                lines.append(f'pipeline_stage_bytes_total{{stage="{n}",direction="out"}} {st.bytes_out}')
+            lines += [
+                "# HELP pipeline_stage_errors_total Failed stage executions",
+                "# TYPE pipeline_stage_errors_total counter",
+            ] + [f'pipeline_stage_errors_total{{stage="{n}"}} {st.errors}' for n, st in stages]
+
+        lines += [
+            "# HELP process_resident_memory_bytes Resident memory size in bytes",
+            "# TYPE process_resident_memory_bytes gauge",
+            f"process_resident_memory_bytes {current_rss_bytes() or 0}",
+            "# HELP process_peak_resident_memory_bytes Peak resident memory size in bytes",
+            "# TYPE process_peak_resident_memory_bytes gauge",
+            f"process_peak_resident_memory_bytes {peak_rss_bytes() or 0}",
+        ]
+        for fn in self._collectors:
+            try:
+                lines += fn()
+            except Exception as e:
+                print("[METRICS] collector error:", e)
+        return "\n".join(lines) + "\n"
+
+
+def histogram_lines(name: str, help_text: str, label: str, items) -> List[str]:
+    """histogram (bucket/sum/count) + summary p50/p95/p99 ของค่าล่าสุด สำหรับ [(ชื่อ, LatencyHistogram)]"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for key, hist in items:
+        for le, n in hist.cumulative():
+            lines.append(f'{name}_bucket{{{label}="{key}",le="{le}"}} {n}')
+        lines.append(f'{name}_sum{{{label}="{key}"}} {hist.total}')
+        lines.append(f'{name}_count{{{label}="{key}"}} {hist.count}')
+    summary = name.replace("_duration_seconds", "_latency_seconds")
+    lines += [f"# HELP {summary} {help_text} (recent window quantiles)", f"# TYPE {summary} summary"]
+    for key, hist in items:
+        for q, v in hist.quantiles().items():
+            if v is not None:
+                lines.append(f'{summary}{{{label}="{key}",quantile="{q}"}} {v}')
+        lines.append(f'{summary}_sum{{{label}="{key}"}} {hist.total}')
+        lines.append(f'{summary}_count{{{label}="{key}"}} {hist.count}')
+    return lines
+
+
+# สถิติกลางของ process
+metrics = PipelineMetrics()
+
+
+class measure:
+    """
+    วัด stage หนึ่งครั้ง: with measure("ocr", timings, bytes_in=len(png)) as m: ...; m.bytes_out = len(text)
+    - บันทึกลง metrics กลาง และลง timings[stage] (ถ้าส่ง dict มา) สำหรับแนบกับผลของหน้า
+    - cpu=False สำหรับโค้ดที่ await อยู่บน event loop (thread time จะปนกับ task อื่น)
+    """
+
+    def __init__(self, stage: str, timings: Optional[Dict[str, Any]] = None,
+                 bytes_in: Optional[int] = None, cpu: bool = True):
+        self.stage = stage
+        self.timings = timings
+        self.bytes_in = bytes_in
+        self.bytes_out = None
+        self.cpu = cpu
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time() if self.cpu else None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu if self.cpu else None
+        record(self.stage, self.timings, wall, cpu, self.bytes_in, self.bytes_out, ok=exc_type is None)
+        return False
+
+
+def record(stage: str, timings: Optional[Dict[str, Any]], wall: float, cpu: Optional[float] = None,
+           bytes_in: Optional[int] = None, bytes_out: Optional[int] = None, ok: bool = True):
+    """บันทึกผลวัดหนึ่งครั้งลง metrics กลาง และลง timings[stage] ถ้าส่ง dict ของหน้ามา"""
+    metrics.observe(stage, wall, cpu, bytes_in, bytes_out, ok)
+    if timings is None:
+        return
+    timings[stage] = {
+        "wall_seconds": round(wall, 4),
+        "cpu_seconds": round(cpu, 4) if cpu is not None else None,
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "rss_bytes": current_rss_bytes(),
+    }
+
+
+def page_summary(timings: Dict[str, Any], wall: Optional[float] = None) -> Dict[str, Any]:
+    """รวม timings ราย stage ของหน้าเป็น block ที่แนบไปกับผลของหน้า"""
+    rss = [t["rss_bytes"] for t in timings.values() if t.get("rss_bytes") is not None]
+    cpu = [t["cpu_seconds"] for t in timings.values() if t.get("cpu_seconds") is not None]
+    return {
+        "wall_seconds": round(wall, 4) if wall is not None else None,
+        "cpu_seconds": round(sum(cpu), 4),
+        "peak_rss_bytes": max(rss) if rss else None,
+        "stages": timings,
+    }
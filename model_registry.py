@@ -0,0 +1,174 @@
+import os, time, hashlib, threading
+from datetime import datetime
+from typing import Dict, Any, Optional, List
+
+from predict_category import prediction, load_models
+from embeddings import sentence_cache
+from metrics import current_rss_bytes
+
+# ---- Settings ----
+MODEL_DIR = os.getenv("MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model"))
+# ตรวจ mtime ของไฟล์ .pkl ไม่เกินทุก ๆ กี่วินาที (0 = ตรวจทุกครั้งที่เรียก)
+MODEL_RELOAD_INTERVAL = float(os.getenv("MODEL_RELOAD_INTERVAL", "5"))
+
+MODEL_FILES = {
+    "main_model_path": "voting_soft_best_v2.pkl",
+    "sub_personal_path": "sub_model_personal.pkl",
+    "sub_invest_path": "sub_model_invest.pkl",
+    "sub_assets_path": "sub_model_assets.pkl",
+    "sub_easy_path": "sub_model_easy_receipt.pkl",
+    "sub_donation_path": "sub_model_donation.pkl",
+}
+
+
+class ModelRegistry:
+    """
+    เก็บชุดโมเดลจัดหมวดหมู่ไว้ครั้งเดียวต่อ worker process
+    - โหลดครั้งแรกตอน warm_up() หรือเมื่อถูกเรียกใช้ครั้งแรก
+    - ถ้าไฟล์ .pkl ถูกแก้ (mtime เปลี่ยน) จะโหลดใหม่ให้อัตโนมัติ โดย thai2fit ใช้ตัวเดิม
+    - thread-safe: ผู้เรียกระหว่าง reload ยังใช้ชุดเดิมต่อได้จนกว่าชุดใหม่จะพร้อม
+    """
+
+    def __init__(self, model_dir: str = MODEL_DIR, reload_interval: float = MODEL_RELOAD_INTERVAL):
+        self.model_dir = model_dir
+        self.reload_interval = reload_interval
+        self._load_lock = threading.Lock()
+        self._models: Optional[Dict[str, Any]] = None
+        self._mtimes: Dict[str, float] = {}
+        self._last_check = 0.0
+        self._loaded_at = None
+        self._load_seconds = None
+        self._rss_delta = None
+        self._loads = 0
+        self._last_error = None
+
+    def _paths(self) -> Dict[str, str]:
+        return {k: os.path.join(self.model_dir, name) for k, name in MODEL_FILES.items()}
+
+    def _read_mtimes(self) -> Dict[str, float]:
+        return {path: os.path.getmtime(path) for path in self._paths().values()}
+
+    def _is_stale(self) -> bool:
+        now = time.monotonic()
+        if now - self._last_check < self.reload_interval:
+            return False
+        self._last_check = now
+        try:
+            return self._read_mtimes() != self._mtimes
+        except OSError:
+            # ไฟล์กำลังถูกเขียนทับ/หายชั่วคราว ใช้ชุดเดิมไปก่อน
+            return False
+
+    def _load(self):
+        rss_before = current_rss_bytes()
+        started = time.perf_counter()
+        try:
+            mtimes = self._read_mtimes()
+            prev = self._models or {}
+            models = load_models(
+                **self._paths(),
+                thai2vec_model=prev.get("thai2vec_model"),
+                stopwords=prev.get("stopwords"),
+            )
+        except Exception as e:
+            self._last_error = repr(e)
+            raise
+
+        if self._models is not None:
+            # reload: vector ที่ cache ไว้อาจมาจากตาราง/tokenizer ชุดเก่า
+            sentence_cache.clear()
+        self._models = models
+        self._mtimes = mtimes
+        self._last_check = time.monotonic()
+        self._load_seconds = round(time.perf_counter() - started, 3)
+        self._loaded_at = datetime.utcnow().isoformat() + "Z"
+        rss_after = current_rss_bytes()
+        if rss_before is not None and rss_after is not None:
+            self._rss_delta = rss_after - rss_before
+        self._loads += 1
+        self._last_error = None
+        print(f"[MODEL REGISTRY] loaded models in {self._load_seconds}s (load #{self._loads})")
+
+    def get(self) -> Dict[str, Any]:
+        """คืนชุดโมเดลปัจจุบัน โหลด/รีโหลดถ้าจำเป็น"""
+        if self._models is None or self._is_stale():
+            with self._load_lock:
+                # เช็คซ้ำหลังได้ lock เผื่อ thread อื่นโหลดเสร็จไปแล้ว
+                if self._models is None:
+                    self._load()
+                else:
+                    try:
+                        changed = self._read_mtimes() != self._mtimes
+                    except OSError:
+                        changed = False
+                    if changed:
+                        self._load()
+        return self._models
+
+    def fingerprint(self) -> str:
+        """
+        ค่าที่เปลี่ยนเมื่อไฟล์โมเดล .pkl เปลี่ยน (ชื่อ + mtime) ใช้เป็นส่วนหนึ่งของ key ของผลที่ cache ไว้
+        ใช้ mtime ของชุดที่โหลดอยู่ถ้ามี ไม่งั้นอ่านจากไฟล์ (ไม่โหลดโมเดล)
+        """
+        mtimes = self._mtimes
+        if not mtimes:
+            try:
+                mtimes = self._read_mtimes()
+            except OSError:
+                mtimes = {}
+        raw = "|".join(f"{os.path.basename(p)}:{m}" for p, m in sorted(mtimes.items()))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    def warm_up(self) -> bool:
+        try:
+            self.get()
+            return True
+        except Exception as e:
+            print("[MODEL REGISTRY] warm up failed:", repr(e))
+            return False
+
+    def classify(self, payload) -> Dict[str, Any]:
+        """เหมือน prediction(payload).run() แต่ใช้โมเดลที่โหลดไว้แล้ว"""
+        return prediction(payload, models=self.get()).run()
+
+    def classify_batch(self, payloads) -> List[Dict[str, Any]]:
+        """จัดหมวดหมู่หลายเอกสารด้วย predict ครั้งเดียวต่อโมเดล (ดู prediction.run_batch)"""
+        return prediction(None, models=self.get()).run_batch(payloads)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "loaded": self._models is not None,
+            "loaded_at": self._loaded_at,
+            "load_seconds": self._load_seconds,
+            "loads": self._loads,
+            "rss_bytes": current_rss_bytes(),
+            "rss_delta_bytes": self._rss_delta,
+            "model_dir": self.model_dir,
+            "last_error": self._last_error,
+            "word_vectors": type(self._models["thai2vec_model"]).__name__ if self._models else None,
+            "sentence_cache": sentence_cache.status(),
+        }
+
+
+# registry กลางของ process — ใช้ผ่านฟังก์ชันด้านล่าง
+registry = ModelRegistry()
+
+
+def warm_up() -> bool:
+    return registry.warm_up()
+
+
+def classify(payload) -> Dict[str, Any]:
+    return registry.classify(payload)
+
+
+def fingerprint() -> str:
+    return registry.fingerprint()
+
+
+def classify_batch(payloads) -> List[Dict[str, Any]]:
+    return registry.classify_batch(payloads)
+
+
+def status() -> Dict[str, Any]:
+    return registry.status()
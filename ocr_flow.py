@@ -1,74 +1,219 @@
 import re
 import os
-from typhoon_ocr import ocr_document
-from dotenv import load_dotenv
-from openai import OpenAI
+import json
+import base64
+import asyncio
+import hashlib
+import time
+from typhoon_ocr import ocr_document, get_prompt, prepare_ocr_messages
 from PyPDF2 import PdfReader
 from collections import defaultdict
 from prepro import ImageProcessor
+from concurrency import ordered_map, PIPELINE_WORKERS
+from typhoon_client import get_client, get_async_client, call, acall
+from result_cache import cache, make_key
+from metrics import measure, record
+
+OCR_MODEL = "typhoon-ocr-preview"
+# เปลี่ยนค่านี้เมื่อ prompt/พารามิเตอร์ของ OCR เปลี่ยน เพื่อไม่ให้ใช้ผลเก่าใน cache
+OCR_VERSION = f"{OCR_MODEL}:default:3"
+# ด้านยาวสุดของภาพที่ส่ง OCR (ค่าเดียวกับ target_image_dim ของ typhoon_ocr.ocr_document)
+OCR_TARGET_IMAGE_DIM = int(os.getenv("OCR_TARGET_IMAGE_DIM", "1800"))
+# เขียนภาพหลัง preprocess ลง output_dir ด้วย (ไว้ debug) — ปกติทำทุกอย่างในหน่วยความจำ
+OCR_DEBUG_IMAGES = os.getenv("OCR_DEBUG_IMAGES", "0").lower() in ("1", "true", "yes")
+# พารามิเตอร์เดียวกับที่ typhoon_ocr.ocr_document ใช้กับ task_type default/structure
+OCR_REQUEST_PARAMS = {
+    "max_tokens": 16384,
+    "extra_body": {
+        "repetition_penalty": 1.2,
+        "temperature": 0.1,
+        "top_p": 0.6,
+    },
+}
+
+def _image_bytes(img):
+    """ขนาดข้อมูลภาพของหน้า: pixel ของภาพ PIL หรือขนาดไฟล์ภาพ"""
+    if isinstance(img, str):
+        return os.path.getsize(img)
+    if hasattr(img, "getbands"):
+        return img.width * img.height * len(img.getbands())
+    return getattr(img, "nbytes", None)
+
 
 class OCRService:
     def __init__(self):
-        load_dotenv()
-        self.client = OpenAI(
-            api_key=os.getenv("TYPHOON_OCR_API_KEY"),
-            base_url="https://api.opentyphoon.ai/v1"
-        )
+        # ใช้ client กลางของ process (connection pool + keep-alive ร่วมกัน)
+        self.client = get_client()
 
     def run_ocr(self, image_path):
-        return ocr_document(
+        return call("ocr_document", lambda: ocr_document(
             pdf_or_image_path=image_path,
             task_type="default",
             page_num=1
+        ))
+
+    async def arun_ocr(self, image_path, task_type="default"):
+        """run_ocr แบบ async: เตรียมภาพใน thread แล้วส่ง request ผ่าน AsyncOpenAI"""
+        messages = await asyncio.to_thread(
+            prepare_ocr_messages, pdf_or_image_path=image_path, task_type=task_type, page_num=1
         )
+        client = get_async_client()
+        resp = await acall("ocr_document", lambda: client.chat.completions.create(
+            model=OCR_MODEL, messages=messages, **OCR_REQUEST_PARAMS
+        ))
+        return self._natural_text(resp)
+
+    @staticmethod
+    def _png_messages(png_bytes, width, height, task_type="default"):
+        """
+        สร้าง messages แบบเดียวกับ typhoon_ocr.ocr_document สำหรับไฟล์ภาพ
+        width/height ต้องเป็นขนาดของ png_bytes (ย่อเหลือ OCR_TARGET_IMAGE_DIM แล้ว)
+        """
+        anchor_text = f"Page dimensions: {width:.1f}x{height:.1f}\n[Image 0x0 to {width:.0f}x{height:.0f}]\n"
+        image_base64 = base64.b64encode(png_bytes).decode("ascii")
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": get_prompt(task_type)(anchor_text)},
+                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_base64}"}},
+                ],
+            }
+        ]
+
+    @staticmethod
+    def _natural_text(resp):
+        return json.loads(resp.choices[0].message.content)["natural_text"]
+
+    def run_ocr_png(self, png_bytes, width, height, task_type="default"):
+        """OCR จาก PNG ที่อยู่ในหน่วยความจำโดยตรง (ไม่ต้องเขียน/อ่านไฟล์)"""
+        messages = self._png_messages(png_bytes, width, height, task_type)
+        resp = call("ocr", lambda: self.client.chat.completions.create(
+            model=OCR_MODEL, messages=messages, **OCR_REQUEST_PARAMS
+        ))
+        return self._natural_text(resp)
+
+    async def arun_ocr_png(self, png_bytes, width, height, task_type="default"):
+        """run_ocr_png แบบ async (ไม่ใช้ thread ระหว่างรอ Typhoon)"""
+        messages = self._png_messages(png_bytes, width, height, task_type)
+        client = get_async_client()
+        resp = await acall("ocr", lambda: client.chat.completions.create(
+            model=OCR_MODEL, messages=messages, **OCR_REQUEST_PARAMS
+        ))
+        return self._natural_text(resp)
         
 class TransactionExtractor:
-    def __init__(self, ocr_service, output_dir="output", dpi=300):
+    def __init__(self, ocr_service, output_dir="output", dpi=300, max_workers=PIPELINE_WORKERS,
+                 debug_images=OCR_DEBUG_IMAGES, target_image_dim=OCR_TARGET_IMAGE_DIM):
         self.ocr_service = ocr_service
         self.data = defaultdict(list)
         self.output_dir = output_dir
         self.dpi = dpi
-        os.makedirs(self.output_dir, exist_ok=True)
+        self.max_workers = max_workers
+        self.debug_images = debug_images
+        self.target_image_dim = target_image_dim
+        # เวลาแปลง PDF เป็นภาพของแต่ละหน้า (iter_pages บันทึก ผู้เรียกดึงไปรวมกับ stage อื่นของหน้า)
+        self.page_timings = {}
+        if self.debug_images:
+            os.makedirs(self.output_dir, exist_ok=True)
 
-    def process_document(self, file_handler):
+    def iter_pages(self, file_handler):
+        """คืน (เลขหน้าเริ่มที่ 1, ภาพ PIL หรือ path ของไฟล์ภาพ)"""
         file_type = file_handler.check_file_type()
 
         if file_type == "pdf":
-            images = file_handler.pdf_to_images(dpi=self.dpi)
+            # ดึงทีละหน้าแบบ lazy — ordered_map จะขอหน้าถัดไปเมื่อมีช่องว่างใน pipeline เท่านั้น
+            images = file_handler.iter_pdf_pages(dpi=self.dpi)
         elif file_type == "image":
-            images = [file_handler.filepath]
+            yield 1, file_handler.filepath
+            return
         else:
             raise ValueError("ไฟล์ไม่รองรับ")
-        
-        print(images)
 
-        for i, img in enumerate(images):
-            try:
-                if file_type == "pdf":
-                    img_path = os.path.join(
-                        self.output_dir,
-                        f"{os.path.splitext(os.path.basename(file_handler.filepath))[0]}_page_{i+1}.png"
-                    )
-                    img.save(img_path, "PNG")                     
-                else:
-                    ext = os.path.splitext(file_handler.filepath)[1].lower()
-                    img_path = os.path.join(
-                        self.output_dir,
-                        f"{os.path.splitext(os.path.basename(file_handler.filepath))[0]}{ext}"
-                    )
-                    if file_handler.filepath != img_path:
-                        import shutil
-                        shutil.copy(file_handler.filepath, img_path)
-
-                    
-
-                ImageProcessor.preprocess_image(img_path, img_path)
-                markdown = self.ocr_service.run_ocr(img_path)
-                tid = self.extract_transaction_id(markdown, f"unknown_{i+1}")
-                self.data[tid].append(markdown)
+        page = 0
+        while True:
+            started, cpu_started = time.perf_counter(), time.thread_time()
+            img = next(images, None)
+            if img is None:
+                return
+            page += 1
+            record(
+                "rasterise", self.page_timings.setdefault(page, {}),
+                time.perf_counter() - started, time.thread_time() - cpu_started,
+                bytes_out=_image_bytes(img),
+            )
+            yield page, img
 
+    def ocr_page(self, file_handler, page, img):
+        return self.ocr_page_hashed(file_handler, page, img)[0]
+
+    def ocr_page_hashed(self, file_handler, page, img, timings=None):
+        """
+        preprocess ภาพของหน้าในหน่วยความจำ -> เข้ารหัส PNG ครั้งเดียว -> OCR
+        คืน (markdown, page_hash) โดย page_hash คือ SHA-256 ของ PNG หลัง preprocess
+        หน้าที่เคย OCR แล้ว (ภาพเหมือนกันทุก byte) จะได้ผลจาก cache โดยไม่เรียก API
+        timings = dict ของหน้าที่จะถูกเติมเวลา stage preprocess / ocr (ถ้าส่งมา)
+        """
+        png, width, height, page_hash = self._prepare_png(file_handler, page, img, timings)
+        key = make_key(page_hash, OCR_VERSION)
+        with measure("ocr", timings, bytes_in=len(png)) as m:
+            markdown = cache.get("ocr", key)
+            if markdown is None:
+                markdown = self.ocr_service.run_ocr_png(png, width, height)
+                cache.put("ocr", key, markdown)
+            m.bytes_out = len(markdown.encode("utf-8"))
+        return markdown, page_hash
+
+    async def aocr_page_hashed(self, file_handler, page, img, timings=None):
+        """
+        ocr_page_hashed แบบ async: preprocess (ใช้ CPU) และ cache (SQLite) ใน thread ส่วน OCR รอบน event loop
+        """
+        png, width, height, page_hash = await asyncio.to_thread(self._prepare_png, file_handler, page, img, timings)
+        key = make_key(page_hash, OCR_VERSION)
+        # ไม่วัด CPU เพราะ thread time ของ event loop ปนกับ task อื่น
+        with measure("ocr", timings, bytes_in=len(png), cpu=False) as m:
+            markdown = await asyncio.to_thread(cache.get, "ocr", key)
+            if markdown is None:
+                markdown = await self.ocr_service.arun_ocr_png(png, width, height)
+                await asyncio.to_thread(cache.put, "ocr", key, markdown)
+            m.bytes_out = len(markdown.encode("utf-8"))
+        return markdown, page_hash
+
+    def _prepare_png(self, file_handler, page, img, timings=None):
+        debug_path = None
+        if self.debug_images:
+            base = os.path.splitext(os.path.basename(file_handler.filepath))[0]
+            debug_path = os.path.join(self.output_dir, f"{base}_page_{page}.png")
+
+        with measure("preprocess", timings, bytes_in=_image_bytes(img)) as m:
+            png, (width, height) = ImageProcessor.preprocess_to_png(
+                img, debug_path=debug_path, max_dim=self.target_image_dim
+            )
+            m.bytes_out = len(png)
+        return png, width, height, hashlib.sha256(png).hexdigest()
+
+    def ocr_pages(self, file_handler):
+        """
+        OCR ทุกหน้าพร้อมกันสูงสุด max_workers หน้า คืนผลเรียงตามเลขหน้า
+        แต่ละหน้าเป็น dict: {"page", "ok", "markdown"} หรือ {"page", "ok": False, "stage", "error"}
+        """
+        def _run(item):
+            page, img = item
+            try:
+                return {"page": page, "ok": True, "markdown": self.ocr_page(file_handler, page, img)}
             except Exception as e:
-                print(f"❌ Error processing page {i+1}: {e}")
+                print(f"❌ Error processing page {page}: {e}")
+                return {"page": page, "ok": False, "stage": "ocr", "error": str(e)}
+
+        return ordered_map(_run, self.iter_pages(file_handler), max_workers=self.max_workers)
+
+    def process_document(self, file_handler):
+        for res in self.ocr_pages(file_handler):
+            if not res["ok"]:
+                continue
+            markdown = res["markdown"]
+            tid = self.extract_transaction_id(markdown, f"unknown_{res['page']}")
+            self.data[tid].append(markdown)
 
         return self.data
     
@@ -0,0 +1,211 @@
+import os, json, time, asyncio
+from typing import Dict, Any, List, Optional
+
+from ocr_flow import OCRService, TransactionExtractor, OCR_VERSION
+from extraction import InvoiceExtractor, EXTRACT_CACHE_BYPASS, EXTRACT_MODEL, PROMPT_VERSION
+from find_company import FindInvoiceCompany
+from condition import check_condition, current_tax_year, RULES_VERSION
+from concurrency import ordered_map, aordered_map, PIPELINE_WORKERS
+from metrics import measure, page_summary
+from result_cache import cache, make_key
+import model_registry
+
+# ---- Settings ----
+# อายุของผลทั้งเอกสารที่จำไว้ตาม sha256 ของไฟล์ (วินาที, 0 = ไม่หมดอายุ)
+DOCUMENT_CACHE_TTL = float(os.getenv("DOCUMENT_CACHE_TTL", str(7 * 24 * 3600)))
+
+
+def _json_bytes(obj) -> int:
+    return len(json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+class DocumentPipeline:
+    """
+    ประมวลผลเอกสารทีละหน้าแบบขนาน (สูงสุด max_workers หน้าพร้อมกัน)
+    แต่ละหน้า: preprocess -> OCR -> LLM extraction -> classify -> ตรวจชื่อบริษัท -> ตรวจเงื่อนไข
+    ผลลัพธ์เรียงตามเลขหน้าเสมอ และหน้าที่ล้มเหลวจะถูกรายงานพร้อม stage ที่พัง แทนที่จะหายไปเงียบ ๆ
+    มีทั้งแบบ thread (run/iter_results) และแบบ async (arun/aiter_results) ที่รอ OCR/LLM บน event loop
+    """
+
+    def __init__(self, file_handler, ocr_service=None, max_workers: int = PIPELINE_WORKERS,
+                 output_dir: str = "output", dpi: int = 300, on_event=None,
+                 bypass_cache: bool = False):
+        self.file_handler = file_handler
+        # True = เรียก LLM ใหม่ทุกหน้าแม้จะมีผลใน cache (หรือตั้ง EXTRACT_CACHE_BYPASS=1 ทั้ง process)
+        self.bypass_cache = bypass_cache or EXTRACT_CACHE_BYPASS
+        # on_event(dict) ถูกเรียกจาก worker thread ทุกครั้งที่หน้าหนึ่งผ่านแต่ละ stage
+        self.on_event = on_event
+        self.base = os.path.splitext(os.path.basename(file_handler.filepath))[0]
+        self.max_workers = max_workers
+        self.extractor = TransactionExtractor(
+            ocr_service or OCRService(), output_dir=output_dir, dpi=dpi, max_workers=max_workers
+        )
+
+    def extract(self, markdown: str, timings=None) -> Dict[str, Any]:
+        """ดึงข้อมูลของหน้า: แม่แบบ/regex ก่อน แล้วค่อย LLM (ใช้ผลจาก cache ถ้า markdown เดียวกันเคยถูก extract แล้ว)"""
+        with measure("extract", timings, bytes_in=len(markdown.encode("utf-8"))) as m:
+            out = InvoiceExtractor(markdown).extract(self.bypass_cache)  # may return dict or {"json": {...}}
+            m.bytes_out = _json_bytes(out)
+        return out
+
+    async def aextract(self, markdown: str, timings=None) -> Dict[str, Any]:
+        with measure("extract", timings, bytes_in=len(markdown.encode("utf-8")), cpu=False) as m:
+            out = await InvoiceExtractor(markdown).aextract(self.bypass_cache)
+            m.bytes_out = _json_bytes(out)
+        return out
+
+    def _emit(self, event: Dict[str, Any]):
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(event)
+        except Exception as e:
+            print("[PIPELINE] on_event error:", e)
+
+    def _stage_done(self, page: int, state: Dict[str, Any], next_stage: str = None):
+        self._emit({"event": "stage", "page": page, "stage": state["stage"]})
+        if next_stage:
+            state["stage"] = next_stage
+
+    def _start(self, page: int) -> Dict[str, Any]:
+        self._emit({"event": "stage", "page": page, "stage": "rasterised"})
+        # เวลาแปลงหน้าจาก PDF ถูกบันทึกไว้ตอน iter_pages
+        return {"stage": "ocr", "started": time.perf_counter(),
+                "timings": self.extractor.page_timings.pop(page, {})}
+
+    def _finish(self, page: int, state: Dict[str, Any], transaction_id=None, result=None, error=None):
+        timings = page_summary(state["timings"], time.perf_counter() - state["started"])
+        if error is None:
+            res = {"page": page, "ok": True, "transaction_id": transaction_id, "result": result, "timings": timings}
+        else:
+            print(f"❌ Error processing page {page} ({state['stage']}): {error}")
+            res = {"page": page, "ok": False, "stage": state["stage"], "error": str(error), "timings": timings}
+        # ส่งผลของหน้าทันทีที่เสร็จ (ไม่รอหน้าก่อนหน้า)
+        self._emit({"event": "page", **res})
+        return res
+
+    def _extracted(self, page: int, state: Dict[str, Any], markdown: str, out: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "page": page, "ok": True, "state": state,
+            "transaction_id": self.extractor.extract_transaction_id(markdown, f"unknown_{page}"),
+            "payload": out.get("json", out),
+        }
+
+    def extract_page(self, item) -> Dict[str, Any]:
+        """
+        ครึ่งแรกของหน้า: OCR -> extraction คืน {"page", "ok": True, "state", "transaction_id", "payload"}
+        ส่งต่อให้ classify_page ถ้าล้มเหลวคืนผลล้มเหลวของหน้าเลย
+        """
+        page, img = item
+        state = self._start(page)
+        try:
+            markdown, _ = self.extractor.ocr_page_hashed(self.file_handler, page, img, state["timings"])
+            self._stage_done(page, state, "extract")
+            out = self.extract(markdown, state["timings"])
+            self._stage_done(page, state, "classify")
+        except Exception as e:
+            return self._finish(page, state, error=e)
+        return self._extracted(page, state, markdown, out)
+
+    async def aextract_page(self, item) -> Dict[str, Any]:
+        """extract_page แบบ async: ไม่กิน thread ระหว่างรอ OCR/LLM ส่วน preprocess รันใน thread"""
+        page, img = item
+        state = self._start(page)
+        try:
+            markdown, _ = await self.extractor.aocr_page_hashed(self.file_handler, page, img, state["timings"])
+            self._stage_done(page, state, "extract")
+            out = await self.aextract(markdown, state["timings"])
+            self._stage_done(page, state, "classify")
+        except Exception as e:
+            return self._finish(page, state, error=e)
+        return self._extracted(page, state, markdown, out)
+
+    def classify_page(self, part: Dict[str, Any], pred: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        ครึ่งหลังของหน้า: classify -> ตรวจชื่อบริษัท -> ตรวจเงื่อนไข คืนผลสุดท้ายของหน้า
+        pred = ผลที่ classify มาแล้ว (เช่นจาก model_registry.classify_batch) ถ้าไม่ส่งจะ classify เอง
+        """
+        if not part["ok"]:
+            return part
+        page, state = part["page"], part["state"]
+        timings = state["timings"]
+        try:
+            if pred is None:
+                with measure("classify", timings):
+                    pred = model_registry.classify(part["payload"])
+            self._stage_done(page, state, "verify_company")
+
+            with measure("verify_company", timings):
+                verified = FindInvoiceCompany(input_json=pred, file_name=self.base, num=page).invoice_company()
+            self._stage_done(page, state, "check_condition")
+
+            with measure("check_condition", timings):
+                checked = check_condition(verified, file_name=self.base, num=page).check()
+            self._stage_done(page, state)
+        except Exception as e:
+            return self._finish(page, state, error=e)
+        return self._finish(page, state, part["transaction_id"], checked)
+
+    def process_page(self, item) -> Dict[str, Any]:
+        return self.classify_page(self.extract_page(item))
+
+    async def aprocess_page(self, item) -> Dict[str, Any]:
+        part = await self.aextract_page(item)
+        if not part["ok"]:
+            return part
+        return await asyncio.to_thread(self.classify_page, part)
+
+    def iter_results(self):
+        """yield ผลของแต่ละหน้าตามลำดับ ทันทีที่หน้านั้น (และหน้าก่อนหน้า) เสร็จ"""
+        return ordered_map(
+            self.process_page, self.extractor.iter_pages(self.file_handler), max_workers=self.max_workers
+        )
+
+    def run(self) -> List[Dict[str, Any]]:
+        return list(self.iter_results())
+
+    def aiter_results(self):
+        """เหมือน iter_results แต่เป็น async generator"""
+        return aordered_map(
+            self.aprocess_page, self.extractor.iter_pages(self.file_handler), max_pending=self.max_workers
+        )
+
+    async def arun(self) -> List[Dict[str, Any]]:
+        return [res async for res in self.aiter_results()]
+
+
+def page_timings(page_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """timings ของแต่ละหน้า (รวมหน้าที่ล้มเหลว) ตามเลขหน้า สำหรับแนบกับ response"""
+    return {str(r["page"]): r.get("timings") for r in page_results}
+
+
+def split_page_results(page_results: List[Dict[str, Any]]):
+    """แยกผลรายหน้าเป็น (pages สำหรับ frontend, รายการ error)"""
+    pages, errors = {}, []
+    for r in page_results:
+        if r["ok"]:
+            pages[str(r["page"])] = r["result"]
+        else:
+            errors.append({"page": r["page"], "stage": r["stage"], "error": r["error"]})
+    return pages, errors
+
+
+def _document_key(sha256: str) -> str:
+    # ผลที่ cache มี deduction_status ที่ check_condition ตรวจด้วยปีภาษีปัจจุบัน (ค่าเริ่มต้นของ RuleEngine)
+    # จึงมีปีภาษีอยู่ใน key — ข้ามปีแล้วต้องตรวจใหม่ ไม่ใช่ได้ผลของปีก่อนจาก cache
+    # fingerprint ของโมเดลจัดหมวดหมู่ด้วย — เปลี่ยนโมเดลแล้วต้องไม่ได้หมวดหมู่เดิมจาก cache
+    return make_key(
+        sha256, OCR_VERSION, PROMPT_VERSION, EXTRACT_MODEL, RULES_VERSION,
+        model_registry.fingerprint(), str(current_tax_year()),
+    )
+
+
+def known_result(sha256: str) -> Optional[Dict[str, Any]]:
+    """ผลต่อหน้า (pages ของ split_page_results) ของไฟล์ที่เคยประมวลผลสำเร็จแล้ว หรือ None"""
+    return cache.get("document", _document_key(sha256), ttl=DOCUMENT_CACHE_TTL)
+
+
+def remember_result(sha256: str, pages: Dict[str, Any], errors: List[Dict[str, Any]]):
+    """จำผลของไฟล์ไว้ให้ known_result (เฉพาะเมื่อทุกหน้าสำเร็จ)"""
+    if pages and not errors:
+        cache.put("document", _document_key(sha256), pages)
@@ -1,37 +1,87 @@
 import joblib, json, re
 import numpy as np
-from typing import Union, Dict, Any
+from typing import Union, Dict, Any, Optional, List
 from pythainlp.tokenize import word_tokenize
 from pythainlp.corpus.common import thai_stopwords
-from pythainlp import word_vector
+from embeddings import load_word_vectors, sentence_cache
 from json.decoder import JSONDecodeError
 
+MODEL_DIR = "./model"
+
+# หมวดหลัก -> (ชื่อ sub-model, ชื่อ vectorizer) ใน dict ของ load_models
+SUB_MODEL_KEYS = {
+    "สิทธิลดหย่อนส่วนตัวและครอบครัว": ("sub_model_personal", "sub_vec_personal"),
+    "การออมการลงทุนและประกัน": ("sub_model_invest", "sub_vec_invest"),
+    "สินทรัพย์และมาตรการนโยบายภาครัฐ": ("sub_model_assets", "sub_vec_assets"),
+    "Easy E-Receipt": ("sub_model_easy", "sub_vec_easy"),
+    "เงินบริจาค": ("sub_model_donation", "sub_vec_donation"),
+}
+UNKNOWN_SUB_CATEGORY = "ไม่ทราบหมวดหมู่"
+
+def load_models(
+    main_model_path: str = f"{MODEL_DIR}/voting_soft_best_v2.pkl",
+    sub_personal_path: str = f"{MODEL_DIR}/sub_model_personal.pkl",
+    sub_invest_path: str = f"{MODEL_DIR}/sub_model_invest.pkl",
+    sub_assets_path: str = f"{MODEL_DIR}/sub_model_assets.pkl",
+    sub_easy_path: str = f"{MODEL_DIR}/sub_model_easy_receipt.pkl",
+    sub_donation_path: str = f"{MODEL_DIR}/sub_model_donation.pkl",
+    thai2vec_model=None,
+    stopwords=None,
+) -> Dict[str, Any]:
+    """
+    โหลดโมเดลทั้งชุดที่ prediction ใช้ คืนเป็น dict
+    ส่ง thai2vec_model / stopwords ที่โหลดไว้แล้วเข้ามาได้ เพื่อไม่ต้องโหลดซ้ำตอน reload เฉพาะไฟล์ .pkl
+    """
+    models: Dict[str, Any] = {}
+
+    # โหลดโมเดลหลัก
+    models["main_model"] = joblib.load(main_model_path)
+
+    # โหลด sub-models (รูปแบบไฟล์ต้องเป็น tuple: (model, vectorizer))
+    models["sub_model_personal"], models["sub_vec_personal"] = joblib.load(sub_personal_path)
+    models["sub_model_invest"],   models["sub_vec_invest"]   = joblib.load(sub_invest_path)
+    models["sub_model_assets"],   models["sub_vec_assets"]   = joblib.load(sub_assets_path)
+    models["sub_model_easy"],     models["sub_vec_easy"]     = joblib.load(sub_easy_path)
+    models["sub_model_donation"], models["sub_vec_donation"] = joblib.load(sub_donation_path)
+
+    # โหลด Thai2Vec (ตาราง .npy แบบ mmap ที่แปลงไว้แล้ว — ดู embeddings.py)
+    if thai2vec_model is None:
+        thai2vec_model = load_word_vectors()
+    models["thai2vec_model"] = thai2vec_model
+    models["stopwords"] = stopwords if stopwords is not None else set(thai_stopwords())
+    return models
+
+
 class prediction:
     def __init__(
         self,
         input_json: Union[str, dict],
-        main_model_path: str = "./model/voting_soft_best_v2.pkl",
-        sub_personal_path: str = "./model/sub_model_personal.pkl",
-        sub_invest_path: str = "./model/sub_model_invest.pkl",
-        sub_assets_path: str = "./model/sub_model_assets.pkl",
-        sub_easy_path: str = "./model/sub_model_easy_receipt.pkl",
-        sub_donation_path: str = "./model/sub_model_donation.pkl",
+        main_model_path: str = f"{MODEL_DIR}/voting_soft_best_v2.pkl",
+        sub_personal_path: str = f"{MODEL_DIR}/sub_model_personal.pkl",
+        sub_invest_path: str = f"{MODEL_DIR}/sub_model_invest.pkl",
+        sub_assets_path: str = f"{MODEL_DIR}/sub_model_assets.pkl",
+        sub_easy_path: str = f"{MODEL_DIR}/sub_model_easy_receipt.pkl",
+        sub_donation_path: str = f"{MODEL_DIR}/sub_model_donation.pkl",
+        models: Optional[Dict[str, Any]] = None,
     ):
         self.input_json_raw = input_json
-        
-        # โหลดโมเดลหลัก
-        self.main_model = joblib.load(main_model_path)
-        
-        # โหลด sub-models (รูปแบบไฟล์ต้องเป็น tuple: (model, vectorizer))
-        self.sub_model_personal, self.sub_vec_personal = joblib.load(sub_personal_path)
-        self.sub_model_invest,   self.sub_vec_invest   = joblib.load(sub_invest_path)
-        self.sub_model_assets,   self.sub_vec_assets   = joblib.load(sub_assets_path)
-        self.sub_model_easy,     self.sub_vec_easy     = joblib.load(sub_easy_path)
-        self.sub_model_donation, self.sub_vec_donation = joblib.load(sub_donation_path)
-        
-        # โหลด Thai2Vec
-        self.thai2vec_model = word_vector.WordVector(model_name="thai2fit_wv").get_model()
-        self.stopwords = set(thai_stopwords())
+
+        # ถ้าไม่ได้ส่งชุดโมเดลที่โหลดไว้แล้ว (เช่นจาก model_registry) ให้โหลดเองเหมือนเดิม
+        if models is None:
+            models = load_models(
+                main_model_path, sub_personal_path, sub_invest_path,
+                sub_assets_path, sub_easy_path, sub_donation_path,
+            )
+
+        self.main_model = models["main_model"]
+        self.sub_model_personal, self.sub_vec_personal = models["sub_model_personal"], models["sub_vec_personal"]
+        self.sub_model_invest,   self.sub_vec_invest   = models["sub_model_invest"],   models["sub_vec_invest"]
+        self.sub_model_assets,   self.sub_vec_assets   = models["sub_model_assets"],   models["sub_vec_assets"]
+        self.sub_model_easy,     self.sub_vec_easy     = models["sub_model_easy"],     models["sub_vec_easy"]
+        self.sub_model_donation, self.sub_vec_donation = models["sub_model_donation"], models["sub_vec_donation"]
+
+        self.thai2vec_model = models["thai2vec_model"]
+        self.stopwords = models["stopwords"]
         
     @staticmethod
     def safe_json_loads(text: str) -> dict:
@@ -46,13 +96,50 @@ class prediction:
         
     # ฟังก์ชันแปลงข้อความเป็นเวกเตอร์
     def sentence_vector(self, sentence):
+        cached = sentence_cache.get(self.thai2vec_model, sentence)
+        if cached is not None:
+            return cached
         words = word_tokenize(sentence, engine="newmm")
         vectors = [self.thai2vec_model[word] for word in words if word in self.thai2vec_model]
         if vectors:
-            return np.mean(vectors, axis=0)
+            vec = np.mean(vectors, axis=0, dtype=np.float32)
         else:
-            return np.zeros(self.thai2vec_model.vector_size)
+            vec = np.zeros(self.thai2vec_model.vector_size, dtype=np.float32)
+        sentence_cache.put(self.thai2vec_model, sentence, vec)
+        return vec
         
+    def sentence_vectors(self, sentences: List[str]) -> np.ndarray:
+        """sentence_vector ของหลายประโยคพร้อมกัน คืน matrix ขนาด (len(sentences), vector_size)"""
+        kv = self.thai2vec_model
+        key_to_index = getattr(kv, "key_to_index", None)
+        if key_to_index is None:
+            # ไม่ใช่ KeyedVectors/EmbeddingTable — ใช้ทีละประโยคแบบเดิม
+            return np.vstack([self.sentence_vector(s) for s in sentences]) if sentences else np.zeros((0, kv.vector_size), dtype=np.float32)
+
+        X = np.zeros((len(sentences), kv.vector_size), dtype=np.float32)
+        missing, rows, counts = [], [], []
+        for i, sentence in enumerate(sentences):
+            cached = sentence_cache.get(kv, sentence)
+            if cached is not None:
+                X[i] = cached
+                continue
+            idx = [key_to_index[w] for w in word_tokenize(sentence, engine="newmm") if w in key_to_index]
+            missing.append(i)
+            rows.extend(idx)
+            counts.append(len(idx))
+
+        if missing:
+            counts = np.asarray(counts)
+            nonempty = counts > 0
+            if nonempty.any():
+                # รวมเวกเตอร์ของคำในแต่ละประโยคด้วย reduceat ครั้งเดียว แล้วหารด้วยจำนวนคำ
+                starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+                sums = np.add.reduceat(kv.vectors[np.asarray(rows)].astype(np.float32, copy=False), starts, axis=0)
+                X[np.asarray(missing)[nonempty]] = sums / counts[nonempty, None]
+            for i in missing:
+                sentence_cache.put(kv, sentences[i], X[i])
+        return X
+
     def preprocess_text(self, text):
         text = re.sub(r'[^\u0E00-\u0E7Fa-zA-Z0-9\s]', '', text)
         tokens = word_tokenize(text.lower())
@@ -62,24 +149,19 @@ class prediction:
         vec = self.sentence_vector(cleaned_name).reshape(1, -1)
         return self.main_model.predict(vec)[0]
     
+    def _sub_model(self, cat: str):
+        keys = SUB_MODEL_KEYS.get(cat)
+        if keys is None:
+            return None, None
+        model_attr, vec_attr = keys
+        return getattr(self, model_attr), getattr(self, vec_attr)
+
     def _predict_sub(self, cat: str, cleaned_name: str) -> str:
-        if cat == "สิทธิลดหย่อนส่วนตัวและครอบครัว":
-            X = self.sub_vec_personal.transform([cleaned_name])
-            return self.sub_model_personal.predict(X)[0]
-        elif cat == "การออมการลงทุนและประกัน":
-            X = self.sub_vec_invest.transform([cleaned_name])
-            return self.sub_model_invest.predict(X)[0]
-        elif cat == "สินทรัพย์และมาตรการนโยบายภาครัฐ":
-            X = self.sub_vec_assets.transform([cleaned_name])
-            return self.sub_model_assets.predict(X)[0]
-        elif cat == "Easy E-Receipt":
-            X = self.sub_vec_easy.transform([cleaned_name])
-            return self.sub_model_easy.predict(X)[0]
-        elif cat == "เงินบริจาค":
-            X = self.sub_vec_donation.transform([cleaned_name])
-            return self.sub_model_donation.predict(X)[0]
-        else:
-            return "ไม่ทราบหมวดหมู่"
+        model, vec = self._sub_model(cat)
+        if model is None:
+            return UNKNOWN_SUB_CATEGORY
+        X = vec.transform([cleaned_name])
+        return model.predict(X)[0]
     
     def run(self) -> Dict[str, Any]:
         data = self.input_json_raw
@@ -101,3 +183,36 @@ class prediction:
         data["sub_category"] = sub
 
         return data
+
+    def run_batch(self, payloads: List[Union[str, dict]]) -> List[Dict[str, Any]]:
+        """
+        จัดหมวดหมู่หลายเอกสารในครั้งเดียว (ไม่ใช้ self.input_json_raw)
+        - ตัดคำ/ทำความสะอาด title ที่ไม่ซ้ำกันแค่ครั้งเดียว
+        - สร้าง sentence vector เป็น matrix แล้ว predict โมเดลหลักครั้งเดียว
+        - จัดกลุ่มตามหมวดหลัก แล้ว transform/predict ของแต่ละ sub-model ครั้งเดียวต่อกลุ่ม
+        คืน list ของ dict ตามลำดับเดิม (แก้ category/sub_category ใน dict เดิมเหมือน run())
+        """
+        docs = [self.safe_json_loads(p) if isinstance(p, str) else p for p in payloads]
+        if not docs:
+            return []
+
+        # title ซ้ำกันบ่อยในใบเสร็จ — ทำแค่ title ที่ไม่ซ้ำ
+        unique_titles = list(dict.fromkeys((d.get("title") or "") for d in docs))
+        cleaned = [self.preprocess_text(t) for t in unique_titles]
+        print(f"Processing batch: {len(docs)} documents, {len(unique_titles)} unique titles")
+
+        cats = self.main_model.predict(self.sentence_vectors(cleaned))
+        subs = np.full(len(cleaned), UNKNOWN_SUB_CATEGORY, dtype=object)
+        for cat in set(cats):
+            model, vec = self._sub_model(cat)
+            if model is None:
+                continue
+            rows = np.flatnonzero(cats == cat)
+            X = vec.transform([cleaned[i] for i in rows])
+            subs[rows] = model.predict(X)
+
+        by_title = {t: (cats[i], subs[i]) for i, t in enumerate(unique_titles)}
+        for d in docs:
+            # เก็บ category/sub_category ที่ระดับ document
+            d["category"], d["sub_category"] = by_title[d.get("title") or ""]
+        return docs
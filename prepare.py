@@ -30,8 +30,19 @@ class FileHandler:
         reader = PdfReader(self.filepath)
         return len(reader.pages)
     
+    def iter_pdf_pages(self, dpi=300):
+        """
+        แปลง PDF เป็นภาพทีละหน้า (generator) แทนการโหลดทุกหน้าเข้าหน่วยความจำพร้อมกัน
+        ผู้เรียกถือภาพไว้กี่หน้า หน่วยความจำก็ใช้เท่านั้น
+        """
+        for page in range(1, self.count_pages() + 1):
+            images = convert_from_path(self.filepath, dpi=dpi, first_page=page, last_page=page)
+            if images:
+                yield images[0]
+
     def pdf_to_images(self, dpi=300):
-        return convert_from_path(self.filepath, dpi=dpi)
+        # เก็บไว้เพื่อความเข้ากันได้ — โค้ดใหม่ควรใช้ iter_pdf_pages
+        return list(self.iter_pdf_pages(dpi=dpi))
 
 class ImageProcessor:
     
@@ -1,5 +1,6 @@
 import mimetypes
 import cv2
+import numpy as np
 from pdf2image import convert_from_path
 from PyPDF2 import PdfReader
 
@@ -22,22 +23,48 @@ class FileHandler:
         reader = PdfReader(self.filepath)
         return len(reader.pages)
     
+    def iter_pdf_pages(self, dpi=300):
+        """
+        แปลง PDF เป็นภาพทีละหน้า (generator) แทนการโหลดทุกหน้าเข้าหน่วยความจำพร้อมกัน
+        ผู้เรียกถือภาพไว้กี่หน้า หน่วยความจำก็ใช้เท่านั้น
+        """
+        for page in range(1, self.count_pages() + 1):
+            images = convert_from_path(self.filepath, dpi=dpi, first_page=page, last_page=page)
+            if images:
+                yield images[0]
+
     def pdf_to_images(self, dpi=300):
-        return convert_from_path(self.filepath, dpi=dpi)
+        # เก็บไว้เพื่อความเข้ากันได้ — โค้ดใหม่ควรใช้ iter_pdf_pages
+        return list(self.iter_pdf_pages(dpi=dpi))
     
 class ImageProcessor:
-    
-    @staticmethod
-    def preprocess_image(input_path, output_path):
-        img = cv2.imread(input_path)
-        if img is None:
-            raise ValueError(f"❌ ไม่สามารถโหลดภาพจาก: {input_path}")
 
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    @staticmethod
+    def to_gray(img) -> np.ndarray:
+        """รับภาพ PIL / numpy (BGR) / path ของไฟล์ภาพ คืน numpy grayscale"""
+        if isinstance(img, str):
+            arr = cv2.imread(img)
+            if arr is None:
+                raise ValueError(f"❌ ไม่สามารถโหลดภาพจาก: {img}")
+            return cv2.cvtColor(arr, cv2.COLOR_BGR2GRAY)
+        if isinstance(img, np.ndarray):
+            return img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # PIL image (เช่นหน้าจาก pdf2image)
+        return cv2.cvtColor(np.asarray(img.convert("RGB")), cv2.COLOR_RGB2GRAY)
 
-        # Resize 2x (Upscale)
-        resized = cv2.resize(gray, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+    @staticmethod
+    def preprocess_array(gray: np.ndarray, max_dim=None) -> np.ndarray:
+        # Resize 2x (Upscale) — ถ้าให้ max_dim ย่อ/ขยายครั้งเดียวให้ด้านยาวไม่เกิน max_dim ก่อน threshold
+        # (ไม่ขยาย 2 เท่าแล้วค่อยย่อทีหลัง ซึ่งเสียเวลากับภาพที่ใหญ่กว่าที่ส่ง OCR จริง)
+        height, width = gray.shape[:2]
+        scale = 2.0
+        if max_dim:
+            scale = min(scale, max_dim / max(width, height))
+        if scale == 1:
+            resized = gray
+        else:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            resized = cv2.resize(gray, size, interpolation=cv2.INTER_CUBIC if scale > 1 else cv2.INTER_AREA)
 
         # Adaptive Threshold
         thresh = cv2.adaptiveThreshold(
@@ -46,7 +73,32 @@ class ImageProcessor:
         )
 
         # Invert image
-        inverted = cv2.bitwise_not(thresh)
+        return cv2.bitwise_not(thresh)
+
+    @staticmethod
+    def encode_png(arr: np.ndarray) -> bytes:
+        ok, buf = cv2.imencode(".png", arr)
+        if not ok:
+            raise ValueError("❌ ไม่สามารถเข้ารหัสภาพเป็น PNG")
+        return buf.tobytes()
+
+    @staticmethod
+    def preprocess_to_png(img, debug_path=None, max_dim=None):
+        """
+        preprocess ในหน่วยความจำทั้งหมด ด้านยาวไม่เกิน max_dim (ถ้ากำหนด) แล้วเข้ารหัส PNG ครั้งเดียว
+        คืน (png_bytes, (width, height)) ของภาพที่เข้ารหัส — ถ้าให้ debug_path จะเขียนไฟล์ผลลัพธ์ลงดิสก์ด้วย
+        """
+        processed = ImageProcessor.preprocess_array(ImageProcessor.to_gray(img), max_dim)
+        png = ImageProcessor.encode_png(processed)
+        if debug_path:
+            with open(debug_path, "wb") as f:
+                f.write(png)
+        height, width = processed.shape[:2]
+        return png, (width, height)
+
+    @staticmethod
+    def preprocess_image(input_path, output_path):
+        inverted = ImageProcessor.preprocess_array(ImageProcessor.to_gray(input_path))
 
         # Save result
-        cv2.imwrite(output_path, inverted)
\ No newline at end of file
+        cv2.imwrite(output_path, inverted)
@@ -0,0 +1,143 @@
+"""
+ตรวจเงื่อนไขลดหย่อนของเอกสารที่บันทึกไว้ใหม่ทั้งหมดเมื่อกฎเปลี่ยน (ไม่ต้อง OCR/LLM ใหม่)
+    python reevaluate.py [--rules-version 2025.1] [--batch-size 500] [--employee-id 3] [--tax-year 2567] [--no-reclassify] [--dry-run]
+หรือผ่าน POST /api/documents/reevaluate (รันใน background) แล้วดูความคืบหน้าที่ GET เดียวกัน
+"""
+import os, time, json, argparse, threading
+from contextlib import closing
+from typing import Any, Callable, Dict, Optional
+
+from condition import RuleEngine, RULE_SETS, RULES_VERSION
+from database.conn import DatabaseConnection
+
+# ---- Settings ----
+REEVALUATE_BATCH_SIZE = int(os.getenv("REEVALUATE_BATCH_SIZE", "500"))
+
+
+def document_tax_year(doc: Dict[str, Any], created_at) -> int:
+    """
+    ปีภาษี (พ.ศ.) ที่เอกสารถูกยื่น: ปีที่ตรวจไว้ครั้งก่อน (result_json.tax_year) ไม่งั้นปีที่อัปโหลด
+    ไม่ใช้ปีปัจจุบัน — เอกสารของปีก่อน ๆ จะกลายเป็น "ปีภาษีไม่ตรง" ทั้งหมด
+    """
+    year = doc.get("tax_year")
+    if isinstance(year, int) or (isinstance(year, str) and year.isdigit()):
+        return int(year)
+    return created_at.year + 543
+
+
+def _outcome(doc: Dict[str, Any]):
+    return doc.get("deduction_status"), doc.get("reason"), tuple(it.get("deduction_status") for it in doc.get("items") or [])
+
+
+class Reevaluator:
+    """
+    อ่าน result_json จากตาราง document ทีละ batch (server-side cursor) -> classify ใหม่ (ถ้าเปิด)
+    -> RuleEngine.evaluate_many (ปีภาษีของแต่ละเอกสาร หรือ tax_year ถ้ากำหนด) -> เขียนกลับด้วย execute_values พร้อมแถว history ที่ติด rules_version
+    ถือในหน่วยความจำแค่ batch เดียว ใช้ connection 2 ตัว (อ่าน/เขียน)
+    """
+
+    def __init__(self, rules_version: str = RULES_VERSION, batch_size: int = REEVALUATE_BATCH_SIZE,
+                 employee_id: Optional[int] = None, reclassify: bool = True, dry_run: bool = False,
+                 tax_year: Optional[int] = None, on_progress: Callable[[Dict[str, Any]], None] = None):
+        if rules_version not in RULE_SETS:
+            raise ValueError(f"Unknown rules version {rules_version}")
+        self.engine = RuleEngine(rules_version)
+        self.batch_size = max(1, batch_size)
+        self.employee_id = employee_id
+        self.tax_year = tax_year
+        self.reclassify = reclassify
+        self.dry_run = dry_run
+        self.on_progress = on_progress
+        self.stats = {
+            "rules_version": rules_version, "employee_id": employee_id, "tax_year": tax_year, "reclassify": reclassify,
+            "dry_run": dry_run, "batches": 0, "documents": 0, "changed": 0, "seconds": 0.0,
+        }
+
+    def _classify(self, docs):
+        import model_registry  # โหลดโมเดลเฉพาะเมื่อ classify ใหม่
+        return model_registry.classify_batch(docs)
+
+    def _process(self, rows, writer):
+        ids = [doc_id for doc_id, _, _ in rows]
+        docs = [doc for _, doc, _ in rows]
+        if self.tax_year is not None:
+            tax_years = [self.tax_year] * len(rows)
+        else:
+            tax_years = [document_tax_year(doc, created_at) for _, doc, created_at in rows]
+        before = [_outcome(doc) for doc in docs]
+        if self.reclassify:
+            docs = self._classify(docs)
+        docs = self.engine.evaluate_many(docs, tax_years)
+        if not self.dry_run:
+            writer.update_results_bulk(list(zip(ids, docs)), self.engine.version)
+
+        self.stats["batches"] += 1
+        self.stats["documents"] += len(docs)
+        self.stats["changed"] += sum(b != _outcome(doc) for b, doc in zip(before, docs))
+        self.stats["last_document_id"] = ids[-1]
+
+    def run(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        with DatabaseConnection() as reader, DatabaseConnection() as writer:
+            if reader.connection is None or writer.connection is None:
+                raise RuntimeError("database unavailable")
+            # closing(): ถ้าพังกลางทาง ปิด cursor/transaction ของ reader ก่อนคืน connection
+            with closing(reader.iter_result_batches(self.batch_size, self.employee_id)) as batches:
+                for rows in batches:
+                    self._process(rows, writer)
+                    self.stats["seconds"] = round(time.perf_counter() - started, 3)
+                    if self.on_progress is not None:
+                        self.on_progress(dict(self.stats))
+        self.stats["seconds"] = round(time.perf_counter() - started, 3)
+        return self.stats
+
+
+# งานที่รันอยู่/รันล่าสุดของ process (รันได้ทีละงาน)
+_state = {"thread": None, "status": None}
+_state_lock = threading.Lock()
+
+
+def status() -> Optional[Dict[str, Any]]:
+    return _state["status"]
+
+
+def start(**kwargs) -> bool:
+    """เริ่ม Reevaluator(**kwargs) ใน background thread คืน False ถ้ามีงานรันอยู่แล้ว (ValueError ถ้า version ผิด)"""
+    with _state_lock:
+        if _state["thread"] is not None and _state["thread"].is_alive():
+            return False
+        job = Reevaluator(**kwargs)
+        _state["status"] = {"state": "running", **job.stats}
+
+        def progress(stats):
+            _state["status"] = {"state": "running", **stats}
+
+        def work():
+            job.on_progress = progress
+            try:
+                _state["status"] = {"state": "done", **job.run()}
+            except Exception as e:
+                print("❌ Re-evaluation failed:", e)
+                _state["status"] = {"state": "failed", "error": str(e), **job.stats}
+
+        _state["thread"] = threading.Thread(target=work, name="reevaluate", daemon=True)
+        _state["thread"].start()
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-evaluate deduction rules for stored documents")
+    parser.add_argument("--rules-version", default=RULES_VERSION, choices=sorted(RULE_SETS))
+    parser.add_argument("--batch-size", type=int, default=REEVALUATE_BATCH_SIZE)
+    parser.add_argument("--employee-id", type=int, default=None)
+    parser.add_argument("--tax-year", type=int, default=None, help="ปีภาษี พ.ศ. ของทุกเอกสาร (ค่าเริ่มต้น: ปีของแต่ละเอกสาร)")
+    parser.add_argument("--no-reclassify", action="store_true", help="ใช้ category เดิมใน result_json")
+    parser.add_argument("--dry-run", action="store_true", help="นับผลที่เปลี่ยนโดยไม่เขียนลงฐานข้อมูล")
+    args = parser.parse_args()
+
+    job = Reevaluator(
+        args.rules_version, args.batch_size, args.employee_id,
+        reclassify=not args.no_reclassify, dry_run=args.dry_run, tax_year=args.tax_year,
+        on_progress=lambda s: print(f"[REEVALUATE] {s['documents']} documents ({s['changed']} changed) up to id {s['last_document_id']}"),
+    )
+    print(json.dumps(job.run(), ensure_ascii=False, indent=2))
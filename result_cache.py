@@ -0,0 +1,146 @@
+import os, json, time, sqlite3, hashlib, threading
+from typing import Any, Dict, Optional
+
+# ---- Settings ----
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"))
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))  # 256MB
+
+
+def make_key(*parts) -> str:
+    """รวมหลายส่วน (bytes/str) เป็น SHA-256 hex เดียว ใช้เป็น cache key"""
+    h = hashlib.sha256()
+    for p in parts:
+        if isinstance(p, str):
+            p = p.encode("utf-8")
+        h.update(p)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Cache ผลลัพธ์ (JSON) แบบถาวรบน SQLite แยกตาม namespace เช่น "ocr", "extract"
+    - ขนาดรวมไม่เกิน max_bytes โดยลบรายการที่ไม่ได้ใช้นานที่สุดออกก่อน (LRU)
+    - กำหนดอายุ (ttl) ตอน get ได้ รายการที่หมดอายุจะถูกลบ
+    - ใช้ร่วมกันได้หลาย thread และหลาย worker process (WAL mode)
+    """
+
+    def __init__(self, path: str = None, max_bytes: int = RESULT_CACHE_MAX_BYTES, enabled: bool = RESULT_CACHE_ENABLED):
+        self.path = path or os.path.join(CACHE_DIR, "result_cache.sqlite3")
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._db = None
+        self._size = 0
+        self._stats = {}  # namespace -> {"hits": n, "misses": n}
+
+    def _conn(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS cache (
+                namespace   TEXT NOT NULL,
+                key         TEXT NOT NULL,
+                value       TEXT NOT NULL,
+                size_bytes  INTEGER NOT NULL,
+                created_at  REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )""")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_cache_access ON cache(last_access)")
+            db.commit()
+            self._size = db.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM cache").fetchone()[0]
+            self._db = db
+        return self._db
+
+    def _count(self, namespace: str, field: str):
+        self._stats.setdefault(namespace, {"hits": 0, "misses": 0, "expired": 0})[field] += 1
+
+    def get(self, namespace: str, key: str, ttl: Optional[float] = None) -> Optional[Any]:
+        """ttl (วินาที): รายการที่เก่ากว่านี้นับเป็น miss และถูกลบทิ้ง (None/0 = ไม่หมดอายุ)"""
+        if not self.enabled:
+            return None
+        try:
+            with self._lock:
+                db = self._conn()
+                row = db.execute(
+                    "SELECT value, created_at, size_bytes FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+                if row is None:
+                    self._count(namespace, "misses")
+                    return None
+                now = time.time()
+                if ttl and now - row[1] > ttl:
+                    db.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+                    db.commit()
+                    self._size -= row[2]
+                    self._count(namespace, "expired")
+                    self._count(namespace, "misses")
+                    return None
+                db.execute(
+                    "UPDATE cache SET last_access = ? WHERE namespace = ? AND key = ?",
+                    (now, namespace, key)
+                )
+                db.commit()
+                self._count(namespace, "hits")
+                return json.loads(row[0])
+        except Exception as e:
+            print("[CACHE] get error:", e)
+            return None
+
+    def put(self, namespace: str, key: str, value: Any):
+        if not self.enabled:
+            return
+        try:
+            data = json.dumps(value, ensure_ascii=False)
+            size = len(data.encode("utf-8"))
+            now = time.time()
+            with self._lock:
+                db = self._conn()
+                old = db.execute(
+                    "SELECT size_bytes FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+                db.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, size_bytes, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (namespace, key, data, size, now, now)
+                )
+                self._size += size - (old[0] if old else 0)
+                self._evict(db)
+                db.commit()
+        except Exception as e:
+            print("[CACHE] put error:", e)
+
+    def _evict(self, db):
+        if self._size <= self.max_bytes:
+            return
+        # worker อื่นอาจเขียน/ลบไปแล้ว — อ่านขนาดจริงจากฐานข้อมูลก่อน
+        self._size = db.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM cache").fetchone()[0]
+        # ลบรายการที่เข้าถึงล่าสุดนานที่สุดจนขนาดรวมไม่เกิน max_bytes
+        while self._size > self.max_bytes:
+            rows = db.execute(
+                "SELECT namespace, key, size_bytes FROM cache ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                break
+            for ns, key, size in rows:
+                db.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (ns, key))
+                self._size -= size
+                if self._size <= self.max_bytes:
+                    break
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "size_bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "namespaces": {ns: dict(v) for ns, v in self._stats.items()},
+        }
+
+
+# cache กลางของ process
+cache = ResultCache()
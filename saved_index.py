@@ -0,0 +1,150 @@
+import os, json, sqlite3, threading, argparse
+from typing import Any, Dict, Optional
+
+# ---- Settings ----
+SAVED_DIR = os.getenv("SAVED_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "saved_records"))
+SAVED_INDEX_PATH = os.getenv("SAVED_INDEX_PATH", os.path.join(SAVED_DIR, "index.sqlite3"))
+SAVED_LIST_MAX_LIMIT = 1000
+
+
+def summarize(data: dict) -> Dict[str, Any]:
+    """สรุปของ record ที่ /api/saved คืนให้ frontend"""
+    return {
+        "id": data.get("id"),
+        "savedAt": data.get("savedAt"),
+        "fileName": data.get("fileName"),
+        "memberName": data.get("memberName"),
+        "title": data.get("title") or (data.get("raw") or {}).get("title"),
+        "seller": data.get("seller"),
+        "dateStr": data.get("dateStr"),
+        "total": data.get("total"),
+        "deduction_status": data.get("deduction_status"),
+        "reason": data.get("reason"),
+    }
+
+
+class SavedIndex:
+    """
+    ดัชนีของ saved_records/*.json บน SQLite
+    /api/save เพิ่มแถวทุกครั้งที่เขียนไฟล์ /api/saved ตอบจากดัชนีโดยไม่เปิดไฟล์ record เลย
+    ถ้ายังไม่มีไฟล์ดัชนีจะสร้างจากไฟล์ที่มีอยู่ให้อัตโนมัติครั้งแรก
+    """
+
+    def __init__(self, path: str = SAVED_INDEX_PATH, saved_dir: str = SAVED_DIR):
+        self.path = path
+        self.saved_dir = saved_dir
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _conn(self):
+        if self._db is None:
+            is_new = not os.path.exists(self.path)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS saved_index (
+                id               TEXT PRIMARY KEY,
+                saved_at         TEXT,
+                member_name      TEXT,
+                file_name        TEXT,
+                deduction_status TEXT,
+                summary          TEXT NOT NULL
+            )""")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_saved_member ON saved_index(member_name, id)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_saved_status ON saved_index(deduction_status, id)")
+            db.commit()
+            self._db = db
+            if is_new:
+                self._rebuild(db)
+        return self._db
+
+    @staticmethod
+    def _row(record: dict):
+        s = summarize(record)
+        return (
+            str(s["id"]), s["savedAt"], s["memberName"], s["fileName"], s["deduction_status"],
+            json.dumps(s, ensure_ascii=False),
+        )
+
+    def add(self, record: dict):
+        with self._lock:
+            db = self._conn()
+            db.execute(
+                "INSERT OR REPLACE INTO saved_index (id, saved_at, member_name, file_name, deduction_status, summary) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                self._row(record)
+            )
+            db.commit()
+
+    def _rebuild(self, db) -> int:
+        db.execute("DELETE FROM saved_index")
+        count = 0
+        if os.path.isdir(self.saved_dir):
+            for name in os.listdir(self.saved_dir):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(self.saved_dir, name), "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except Exception as e:
+                    print(f"[SAVED INDEX] skip {name}: {e}")
+                    continue
+                data.setdefault("id", os.path.splitext(name)[0])
+                db.execute(
+                    "INSERT OR REPLACE INTO saved_index (id, saved_at, member_name, file_name, deduction_status, summary) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    self._row(data)
+                )
+                count += 1
+        db.commit()
+        return count
+
+    def rebuild(self) -> int:
+        """สร้างดัชนีใหม่ทั้งหมดจากไฟล์ใน saved_dir คืนจำนวน record"""
+        with self._lock:
+            return self._rebuild(self._conn())
+
+    def list(self, limit: int = 100, cursor: Optional[str] = None,
+             member_name: Optional[str] = None, deduction_status: Optional[str] = None,
+             file_name: Optional[str] = None) -> Dict[str, Any]:
+        """เรียงจาก id ใหม่ไปเก่า (เหมือนเดิม) ส่ง next_cursor เป็น cursor เพื่อดึงหน้าถัดไป"""
+        limit = max(1, min(int(limit), SAVED_LIST_MAX_LIMIT))
+        where, params = [], []
+        if cursor:
+            where.append("id < ?")
+            params.append(cursor)
+        if member_name:
+            where.append("member_name = ?")
+            params.append(member_name)
+        if deduction_status:
+            where.append("deduction_status = ?")
+            params.append(deduction_status)
+        if file_name:
+            where.append("file_name = ?")
+            params.append(file_name)
+        sql = "SELECT id, summary FROM saved_index"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = self._conn().execute(sql, params).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1][0]
+        return {"items": [json.loads(r[1]) for r in rows], "next_cursor": next_cursor}
+
+
+if __name__ == "__main__":
+    # python saved_index.py rebuild [--dir saved_records] [--index saved_records/index.sqlite3]
+    parser = argparse.ArgumentParser(description="Maintain the saved_records index")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--dir", default=SAVED_DIR)
+    parser.add_argument("--index", default=None)
+    args = parser.parse_args()
+
+    idx = SavedIndex(path=args.index or os.path.join(args.dir, "index.sqlite3"), saved_dir=args.dir)
+    print(f"indexed {idx.rebuild()} records from {args.dir}")
@@ -0,0 +1,58 @@
+import os, sys, tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+DB_ENV = ("SUPABASE_DB_HOST", "SUPABASE_DB_PORT", "SUPABASE_DB_NAME", "SUPABASE_DB_USER", "SUPABASE_DB_PASSWORD")
+
+
+@pytest.fixture(scope="session")
+def pg_params():
+    """
+    Postgres สำหรับเทส: TEST_DB_HOST/TEST_DB_PORT/TEST_DB_NAME/TEST_DB_USER/TEST_DB_PASSWORD
+    ถ้าไม่ได้ตั้ง ใช้ pgserver (pip install pgserver) ถ้าไม่มีทั้งคู่ข้ามเทสที่ใช้ฐานข้อมูล
+    """
+    if os.getenv("TEST_DB_HOST"):
+        yield {k: os.getenv(k.replace("SUPABASE_", "TEST_")) for k in DB_ENV}
+        return
+    pgserver = pytest.importorskip("pgserver")
+    server = pgserver.get_server(tempfile.mkdtemp(prefix="pg_test_"), cleanup_mode="stop")
+    yield {
+        "SUPABASE_DB_HOST": None,
+        "SUPABASE_DB_PORT": "5432", "SUPABASE_DB_NAME": "postgres", "SUPABASE_DB_USER": "postgres",
+        "SUPABASE_DB_PASSWORD": None, "_uri": server.get_uri(),
+    }
+
+
+@pytest.fixture
+def db(pg_params, monkeypatch):
+    """DatabaseConnection ต่อตรง (ไม่ใช้ pool) บนตารางที่สร้างใหม่ทุกเทส"""
+    from urllib.parse import urlparse, parse_qs
+    from database import conn
+
+    params = dict(pg_params)
+    uri = params.pop("_uri", None)
+    if uri:
+        # pgserver ฟังบน unix socket: postgresql://postgres:@/postgres?host=<dir>
+        params["SUPABASE_DB_HOST"] = parse_qs(urlparse(uri).query)["host"][0]
+    for key, value in params.items():
+        if value is None:
+            monkeypatch.delenv(key, raising=False)
+        else:
+            monkeypatch.setenv(key, value)
+    monkeypatch.setattr(conn, "_pool", None)
+    monkeypatch.setattr(conn, "_document_unique_index", None)
+
+    database = conn.DatabaseConnection()
+    assert database.connection is not None, "cannot connect to test database"
+    database.cursor.execute("DROP TABLE IF EXISTS document_result_history, document, employee CASCADE")
+    assert database.create_table() == "create table success"
+    database.cursor.execute(
+        "INSERT INTO employee (name, email, password_hash) VALUES ('tester', 'tester@example.com', 'x') RETURNING id"
+    )
+    database.employee_id = database.cursor.fetchone()[0]
+    yield database
+    database.close()
@@ -0,0 +1,91 @@
+import asyncio, hashlib, io, zipfile
+
+import pytest
+
+import batch
+from batch import BatchProcessor
+
+PDF_A = b"%PDF-1.7 receipt A"
+PDF_B = b"%PDF-1.7 receipt B"
+SHA_A, SHA_B = hashlib.sha256(PDF_A).hexdigest(), hashlib.sha256(PDF_B).hexdigest()
+
+
+class FakePipeline:
+    """OCR/extract ปลอม: ไฟล์ละ 2 หน้า ผลของหน้าคือชื่อไฟล์ที่เก็บ + เลขหน้า"""
+
+    def __init__(self, entry, processed):
+        self.entry = entry
+        self.extractor = self
+        self.file_handler = entry["path"]
+        processed.append(entry["sha256"])
+
+    def iter_pages(self, file_handler):
+        for page in (1, 2):
+            yield page, None
+
+    async def aextract_page(self, item):
+        page, _ = item
+        return {"ok": True, "page": page, "payload": {"file": self.entry["saved_name"], "page": page}}
+
+    def classify_page(self, part, pred=None):
+        return {"ok": True, "page": part["page"], "result": {**part["payload"], "category": pred}}
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    state = {"known": {}, "processed": [], "remembered": {}}
+    monkeypatch.setattr(batch, "known_result", lambda sha: state["known"].get(sha))
+    monkeypatch.setattr(batch, "remember_result", lambda sha, pages, errors: state["remembered"].update({sha: pages}))
+    monkeypatch.setattr(BatchProcessor, "_pipeline", lambda self, entry: FakePipeline(entry, state["processed"]))
+    monkeypatch.setattr(batch.model_registry, "classify_batch", lambda payloads: ["cat"] * len(payloads))
+    state["upload_dir"] = str(tmp_path)
+    return state
+
+
+def processor(env, **kwargs):
+    return BatchProcessor(env["upload_dir"], max_bytes=1024, **kwargs)
+
+
+def test_known_files_skip_ocr(env):
+    env["known"][SHA_A] = {"1": {"cached": True}}
+    b = processor(env)
+    b.add("a.pdf", PDF_A)
+    b.add("b.pdf", PDF_B)
+    result = asyncio.run(b.run())
+
+    assert env["processed"] == [SHA_B]
+    assert result["files"]["a.pdf"]["pages"] == {"1": {"cached": True}}
+    assert result["files"]["a.pdf"]["cached"] is True
+    assert result["files"]["b.pdf"]["cached"] is False
+    assert set(result["files"]["b.pdf"]["pages"]) == {"1", "2"}
+    assert result["stats"] == {"files": 2, "unique": 2, "cached": 1, "pages": 2, "failed_pages": 0}
+    # จำผลเฉพาะไฟล์ที่เพิ่งประมวลผล
+    assert list(env["remembered"]) == [SHA_B]
+
+
+def test_bypass_cache_processes_everything(env):
+    env["known"][SHA_A] = {"1": {"cached": True}}
+    b = processor(env, bypass_cache=True)
+    b.add("a.pdf", PDF_A)
+    result = asyncio.run(b.run())
+    assert env["processed"] == [SHA_A]
+    assert result["files"]["a.pdf"]["cached"] is False
+
+
+def test_duplicate_names_keep_real_original_name(env):
+    b = processor(env)
+    b.add("x.pdf", PDF_A)
+    b.add("x.pdf", PDF_B)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("scans/x.pdf", PDF_A)
+    b.add_file("more.zip", io.BytesIO(archive.getvalue()), "application/zip")
+    result = asyncio.run(b.run())
+
+    assert list(result["files"]) == ["x.pdf", "x (2).pdf", "x (3).pdf"]
+    for key in result["files"]:
+        info = result["files"][key]
+        assert info["meta"]["original_name"] == "x.pdf"
+        assert info["download_path"].endswith("?name=x.pdf")
+    assert result["files"]["x (3).pdf"]["duplicate_of"] == "x.pdf"
+    assert env["processed"] == [SHA_A, SHA_B]
@@ -0,0 +1,225 @@
+import asyncio, threading, time, types
+
+import pytest
+
+import concurrency
+from concurrency import HostRateLimiter, ordered_map, aordered_map
+
+
+class FakeClock:
+    """แทน time.monotonic/time.sleep (และ asyncio.sleep) — sleep แค่เลื่อนเวลา"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    async def asleep(self, seconds):
+        self.sleep(seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(concurrency, "time", types.SimpleNamespace(monotonic=clock.monotonic, sleep=clock.sleep))
+    monkeypatch.setattr(asyncio, "sleep", clock.asleep)
+    return clock
+
+
+# ---- HostRateLimiter ----
+
+def test_burst_then_one_token_per_interval(clock):
+    limiter = HostRateLimiter(rate=2, burst=4)
+    for _ in range(4):
+        limiter.acquire("api")
+    assert clock.sleeps == []
+    start = clock.now
+    limiter.acquire("api")
+    assert clock.now - start == pytest.approx(0.5)
+    for _ in range(3):
+        limiter.acquire("api")
+    assert clock.now - start == pytest.approx(2.0)
+
+
+def test_partial_refill(clock):
+    limiter = HostRateLimiter(rate=2, burst=4)
+    for _ in range(4):
+        limiter.acquire("api")
+    clock.now += 1.0  # ได้คืน 2 token
+    limiter.acquire("api")
+    limiter.acquire("api")
+    assert clock.sleeps == []
+    limiter.acquire("api")
+    assert sum(clock.sleeps) == pytest.approx(0.5)
+
+
+def test_refill_is_capped_at_burst(clock):
+    limiter = HostRateLimiter(rate=2, burst=4)
+    limiter.acquire("api")
+    clock.now += 3600
+    for _ in range(4):
+        limiter.acquire("api")
+    assert clock.sleeps == []
+    limiter.acquire("api")
+    assert sum(clock.sleeps) == pytest.approx(0.5)
+
+
+def test_hosts_have_separate_buckets(clock):
+    limiter = HostRateLimiter(rate=1, burst=1)
+    limiter.acquire("a")
+    limiter.acquire("b")
+    assert clock.sleeps == []
+    limiter.acquire("a")
+    assert sum(clock.sleeps) == pytest.approx(1.0)
+
+
+def test_zero_rate_is_unlimited(clock):
+    limiter = HostRateLimiter(rate=0, burst=1)
+    for _ in range(100):
+        limiter.acquire("api")
+    asyncio.run(limiter.aacquire("api"))
+    assert clock.sleeps == []
+
+
+def test_async_acquire_uses_same_bucket(clock):
+    limiter = HostRateLimiter(rate=4, burst=2)
+
+    async def run():
+        limiter.acquire("api")
+        await limiter.aacquire("api")
+        await limiter.aacquire("api")
+
+    asyncio.run(run())
+    assert sum(clock.sleeps) == pytest.approx(0.25)
+
+
+# ---- ordered_map ----
+
+def test_ordered_map_keeps_input_order_when_work_finishes_in_reverse():
+    n = 6
+    release = [threading.Event() for _ in range(n)]
+    finished = []
+
+    def work(i):
+        assert release[i].wait(5)
+        finished.append(i)
+        if i > 0:
+            release[i - 1].set()  # ตัวถัดไปที่เสร็จคือตัวก่อนหน้า
+        return i * 10
+
+    release[-1].set()
+    assert list(ordered_map(work, range(n), max_workers=n)) == [i * 10 for i in range(n)]
+    assert finished == list(reversed(range(n)))
+
+
+def test_ordered_map_respects_worker_cap_and_pending_limit():
+    lock, release = threading.Lock(), threading.Event()
+    state = {"active": 0, "max_active": 0, "pulled": 0}
+    three_running = threading.Event()
+
+    def items():
+        for i in range(20):
+            state["pulled"] += 1
+            yield i
+
+    def work(i):
+        with lock:
+            state["active"] += 1
+            state["max_active"] = max(state["max_active"], state["active"])
+            if state["active"] == 3:
+                three_running.set()
+        assert release.wait(5)
+        with lock:
+            state["active"] -= 1
+        return i
+
+    results = ordered_map(work, items(), max_workers=3, max_pending=5)
+    consumer = threading.Thread(target=lambda: state.update(out=list(results)))
+    consumer.start()
+    assert three_running.wait(5)
+    for _ in range(500):  # รอให้ thread หลัก submit ครบ max_pending (ตัวที่ 6 ต้องรอผลของตัวแรก)
+        if state["pulled"] >= 5:
+            break
+        time.sleep(0.01)
+    time.sleep(0.05)
+    # ยังไม่มีงานไหนเสร็จ: รันอยู่ 3 ตัว และดึง items มาไม่เกิน max_pending
+    assert state["active"] == 3 and state["pulled"] == 5
+    release.set()
+    consumer.join(5)
+    assert state["out"] == list(range(20))
+    assert state["max_active"] == 3
+
+
+def test_ordered_map_raises_at_failing_item():
+    def work(i):
+        if i == 2:
+            raise RuntimeError("bad page")
+        return i
+
+    results = ordered_map(work, range(5), max_workers=2)
+    assert [next(results), next(results)] == [0, 1]
+    with pytest.raises(RuntimeError, match="bad page"):
+        next(results)
+
+
+# ---- aordered_map ----
+
+def test_aordered_map_keeps_input_order_when_work_finishes_in_reverse():
+    n = 6
+
+    async def run():
+        release = [asyncio.Event() for _ in range(n)]
+        finished = []
+
+        async def work(i):
+            await release[i].wait()
+            finished.append(i)
+            if i > 0:
+                release[i - 1].set()
+            return i * 10
+
+        release[-1].set()
+        out = [r async for r in aordered_map(work, range(n), max_pending=n)]
+        return out, finished
+
+    out, finished = asyncio.run(run())
+    assert out == [i * 10 for i in range(n)]
+    assert finished == list(reversed(range(n)))
+
+
+def test_aordered_map_caps_pending_tasks():
+    state = {"active": 0, "max_active": 0, "pulled": 0}
+
+    def items():
+        for i in range(12):
+            state["pulled"] += 1
+            yield i
+
+    async def run():
+        full = asyncio.Event()
+
+        async def work(i):
+            state["active"] += 1
+            state["max_active"] = max(state["max_active"], state["active"])
+            if state["active"] == 3:
+                full.set()
+            if i < 3:
+                await full.wait()  # สามตัวแรกค้างจนมีงานค้างครบ max_pending
+            await asyncio.sleep(0)
+            state["active"] -= 1
+            return i
+
+        out = []
+        async for r in aordered_map(work, items(), max_pending=3):
+            assert state["pulled"] - len(out) <= 3
+            out.append(r)
+        return out
+
+    assert asyncio.run(run()) == list(range(12))
+    assert state["max_active"] == 3
@@ -0,0 +1,114 @@
+from datetime import datetime
+
+import pytest
+
+from condition import RuleEngine, RULE_SETS, DEDUCTIBLE, NOT_DEDUCTIBLE, PASSED
+
+NOW = datetime(2025, 6, 1)  # ปีภาษี 2568
+TAX_YEAR = 2568
+
+LIFE = "เบี้ยประกันชีวิต"
+ANNUITY = "เบี้ยประกันชีวิตแบบบำนาญ"
+RMF = "ค่าซื้อหน่วยลงทุนเพื่อการเลี้ยงชีพ (RMF)"
+SSF = "ค่าซื้อหน่วยลงทุนในกองทุนรวมเพื่อการออม SSF"
+THAI_ESG = "ค่าซื้อหน่วยลงทุนในกองทุนรวมไทยเพื่อความยั่งยืน (Thai ESG)"
+POLITICAL = "เงินบริจาคพรรคการเมือง"
+TRAVEL = "ค่าท่องเที่ยวภายในประเทศ"
+CONSTRUCTION = "ค่าจ้างก่อสร้างอาคารเพื่ออยู่อาศัยขึ้นใหม่ให้แก่ผู้รับจ้างซึ่งเป็นผู้ประกอบการจดทะเบียนภาษีมูลค่าเพิ่ม"
+FLOOD_HOUSE = "ค่าซ่อมบ้านจากอุทกภัย"
+FLOOD_CAR = "ค่าซ่อมรถจากอุทกภัย"
+
+
+def document(item, date, warranty=None, invoice_type="Full Invoice"):
+    d, m, y = date
+    return {
+        "verified_seller_name": {"matched": True},
+        "date": {"day": str(d), "month": str(m), "year": str(y)},
+        "warranty_period": warranty,
+        "invoice_type": invoice_type,
+        "items": [dict(item)],
+    }
+
+
+def item_status(item, date, tax_year=None, **kwargs):
+    data = RuleEngine("2025.1", now=NOW, tax_year=tax_year).evaluate(document(item, date, **kwargs))
+    assert data["deduction_status"] == PASSED, data.get("reason")
+    return data["items"][0]["deduction_status"]
+
+
+@pytest.mark.parametrize("item, date, kwargs, expected", [
+    ({"sub_category": LIFE}, (1, 6, 2568), {"warranty": 10}, DEDUCTIBLE),
+    ({"sub_category": LIFE}, (1, 6, 2568), {"warranty": 9}, NOT_DEDUCTIBLE),
+    ({"sub_category": ANNUITY}, (1, 6, 2568), {"warranty": 10}, DEDUCTIBLE),
+    ({"sub_category": ANNUITY}, (1, 6, 2568), {"warranty": 9}, NOT_DEDUCTIBLE),
+    ({"sub_category": RMF}, (1, 6, 2568), {"warranty": 5}, DEDUCTIBLE),
+    ({"sub_category": RMF}, (1, 6, 2568), {"warranty": 4}, NOT_DEDUCTIBLE),
+    ({"sub_category": SSF}, (1, 6, 2568), {"warranty": 10}, DEDUCTIBLE),
+    ({"sub_category": SSF}, (1, 6, 2568), {"warranty": 9}, NOT_DEDUCTIBLE),
+    ({"sub_category": THAI_ESG}, (1, 1, 2568), {}, DEDUCTIBLE),
+    ({"sub_category": THAI_ESG}, (31, 12, 2568), {}, DEDUCTIBLE),
+    ({"sub_category": POLITICAL}, (1, 6, 2568), {}, DEDUCTIBLE),
+    ({"sub_category": TRAVEL}, (30, 4, 2568), {}, NOT_DEDUCTIBLE),
+    ({"sub_category": TRAVEL}, (1, 5, 2568), {}, DEDUCTIBLE),
+    ({"sub_category": TRAVEL}, (1, 6, 2568), {}, DEDUCTIBLE),
+    ({"sub_category": TRAVEL}, (30, 11, 2568), {}, DEDUCTIBLE),
+    ({"sub_category": TRAVEL}, (1, 12, 2568), {}, NOT_DEDUCTIBLE),
+    ({"sub_category": CONSTRUCTION}, (8, 4, 2568), {}, NOT_DEDUCTIBLE),
+    ({"sub_category": CONSTRUCTION}, (9, 4, 2568), {}, DEDUCTIBLE),
+    ({"sub_category": CONSTRUCTION}, (10, 5, 2568), {}, DEDUCTIBLE),
+    ({"sub_category": CONSTRUCTION}, (31, 12, 2568), {}, DEDUCTIBLE),
+    ({"sub_category": FLOOD_HOUSE}, (15, 8, 2568), {}, NOT_DEDUCTIBLE),
+    ({"sub_category": FLOOD_HOUSE}, (16, 8, 2568), {}, DEDUCTIBLE),
+    ({"sub_category": FLOOD_HOUSE}, (31, 12, 2568), {}, DEDUCTIBLE),
+    ({"sub_category": FLOOD_CAR}, (15, 8, 2568), {}, NOT_DEDUCTIBLE),
+    ({"sub_category": FLOOD_CAR}, (16, 8, 2568), {}, DEDUCTIBLE),
+    ({"sub_category": FLOOD_CAR}, (31, 12, 2568), {}, DEDUCTIBLE),
+    ({"category": "Easy E-Receipt"}, (1, 1, 2568), {}, DEDUCTIBLE),
+    ({"category": "Easy E-Receipt"}, (15, 2, 2568), {}, DEDUCTIBLE),
+    ({"category": "Easy E-Receipt"}, (16, 2, 2568), {}, NOT_DEDUCTIBLE),
+    ({"category": "Easy E-Receipt"}, (1, 2, 2568), {"invoice_type": "Simple Invoice"}, NOT_DEDUCTIBLE),
+    ({"category": "อื่น ๆ"}, (1, 6, 2568), {}, DEDUCTIBLE),
+])
+def test_item_windows_in_current_tax_year(item, date, kwargs, expected):
+    assert item_status(item, date, **kwargs) == expected
+
+
+@pytest.mark.parametrize("item, date, tax_year, kwargs, expected", [
+    # กฎที่มีปีตายตัว: ตรวจด้วยปีภาษีก่อนปีเริ่มใช้
+    ({"sub_category": SSF}, (31, 12, 2562), 2562, {"warranty": 10}, NOT_DEDUCTIBLE),
+    ({"sub_category": SSF}, (1, 1, 2563), 2563, {"warranty": 10}, DEDUCTIBLE),
+    ({"sub_category": POLITICAL}, (31, 12, 2560), 2560, {}, NOT_DEDUCTIBLE),
+    ({"sub_category": POLITICAL}, (1, 1, 2561), 2561, {}, DEDUCTIBLE),
+    # ช่วงวันที่สัมพัทธ์เลื่อนตามปีภาษีที่ตรวจ
+    ({"sub_category": TRAVEL}, (1, 6, 2567), 2567, {}, DEDUCTIBLE),
+    ({"sub_category": TRAVEL}, (1, 12, 2567), 2567, {}, NOT_DEDUCTIBLE),
+    ({"category": "Easy E-Receipt"}, (15, 2, 2567), 2567, {}, DEDUCTIBLE),
+])
+def test_item_windows_follow_tax_year(item, date, tax_year, kwargs, expected):
+    assert item_status(item, date, tax_year=tax_year, **kwargs) == expected
+
+
+def test_every_rule_is_covered():
+    covered = {LIFE, ANNUITY, RMF, SSF, THAI_ESG, POLITICAL, TRAVEL, CONSTRUCTION, FLOOD_HOUSE, FLOOD_CAR, "Easy E-Receipt"}
+    assert {rule.sub_category or rule.category for rule in RULE_SETS["2025.1"]} == covered
+
+
+def test_document_from_other_year_is_rejected():
+    data = RuleEngine("2025.1", now=NOW).evaluate(document({"sub_category": TRAVEL}, (1, 6, 2567)))
+    assert data["deduction_status"] == NOT_DEDUCTIBLE
+    assert "ปีภาษีไม่ตรง (ต้องเป็น 2568)" in data["reason"]
+
+
+def test_unverified_seller_is_rejected():
+    data = document({"sub_category": TRAVEL}, (1, 6, 2568))
+    data["verified_seller_name"] = {"matched": False}
+    data = RuleEngine("2025.1", now=NOW).evaluate(data)
+    assert data["deduction_status"] == NOT_DEDUCTIBLE
+    assert "ยืนยันชื่อบริษัท" in data["reason"]
+
+
+def test_evaluate_many_uses_each_document_tax_year():
+    docs = [document({"sub_category": TRAVEL}, (1, 6, 2567)), document({"sub_category": TRAVEL}, (1, 6, 2568))]
+    out = RuleEngine("2025.1", now=NOW).evaluate_many(docs, tax_years=[2567, 2568])
+    assert [d["deduction_status"] for d in out] == [PASSED, PASSED]
+    assert [d["tax_year"] for d in out] == [2567, 2568]
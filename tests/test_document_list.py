@@ -0,0 +1,107 @@
+import base64, hashlib, json
+from datetime import date, datetime
+
+import pytest
+
+from database.conn import encode_cursor, decode_cursor
+
+
+def b64(obj) -> str:
+    return base64.urlsafe_b64encode(json.dumps(obj).encode()).decode()
+
+
+@pytest.mark.parametrize("sort,value", [
+    ("created_at", datetime(2025, 3, 1, 9, 30, 15, 123456)),
+    ("doc_date", date(2025, 3, 1)),
+    ("doc_date", None),
+])
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_cursor_round_trip(sort, value, order):
+    assert decode_cursor(encode_cursor(sort, order, value, 42), sort, order) == (value, 42)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64 !!", "ไทย", b64("x"), b64(["created_at", "desc", "2025-03-01"]),
+    b64(["created_at", "desc", 5, 1]), b64(["created_at", "desc", "yesterday", 1]),
+    b64(["created_at", "desc", "2025-03-01T00:00:00", "abc"]), b64(["created_at", "desc", None, None]),
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+])
+def test_malformed_cursor_is_value_error(cursor):
+    with pytest.raises(ValueError, match="invalid cursor"):
+        decode_cursor(cursor, "created_at", "desc")
+
+
+def test_cursor_from_other_sort_is_value_error():
+    cursor = encode_cursor("created_at", "desc", datetime(2025, 3, 1), 1)
+    with pytest.raises(ValueError, match="sort/order"):
+        decode_cursor(cursor, "doc_date", "desc")
+    with pytest.raises(ValueError, match="sort/order"):
+        decode_cursor(cursor, "created_at", "asc")
+
+
+# ---- list_documents บน Postgres ----
+
+TIED = datetime(2025, 3, 1, 9, 0, 0)
+
+
+@pytest.fixture
+def documents(db):
+    """เอกสาร 7 ฉบับ created_at ซ้ำกันเป็นกลุ่ม และ doc_date บางฉบับเป็น NULL"""
+    docs = [{
+        "meta": {"original_name": f"r{n}.pdf", "file_path": f"/uploads/{n}.pdf", "mime_type": "application/pdf",
+                 "file_size_bytes": 1, "sha256": hashlib.sha256(bytes([n])).hexdigest()},
+        "result_json": {"marker": n},
+    } for n in range(7)]
+    ids = [r["id"] for r in db.insert_documents_bulk(db.employee_id, "member", docs)]
+    created = [TIED, TIED, TIED, datetime(2025, 2, 1), TIED, datetime(2025, 4, 1), datetime(2025, 2, 1)]
+    doc_dates = [date(2025, 1, 5), None, date(2025, 1, 5), None, date(2025, 1, 1), date(2025, 1, 5), None]
+    for doc_id, c, d in zip(ids, created, doc_dates):
+        db.cursor.execute("UPDATE document SET created_at = %s, doc_date = %s WHERE id = %s", (c, d, doc_id))
+    return [{"id": i, "created_at": c, "doc_date": d} for i, c, d in zip(ids, created, doc_dates)]
+
+
+def page_through(db, sort, order, limit):
+    ids, cursor = [], None
+    while True:
+        page = db.list_documents(db.employee_id, limit=limit, cursor=cursor, sort=sort, order=order)
+        assert len(page["documents"]) <= limit
+        ids += [d["id"] for d in page["documents"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids
+
+
+def expected(documents, sort, order):
+    # NULL อยู่ท้ายเสมอ แล้วเรียงตาม id ในทิศเดียวกัน
+    sign = -1 if order == "desc" else 1
+    with_value = [d for d in documents if d[sort] is not None]
+    nulls = [d for d in documents if d[sort] is None]
+    key = lambda d: (d[sort], d["id"])
+    return ([d["id"] for d in sorted(with_value, key=key, reverse=sign < 0)]
+            + sorted((d["id"] for d in nulls), reverse=sign < 0))
+
+
+@pytest.mark.parametrize("sort", ["created_at", "doc_date"])
+@pytest.mark.parametrize("order", ["asc", "desc"])
+@pytest.mark.parametrize("limit", [1, 2, 3, 10])
+def test_pages_are_stable_when_sort_values_tie(db, documents, sort, order, limit):
+    ids = page_through(db, sort, order, limit)
+    assert ids == expected(documents, sort, order)
+    assert len(set(ids)) == len(documents)
+
+
+def test_malformed_cursor_is_400(db, documents):
+    from fastapi.testclient import TestClient
+    import app
+
+    client = TestClient(app.app)
+    params = {"employee_id": db.employee_id, "limit": 2}
+    first = client.get("/api/get_all_document", params=params)
+    assert first.status_code == 200 and first.json()["next_cursor"]
+
+    for cursor in ("garbage", b64(["created_at", "desc", 5, 1])):
+        response = client.get("/api/get_all_document", params={**params, "cursor": cursor})
+        assert response.status_code == 400
+        assert response.json()["detail"] == "invalid cursor"
+    response = client.get("/api/get_all_document", params={**params, "cursor": first.json()["next_cursor"]})
+    assert response.status_code == 200 and len(response.json()["documents"]) == 2
@@ -0,0 +1,115 @@
+import hashlib
+
+import pytest
+
+from database import conn
+
+
+def sha(n) -> str:
+    return hashlib.sha256(str(n).encode()).hexdigest()
+
+
+def doc(n, name=None):
+    return {
+        "meta": {
+            "original_name": name or f"receipt_{n}.pdf", "file_path": f"/uploads/{sha(n)}.pdf",
+            "mime_type": "application/pdf", "file_size_bytes": 100 + n, "sha256": sha(n),
+        },
+        "result_json": {"marker": n, "deduction_status": "ผ่านเงื่อนไขเบื้องต้น"},
+    }
+
+
+def raw_insert(db, n):
+    """แถวแบบที่ตารางเดิม (ก่อนมี unique index) เก็บไว้ได้"""
+    db.cursor.execute("""
+        INSERT INTO document (employee_id, member_name, original_name, file_path, mime_type,
+                              file_size_bytes, sha256, result_json)
+        VALUES (%s, 'm', %s, '/uploads/x.pdf', 'application/pdf', 1, %s, %s::jsonb) RETURNING id
+    """, (db.employee_id, f"receipt_{n}.pdf", sha(n), '{"marker": %d}' % n))
+    return db.cursor.fetchone()[0]
+
+
+def count(db, sql, params=()):
+    db.cursor.execute(sql, params)
+    return db.cursor.fetchone()[0]
+
+
+def history_matches_documents(db):
+    """ทุกแถว history ชี้ไปที่เอกสารที่มี marker เดียวกัน (sha256 ของ marker)"""
+    db.cursor.execute("""
+        SELECT d.sha256, (h.result_json->>'marker')::int FROM document_result_history h
+        JOIN document d ON d.id = h.document_id WHERE h.stage = 'final'
+    """)
+    rows = db.cursor.fetchall()
+    return bool(rows) and all(doc_sha == sha(marker) for doc_sha, marker in rows)
+
+
+def drop_index_with_duplicates(db):
+    db.cursor.execute("DROP INDEX uq_document_emp_sha")
+    first, second = raw_insert(db, 1), raw_insert(db, 1)
+    db.cursor.execute(
+        "INSERT INTO document_result_history (document_id, stage, result_json) VALUES (%s, 'final', %s::jsonb)",
+        (first, '{"marker": 1}')
+    )
+    conn._document_unique_index = None
+    return first, second
+
+
+@pytest.mark.parametrize("with_index", [True, False])
+def test_bad_row_does_not_roll_back_good_rows(db, with_index):
+    if not with_index:
+        db.cursor.execute("DROP INDEX uq_document_emp_sha")
+        conn._document_unique_index = None
+    # original_name ยาวเกิน VARCHAR(255): ผ่านการเตรียมแถวแต่ล้มใน INSERT -> ลองใหม่ทีละแถว
+    docs = [doc(1), doc(2, name="x" * 300 + ".pdf"), doc(3), {"meta": {}, "result_json": {}}]
+    results = db.insert_documents_bulk(db.employee_id, "member", docs, rules_version="2025.1")
+
+    assert [r["ok"] for r in results] == [True, False, True, False]
+    assert "StringDataRightTruncation" in results[1]["error"]
+    assert results[3]["error"]
+    assert count(db, "SELECT count(*) FROM document") == 2
+    assert count(db, "SELECT count(*) FROM document_result_history") == 2
+    assert history_matches_documents(db)
+    db.cursor.execute("SELECT id, sha256 FROM document")
+    assert dict((s, i) for i, s in db.cursor.fetchall()) == {sha(1): results[0]["id"], sha(3): results[2]["id"]}
+
+
+def test_upsert_keeps_one_row_per_file(db):
+    first = db.insert_documents_bulk(db.employee_id, "member", [doc(1), doc(2)])
+    again = db.insert_documents_bulk(db.employee_id, "member", [doc(2), doc(1), doc(1)])
+    assert {r["id"] for r in again} == {r["id"] for r in first}
+    assert count(db, "SELECT count(*) FROM document") == 2
+    assert count(db, "SELECT count(*) FROM document_result_history") == 4
+    assert history_matches_documents(db)
+
+
+def test_duplicates_block_index_without_deleting_rows(db):
+    drop_index_with_duplicates(db)
+    assert db.create_table() == "create table success"
+    assert db.has_document_unique_index() is False
+    assert count(db, "SELECT count(*) FROM document") == 2
+
+    # ไม่มี index: INSERT ธรรมดา (ไม่ใช่ ON CONFLICT) ยังบันทึกได้
+    results = db.insert_documents_bulk(db.employee_id, "member", [doc(1), doc(2)])
+    assert all(r["ok"] for r in results)
+    assert count(db, "SELECT count(*) FROM document") == 4
+    assert db.insert_document(db.employee_id, "member", doc(3)["meta"], doc(3)["result_json"])
+
+
+def test_dedupe_migration_reports_then_merges(db):
+    first, second = drop_index_with_duplicates(db)
+    raw_insert(db, 2)
+
+    found = db.find_duplicate_documents()
+    assert found == [{"employee_id": db.employee_id, "sha256": sha(1), "ids": [first, second]}]
+    assert count(db, "SELECT count(*) FROM document") == 3  # รายงานอย่างเดียวไม่แก้ข้อมูล
+
+    assert db.dedupe_documents() == 1
+    assert db.find_duplicate_documents() == []
+    assert count(db, "SELECT count(*) FROM document WHERE id = %s", (first,)) == 0
+    # history เดิมย้ายไปแถวที่เก็บ และแถวที่ลบถูกเก็บไว้ทั้งแถว
+    db.cursor.execute("SELECT document_id, stage, result_json->>'id' FROM document_result_history ORDER BY id")
+    assert db.cursor.fetchall() == [(second, "final", None), (second, "dedupe", str(first))]
+    assert db.has_document_unique_index() is True
+    results = db.insert_documents_bulk(db.employee_id, "member", [doc(1)])
+    assert results[0]["id"] == second
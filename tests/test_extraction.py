@@ -0,0 +1,61 @@
+import pytest
+
+import extraction
+from extraction import InvoiceExtractor, REQUIRED_FIELDS
+
+SSF_COMPLETE = """# หนังสือรับรองการซื้อหน่วยลงทุนในกองทุนรวมเพื่อการออม (SSF)
+บริษัทหลักทรัพย์จัดการกองทุน ตัวอย่าง จำกัด
+เลขประจำตัวผู้เสียภาษี 0105536000313
+วันที่ 15/03/2568
+จำนวนเงินที่ซื้อ 50,000.00 บาท
+"""
+# ไม่มีเลขประจำตัวผู้เสียภาษี — ต้องเรียก LLM
+SSF_INCOMPLETE = SSF_COMPLETE.replace("เลขประจำตัวผู้เสียภาษี 0105536000313\n", "")
+
+LLM_JSON = {
+    "title": "หนังสือรับรอง SSF", "seller": "บริษัทหลักทรัพย์จัดการกองทุน ตัวอย่าง จำกัด",
+    "tax_id": "0105536000313", "date": {"day": "15", "month": "03", "year": "2568"},
+    "total": "50000.00", "name_company": "บริษัทหลักทรัพย์จัดการกองทุน ตัวอย่าง จำกัด", "items": [],
+}
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(extraction, "get_client", lambda: None)
+    monkeypatch.setattr(extraction, "LOCAL_EXTRACTION", True)
+
+    def cached_extract(self, bypass_cache=False):
+        calls.append(self.markdown)
+        return {"invoice_type": self.invoice_type, "raw": "", "fixed": "", "json": dict(LLM_JSON)}
+
+    monkeypatch.setattr(InvoiceExtractor, "cached_extract", cached_extract)
+    return calls
+
+
+def test_complete_template_match_skips_llm(llm_calls):
+    out = InvoiceExtractor(SSF_COMPLETE).extract()
+    assert llm_calls == []
+    data = out["json"]
+    assert data["extraction"]["path"] == "local"
+    assert data["extraction"]["template"] == "ssf_rmf"
+    assert all(data["extraction"]["field_sources"][f] == "local" for f in REQUIRED_FIELDS)
+    assert data["tax_id"] == "0105536000313"
+    assert data["total"] == "50,000.00"
+    # ไม่เดา name_company จาก seller
+    assert data["name_company"] is None
+
+
+def test_incomplete_template_match_calls_llm(llm_calls):
+    out = InvoiceExtractor(SSF_INCOMPLETE).extract()
+    assert llm_calls == [SSF_INCOMPLETE]
+    data = out["json"]
+    assert data["extraction"]["path"] == "local+llm"
+    assert data["extraction"]["field_sources"]["tax_id"] == "llm"
+    assert data["extraction"]["field_sources"]["total"] == "local"
+    assert data["name_company"] == LLM_JSON["name_company"]
+
+
+def test_keyword_must_be_whole_word(llm_calls):
+    assert extraction.local_extractor.match("รหัส SSFX001") is None
+    assert extraction.local_extractor.match("กองทุน SSF ตัวอย่าง").name == "ssf_rmf"
@@ -0,0 +1,22 @@
+import pipeline
+
+SHA = "ab" * 32
+
+
+def test_document_key_follows_tax_year_of_rule_check(monkeypatch):
+    monkeypatch.setattr(pipeline.model_registry, "fingerprint", lambda: "models-1")
+    monkeypatch.setattr(pipeline, "current_tax_year", lambda: 2568)
+    key = pipeline._document_key(SHA)
+    assert pipeline._document_key(SHA) == key
+    assert pipeline._document_key("cd" * 32) != key
+
+    monkeypatch.setattr(pipeline, "current_tax_year", lambda: 2569)
+    assert pipeline._document_key(SHA) != key
+
+
+def test_document_key_follows_classifier_models(monkeypatch):
+    monkeypatch.setattr(pipeline, "current_tax_year", lambda: 2568)
+    monkeypatch.setattr(pipeline.model_registry, "fingerprint", lambda: "models-1")
+    key = pipeline._document_key(SHA)
+    monkeypatch.setattr(pipeline.model_registry, "fingerprint", lambda: "models-2")
+    assert pipeline._document_key(SHA) != key
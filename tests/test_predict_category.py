@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+import predict_category
+from embeddings import EmbeddingTable, sentence_cache
+from predict_category import prediction
+
+WORDS = ["ภาษี", "บริจาค", "ประกัน", "กองทุน"]
+
+
+class DictVectors:
+    """word vector แบบ dict (ไม่มี key_to_index) — ทางเดียวกับ gensim รุ่นเก่า"""
+
+    def __init__(self, table):
+        self.table = table
+        self.vector_size = table.vector_size
+
+    def __contains__(self, word):
+        return word in self.table
+
+    def __getitem__(self, word):
+        return self.table[word]
+
+
+class MainModel:
+    """หมวดหลักจากเครื่องหมายของผลรวมเวกเตอร์ — เวกเตอร์ศูนย์ได้หมวดที่ไม่มี sub-model"""
+
+    def predict(self, X):
+        X = np.asarray(X)
+        total = X.sum(axis=1)
+        return np.where(total > 0, "เงินบริจาค", np.where(total < 0, "Easy E-Receipt", "อื่น ๆ"))
+
+
+class Vectorizer:
+    def transform(self, texts):
+        return list(texts)
+
+
+class SubModel:
+    def __init__(self, name):
+        self.name = name
+
+    def predict(self, X):
+        return np.array([f"{self.name}:{len(text.split())}" for text in X], dtype=object)
+
+
+def models():
+    out = {"main_model": MainModel(), "thai2vec_model": table(), "stopwords": {"ของ"}}
+    for model_key, vec_key in predict_category.SUB_MODEL_KEYS.values():
+        out[model_key], out[vec_key] = SubModel(model_key), Vectorizer()
+    return out
+
+
+@pytest.fixture(autouse=True)
+def whitespace_tokenizer(monkeypatch):
+    monkeypatch.setattr(predict_category, "word_tokenize", lambda text, engine=None: text.split())
+    sentence_cache.clear()
+    yield
+    sentence_cache.clear()
+
+
+def table():
+    vectors = np.arange(len(WORDS) * 3, dtype=np.float32).reshape(len(WORDS), 3) - 4
+    return EmbeddingTable(vectors, {w: i for i, w in enumerate(WORDS)}, cache_key="test-table")
+
+
+@pytest.mark.parametrize("kv", [table(), DictVectors(table())], ids=["table", "dict"])
+@pytest.mark.parametrize("sentence", ["", "ไม่มี ในตาราง"])
+def test_sentence_without_known_words_is_float32_zeros(kv, sentence):
+    p = prediction({}, models={**models(), "thai2vec_model": kv})
+    vec = p.sentence_vector(sentence)
+    assert vec.dtype == np.float32
+    np.testing.assert_array_equal(vec, np.zeros(3, dtype=np.float32))
+    assert p.sentence_vectors([sentence]).dtype == np.float32
+    assert p.sentence_vectors([]).shape == (0, 3)
+    assert p.sentence_vectors([]).dtype == np.float32
+
+
+DOCS = [
+    {"title": "บริจาค ภาษี", "total": "1"},
+    {"title": "ประกัน กองทุน"},
+    {"title": ""},
+    {"title": "บริจาค ภาษี", "total": "2"},
+    {"seller": "no title"},
+    {"title": "ภาษี"},
+    {"title": "ของ ไม่มี ในตาราง!!"},
+    {"title": ""},
+    {"title": "ประกัน กองทุน"},
+    {"title": "บริจาค, กองทุน ของ"},
+]
+
+
+def run_each(docs, model_set):
+    return [prediction(dict(d), models=model_set).run() for d in docs]
+
+
+@pytest.mark.parametrize("kv", [table(), DictVectors(table())], ids=["table", "dict"])
+def test_run_batch_matches_run(kv):
+    model_set = {**models(), "thai2vec_model": kv}
+    expected = run_each(DOCS, model_set)
+    # ผลต้องไม่ขึ้นกับว่ามี sentence cache จาก run() อยู่แล้วหรือไม่
+    sentence_cache.clear()
+    batch = prediction({}, models=model_set)
+    assert batch.run_batch([dict(d) for d in DOCS]) == expected
+    assert batch.run_batch([dict(d) for d in DOCS]) == expected
+    # ครอบคลุมทุกแบบ: มี sub-model, ไม่มี sub-model (เวกเตอร์ศูนย์) และ title ซ้ำ
+    assert {d["category"] for d in expected} == {"เงินบริจาค", "Easy E-Receipt", "อื่น ๆ"}
+
+
+def test_run_batch_accepts_json_strings_and_empty_input():
+    model_set = models()
+    batch = prediction({}, models=model_set)
+    payloads = ['{"title": "บริจาค ภาษี"}', 'result: {"title": ""} done', {"title": "ภาษี"}]
+    expected = run_each([{"title": "บริจาค ภาษี"}, {"title": ""}, {"title": "ภาษี"}], model_set)
+    assert batch.run_batch(payloads) == expected
+    assert batch.run_batch([]) == []
@@ -0,0 +1,44 @@
+import cv2
+import numpy as np
+import pytest
+
+import prepro
+from prepro import ImageProcessor
+
+
+def page(width, height):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (height, width), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("size,max_dim,expected", [
+    ((400, 300), None, (800, 600)),     # ค่าเดิม: ขยาย 2 เท่า
+    ((400, 300), 1800, (800, 600)),     # 2 เท่ายังไม่เกิน max_dim
+    ((1200, 900), 1800, (1800, 1350)),  # ขยายน้อยกว่า 2 เท่า
+    ((900, 1800), 1800, (900, 1800)),   # พอดีแล้ว ไม่ resize
+    ((2480, 3508), 1800, (1273, 1800)), # A4 300dpi: ย่อ
+])
+def test_preprocess_to_png_size(size, max_dim, expected):
+    png, (width, height) = ImageProcessor.preprocess_to_png(page(*size), max_dim=max_dim)
+    assert (width, height) == expected
+    decoded = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_UNCHANGED)
+    assert decoded.shape == (expected[1], expected[0])
+    assert set(np.unique(decoded)) <= {0, 255}
+
+
+def test_large_page_is_resized_once_before_threshold(monkeypatch):
+    calls = []
+    resize, threshold = cv2.resize, cv2.adaptiveThreshold
+
+    def counting_resize(src, dsize, *args, **kwargs):
+        calls.append(("resize", src.shape))
+        return resize(src, dsize, *args, **kwargs)
+
+    def counting_threshold(src, *args):
+        calls.append(("threshold", src.shape))
+        return threshold(src, *args)
+
+    monkeypatch.setattr(prepro.cv2, "resize", counting_resize)
+    monkeypatch.setattr(prepro.cv2, "adaptiveThreshold", counting_threshold)
+    ImageProcessor.preprocess_to_png(page(2480, 3508), max_dim=1800)
+    assert calls == [("resize", (3508, 2480)), ("threshold", (1800, 1273))]
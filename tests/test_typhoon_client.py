@@ -0,0 +1,66 @@
+import asyncio, threading
+
+import pytest
+
+import typhoon_client
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setenv("TYPHOON_OCR_API_KEY", "test-key")
+    monkeypatch.setattr(typhoon_client, "load_dotenv", lambda: None)
+    monkeypatch.setattr(typhoon_client, "_async", {"loop": None, "client": None, "semaphore": None, "in_flight": 0})
+
+
+async def client_of_loop():
+    client = typhoon_client.get_async_client()
+    assert typhoon_client.get_async_client() is client  # loop เดียวกันใช้ตัวเดิม
+    return client
+
+
+def test_previous_client_is_closed_when_loop_changes():
+    first = asyncio.run(client_of_loop())
+
+    async def second_loop():
+        client = typhoon_client.get_async_client()
+        await asyncio.sleep(0)  # ให้ task ที่ปิด client เก่าได้รัน
+        await asyncio.gather(*typhoon_client._closing)
+        return client
+
+    second = asyncio.run(second_loop())
+    assert second is not first
+    assert first.is_closed() and not second.is_closed()
+
+
+def test_client_of_running_loop_is_closed_on_that_loop():
+    ready, done = threading.Event(), threading.Event()
+    holder = {}
+
+    def other_thread():
+        async def main():
+            holder["client"] = typhoon_client.get_async_client()
+            holder["loop"] = asyncio.get_running_loop()
+            ready.set()
+            while not holder["client"].is_closed():
+                await asyncio.sleep(0.01)
+            done.set()
+        asyncio.run(main())
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    assert ready.wait(5)
+    mine = asyncio.run(client_of_loop())
+    assert done.wait(5)
+    thread.join(5)
+    assert holder["client"].is_closed() and mine is not holder["client"]
+
+
+def test_aclose_closes_current_client():
+    async def main():
+        client = typhoon_client.get_async_client()
+        await typhoon_client.aclose()
+        return client
+
+    client = asyncio.run(main())
+    assert client.is_closed()
+    assert typhoon_client._async["client"] is None
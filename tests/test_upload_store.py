@@ -0,0 +1,133 @@
+import asyncio, hashlib, os
+
+import pytest
+
+import upload_store
+from upload_store import receive_multipart, MultipartUpload, SNIFF_BYTES, UploadTooLarge, UnsupportedUpload
+
+BOUNDARY = "testboundary9c1e"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+ALLOWED_MIME = {"application/pdf", "image/jpeg", "image/png"}
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+
+
+def part(name, data, filename=None, content_type="application/octet-stream"):
+    disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename is not None else "")
+    headers = f"Content-Disposition: {disposition}\r\n"
+    if filename is not None:
+        headers += f"Content-Type: {content_type}\r\n"
+    return f"--{BOUNDARY}\r\n{headers}\r\n".encode() + data + b"\r\n"
+
+
+def body(*parts):
+    return b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+
+async def chunked(data, size):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def receive(data, upload_dir, chunk_size=3, max_bytes=1024 * 1024, **kwargs):
+    kwargs.setdefault("allowed_mime", ALLOWED_MIME)
+    return asyncio.run(receive_multipart(chunked(data, chunk_size), CONTENT_TYPE, str(upload_dir), max_bytes, **kwargs))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, SNIFF_BYTES - 1, 4096])
+def test_magic_bytes_split_across_chunks(tmp_path, chunk_size):
+    stored = receive(body(part("file", PNG, "scan.png")), tmp_path, chunk_size=chunk_size)
+    sha = hashlib.sha256(PNG).hexdigest()
+    assert (stored.mime_type, stored.size, stored.sha256) == ("image/png", len(PNG), sha)
+    assert stored.path == os.path.join(str(tmp_path), sha + ".png")
+    assert open(stored.path, "rb").read() == PNG
+    assert os.listdir(tmp_path) == [sha + ".png"]
+
+
+def test_file_shorter_than_sniff_bytes(tmp_path):
+    content = b"%PDF-"
+    assert len(content) < SNIFF_BYTES
+    stored = receive(body(part("file", content, "tiny.pdf")), tmp_path, chunk_size=2)
+    assert (stored.mime_type, stored.size, stored.original_name) == ("application/pdf", 5, "tiny.pdf")
+    assert open(stored.path, "rb").read() == content
+
+
+def test_short_unknown_file_is_rejected_and_cleaned_up(tmp_path):
+    with pytest.raises(UnsupportedUpload):
+        receive(body(part("file", b"abc", "a.png")), tmp_path)
+    assert os.listdir(tmp_path) == []
+
+
+def test_other_fields_are_skipped(tmp_path):
+    data = body(
+        part("note", b"%PDF- not a file"),
+        part("attachment", b"\xff\xd8\xff" + b"x" * 50, "photo.jpg"),
+        part("file", PNG, "../../scan.png"),
+        part("file", b"%PDF-1.7 second file", "second.pdf"),
+    )
+    stored = receive(data, tmp_path, chunk_size=5)
+    assert (stored.mime_type, stored.original_name) == ("image/png", "scan.png")
+    assert open(stored.path, "rb").read() == PNG
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_missing_file_field(tmp_path):
+    with pytest.raises(ValueError, match="No file uploaded"):
+        receive(body(part("attachment", PNG, "scan.png")), tmp_path)
+    assert os.listdir(tmp_path) == []
+
+
+def test_disallowed_type_is_rejected_after_writing_nothing(tmp_path):
+    with pytest.raises(UnsupportedUpload, match="application/pdf"):
+        receive(body(part("file", b"%PDF-1.7" + b"0" * 500, "a.pdf")), tmp_path, allowed_mime={"image/png"})
+    assert os.listdir(tmp_path) == []
+
+
+def test_content_length_over_limit_is_rejected_before_reading(tmp_path):
+    async def never_read():
+        raise AssertionError("body must not be read")
+        yield b""
+
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(receive_multipart(never_read(), CONTENT_TYPE, str(tmp_path), 100,
+                                      content_length=100 + upload_store.UPLOAD_FORM_OVERHEAD + 1))
+    assert os.listdir(tmp_path) == []
+
+
+def test_streamed_file_over_limit(tmp_path):
+    # Content-Length ไม่บอก (chunked) แต่ตัวไฟล์เกิน max_bytes — temp file ต้องถูกลบ
+    with pytest.raises(UploadTooLarge):
+        receive(body(part("file", PNG, "scan.png")), tmp_path, chunk_size=64, max_bytes=len(PNG) - 1)
+    assert os.listdir(tmp_path) == []
+
+
+def test_streamed_body_over_limit(tmp_path, monkeypatch):
+    # ไฟล์ผ่าน แต่ body ทั้งก้อน (field อื่น) เกิน max_bytes + UPLOAD_FORM_OVERHEAD
+    monkeypatch.setattr(upload_store, "UPLOAD_FORM_OVERHEAD", 100)
+    data = body(part("file", PNG, "scan.png"), part("note", b"n" * 500))
+    with pytest.raises(UploadTooLarge):
+        receive(data, tmp_path, chunk_size=64, max_bytes=len(PNG))
+    assert os.listdir(tmp_path) == []
+
+
+def test_error_mid_stream_discards_temp_file(tmp_path):
+    async def broken():
+        data = body(part("file", PNG, "scan.png"))
+        yield data[:len(data) // 2]
+        raise ConnectionResetError("client went away")
+
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(receive_multipart(broken(), CONTENT_TYPE, str(tmp_path), 1024 * 1024,
+                                      run_sync=asyncio.to_thread))
+    assert os.listdir(tmp_path) == []
+
+
+def test_same_content_reuses_stored_file(tmp_path):
+    first = receive(body(part("file", PNG, "a.png")), tmp_path)
+    second = receive(body(part("file", PNG, "b.png")), tmp_path, chunk_size=7)
+    assert first.path == second.path and second.original_name == "b.png"
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_rejects_non_multipart(tmp_path):
+    with pytest.raises(ValueError, match="multipart/form-data"):
+        MultipartUpload("application/json", str(tmp_path), 100)
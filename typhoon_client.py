@@ -0,0 +1,286 @@
+import os, time, random, asyncio, threading
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIStatusError
+from dotenv import load_dotenv
+
+from concurrency import limiter, TYPHOON_BASE_URL, TYPHOON_HOST
+from metrics import LatencyHistogram, metrics, histogram_lines
+
+# ---- Settings ----
+TYPHOON_MAX_CONNECTIONS = int(os.getenv("TYPHOON_MAX_CONNECTIONS", "20"))
+TYPHOON_MAX_KEEPALIVE = int(os.getenv("TYPHOON_MAX_KEEPALIVE", "10"))
+TYPHOON_KEEPALIVE_EXPIRY = float(os.getenv("TYPHOON_KEEPALIVE_EXPIRY", "60"))
+# HTTP/2 ต้องมีแพ็กเกจ h2 ถ้าไม่มีจะใช้ HTTP/1.1 keep-alive แทน
+TYPHOON_HTTP2 = os.getenv("TYPHOON_HTTP2", "1").lower() in ("1", "true", "yes")
+TYPHOON_CONNECT_TIMEOUT = float(os.getenv("TYPHOON_CONNECT_TIMEOUT", "10"))
+# OCR หน้าที่ยาวอาจใช้เวลาหลายนาที
+TYPHOON_READ_TIMEOUT = float(os.getenv("TYPHOON_READ_TIMEOUT", "180"))
+TYPHOON_MAX_RETRIES = int(os.getenv("TYPHOON_MAX_RETRIES", "4"))
+TYPHOON_BACKOFF_BASE = float(os.getenv("TYPHOON_BACKOFF_BASE", "0.5"))
+TYPHOON_BACKOFF_MAX = float(os.getenv("TYPHOON_BACKOFF_MAX", "30"))
+# จำนวน request แบบ async ที่ค้างอยู่กับ Typhoon พร้อมกันได้สูงสุดต่อ process
+TYPHOON_MAX_IN_FLIGHT = int(os.getenv("TYPHOON_MAX_IN_FLIGHT", "32"))
+
+# 409 (conflict) ไม่ใช่ error ชั่วคราว — ส่งซ้ำก็ได้ผลเดิม
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+# ขอบบนของแต่ละช่องใน histogram (วินาที)
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+
+
+class LatencyStats:
+    """เก็บ LatencyHistogram แยกตามชื่อ endpoint (ocr / extract / ...) ใช้ร่วมกันทุก thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, LatencyHistogram] = {}
+
+    def _hist(self, endpoint: str) -> LatencyHistogram:
+        hist = self._endpoints.get(endpoint)
+        if hist is None:
+            hist = self._endpoints[endpoint] = LatencyHistogram(LATENCY_BUCKETS)
+        return hist
+
+    def observe(self, endpoint: str, seconds: float, ok: bool = True):
+        with self._lock:
+            self._hist(endpoint).observe(seconds, ok)
+
+    def retry(self, endpoint: str):
+        with self._lock:
+            self._hist(endpoint).retries += 1
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {name: hist.snapshot() for name, hist in self._endpoints.items()}
+
+    def prometheus(self):
+        """บรรทัดสำหรับ GET /metrics"""
+        with self._lock:
+            items = list(self._endpoints.items())
+            lines = histogram_lines("typhoon_request_duration_seconds", "Typhoon API request latency", "endpoint", items)
+            lines += [
+                "# HELP typhoon_request_retries_total Typhoon API requests retried",
+                "# TYPE typhoon_request_retries_total counter",
+            ] + [f'typhoon_request_retries_total{{endpoint="{n}"}} {h.retries}' for n, h in items]
+            lines += [
+                "# HELP typhoon_request_errors_total Failed Typhoon API requests (including retried ones)",
+                "# TYPE typhoon_request_errors_total counter",
+            ] + [f'typhoon_request_errors_total{{endpoint="{n}"}} {h.errors}' for n, h in items]
+        return lines
+
+
+# สถิติกลางของ process
+stats = LatencyStats()
+metrics.register_collector(stats.prometheus)
+
+
+def _is_retryable(exc: Exception) -> bool:
+    # APITimeoutError เป็น subclass ของ APIConnectionError
+    if isinstance(exc, (APIConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code in RETRY_STATUS
+    return False
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float = TYPHOON_BACKOFF_BASE, cap: float = TYPHOON_BACKOFF_MAX) -> float:
+    """exponential backoff แบบ full jitter: สุ่มระหว่าง 0 ถึง min(cap, base * 2^attempt)"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _retry_delay(endpoint: str, exc: Exception, attempt: int, max_retries: int) -> Optional[float]:
+    """เวลาที่ต้องรอก่อนลองครั้งถัดไป หรือ None ถ้าไม่ควรลองใหม่"""
+    if attempt >= max_retries or not _is_retryable(exc):
+        return None
+    delay = min(_retry_after(exc) or backoff_delay(attempt), TYPHOON_BACKOFF_MAX)
+    stats.retry(endpoint)
+    print(f"[TYPHOON] {endpoint} failed ({exc.__class__.__name__}), retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+    return delay
+
+
+def call(endpoint: str, fn: Callable[[], Any], max_retries: int = TYPHOON_MAX_RETRIES, host: str = TYPHOON_HOST):
+    """
+    เรียก fn() (request หนึ่งครั้งไปยัง Typhoon) ผ่าน rate limiter ของ host
+    ถ้าเจอ 429/5xx/timeout/connection error จะลองใหม่แบบ exponential backoff + jitter
+    (ใช้ Retry-After ของ server ถ้ามี) และบันทึก latency ของทุกครั้งลง stats
+    """
+    attempt = 0
+    while True:
+        limiter.acquire(host)
+        started = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            stats.observe(endpoint, time.perf_counter() - started, ok=False)
+            delay = _retry_delay(endpoint, e, attempt, max_retries)
+            if delay is None:
+                raise
+            attempt += 1
+            time.sleep(delay)
+            continue
+        stats.observe(endpoint, time.perf_counter() - started)
+        return result
+
+
+async def acall(endpoint: str, fn: Callable[[], Any], max_retries: int = TYPHOON_MAX_RETRIES, host: str = TYPHOON_HOST):
+    """
+    เหมือน call() แต่ fn() คืน coroutine (เช่น request ผ่าน AsyncOpenAI)
+    จำนวน request ที่ค้างพร้อมกันทั้ง process ถูกจำกัดด้วย semaphore ขนาด TYPHOON_MAX_IN_FLIGHT
+    ระหว่างรอ backoff จะไม่ถือ semaphore ไว้
+    """
+    state = _async_state()
+    attempt = 0
+    while True:
+        await limiter.aacquire(host)
+        async with state["semaphore"]:
+            state["in_flight"] += 1
+            started = time.perf_counter()
+            try:
+                result = await fn()
+            except Exception as e:
+                stats.observe(endpoint, time.perf_counter() - started, ok=False)
+                delay = _retry_delay(endpoint, e, attempt, max_retries)
+                if delay is None:
+                    raise
+            else:
+                stats.observe(endpoint, time.perf_counter() - started)
+                return result
+            finally:
+                state["in_flight"] -= 1
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=TYPHOON_MAX_CONNECTIONS,
+        max_keepalive_connections=TYPHOON_MAX_KEEPALIVE,
+        keepalive_expiry=TYPHOON_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(TYPHOON_READ_TIMEOUT, connect=TYPHOON_CONNECT_TIMEOUT)
+
+
+# client กลางของ process — สร้างเมื่อเรียกใช้ครั้งแรก
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> OpenAI:
+    """
+    OpenAI client ตัวเดียวของทั้ง process (thread-safe) ใช้ connection pool ร่วมกัน
+    จึงไม่ต้อง TLS handshake ใหม่ทุกหน้า — retry ทำใน call() เอง จึงปิด retry ของ SDK
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                load_dotenv()
+                http_client = httpx.Client(
+                    http2=TYPHOON_HTTP2 and _http2_available(), limits=_limits(), timeout=_timeout()
+                )
+                _client = OpenAI(
+                    api_key=os.getenv("TYPHOON_OCR_API_KEY"),
+                    base_url=TYPHOON_BASE_URL,
+                    http_client=http_client,
+                    max_retries=0,
+                    timeout=_timeout(),
+                )
+    return _client
+
+
+# client/semaphore แบบ async ผูกกับ event loop ที่สร้าง จึงสร้างใหม่ถ้า loop เปลี่ยน (และปิดตัวเก่า)
+_async = {"loop": None, "client": None, "semaphore": None, "in_flight": 0}
+_closing = set()  # task ที่กำลังปิด client เก่า (ถือ reference ไว้ไม่ให้ถูก GC ก่อนเสร็จ)
+
+
+async def _close_quietly(client: AsyncOpenAI):
+    try:
+        await client.close()
+    except Exception as e:
+        print("[TYPHOON] closing previous async client failed:", repr(e))
+
+
+def _close_previous(old_loop, client: Optional[AsyncOpenAI]):
+    """
+    ปิด client ของ loop เดิม: ถ้า loop เดิมยังรันอยู่ (thread อื่น) ให้ปิดบน loop นั้น
+    ถ้าหยุดไปแล้ว (เช่นหลัง asyncio.run) ปิดบน loop ปัจจุบัน — connection ที่ค้างถูกปิดทิ้ง
+    """
+    if client is None:
+        return
+    if old_loop is not None and old_loop.is_running() and not old_loop.is_closed():
+        asyncio.run_coroutine_threadsafe(_close_quietly(client), old_loop)
+        return
+    task = asyncio.get_running_loop().create_task(_close_quietly(client))
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+def _async_state() -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    if _async["loop"] is not loop:
+        _close_previous(_async["loop"], _async["client"])
+        load_dotenv()
+        http_client = httpx.AsyncClient(
+            http2=TYPHOON_HTTP2 and _http2_available(), limits=_limits(), timeout=_timeout()
+        )
+        _async.update(
+            loop=loop,
+            client=AsyncOpenAI(
+                api_key=os.getenv("TYPHOON_OCR_API_KEY"),
+                base_url=TYPHOON_BASE_URL,
+                http_client=http_client,
+                max_retries=0,
+                timeout=_timeout(),
+            ),
+            semaphore=asyncio.Semaphore(TYPHOON_MAX_IN_FLIGHT),
+            in_flight=0,
+        )
+    return _async
+
+
+def get_async_client() -> AsyncOpenAI:
+    """AsyncOpenAI client ของ event loop ปัจจุบัน (ต้องเรียกจากใน coroutine)"""
+    return _async_state()["client"]
+
+
+async def aclose():
+    """ปิด AsyncOpenAI client ของ event loop ปัจจุบัน (เรียกตอน shutdown ก่อน loop ปิด)"""
+    if _async["loop"] is asyncio.get_running_loop() and _async["client"] is not None:
+        client = _async["client"]
+        _async.update(loop=None, client=None, semaphore=None)
+        await client.close()
+
+
+def status() -> Dict[str, Any]:
+    return {
+        "base_url": TYPHOON_BASE_URL,
+        "client_ready": _client is not None,
+        "http2": TYPHOON_HTTP2 and _http2_available(),
+        "max_connections": TYPHOON_MAX_CONNECTIONS,
+        "max_retries": TYPHOON_MAX_RETRIES,
+        "max_in_flight": TYPHOON_MAX_IN_FLIGHT,
+        "in_flight": _async["in_flight"],
+        "endpoints": stats.status(),
+    }
@@ -0,0 +1,248 @@
+import os, hashlib, tempfile
+from urllib.parse import quote
+from typing import Any, AsyncIterable, Dict, Optional
+
+try:
+    from python_multipart import MultipartParser
+    from python_multipart.multipart import parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart import MultipartParser
+    from multipart.multipart import parse_options_header
+
+# ---- Settings ----
+# ส่วนเกินของ body multipart นอกจากตัวไฟล์ (boundary, header ของ part, field อื่น)
+UPLOAD_FORM_OVERHEAD = int(os.getenv("UPLOAD_FORM_OVERHEAD", str(64 * 1024)))
+
+# นามสกุลของไฟล์ที่เก็บ (FileHandler แยก PDF/ภาพจากนามสกุล)
+MIME_EXTENSIONS = {"application/pdf": ".pdf", "image/jpeg": ".jpg", "image/png": ".png"}
+
+# magic bytes ที่ต้นไฟล์ -> MIME จริง (ไม่เชื่อ Content-Type ที่ client ส่งมา)
+MAGIC = (
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+)
+SNIFF_BYTES = max(len(m) for m, _ in MAGIC)
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class UnsupportedUpload(ValueError):
+    pass
+
+
+def download_path(stored_name: str, original_name: Optional[str] = None) -> str:
+    """path ของ GET /download — ส่งชื่อไฟล์เดิมไปด้วย (?name=) ให้ไฟล์ที่ดาวน์โหลดได้ชื่อที่ผู้ใช้อัปโหลด"""
+    path = f"/download/{quote(stored_name)}"
+    return f"{path}?name={quote(original_name)}" if original_name else path
+
+
+def sniff_mime(head: bytes) -> Optional[str]:
+    for magic, mime in MAGIC:
+        if head.startswith(magic):
+            return mime
+    return None
+
+
+class StoredUpload:
+    """ไฟล์อัปโหลดที่บันทึกแล้วที่ <upload_dir>/<sha256><ext> พร้อม meta ที่คำนวณตอนเขียน"""
+
+    def __init__(self, original_name: str, path: str, sha256: str, size: int, mime_type: str):
+        self.original_name = original_name
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.mime_type = mime_type
+
+    @property
+    def stored_name(self) -> str:
+        return os.path.basename(self.path)
+
+    def meta(self) -> Dict[str, Any]:
+        """meta ของ DatabaseConnection.insert_document — ครบทุก field จึงไม่ต้องอ่านไฟล์ซ้ำ"""
+        return {
+            "original_name": self.original_name,
+            "file_path": self.path,
+            "mime_type": self.mime_type,
+            "file_size_bytes": self.size,
+            "sha256": self.sha256,
+        }
+
+
+class HashingWriter:
+    """
+    เขียนไฟล์ชั่วคราวใน upload_dir พร้อมคำนวณ SHA-256 และขนาดไปในรอบเดียว
+    commit() ย้ายไปเป็น <sha256><ext> (ไฟล์เนื้อหาเดียวกันใช้ไฟล์เดิม) discard() ลบทิ้ง
+    """
+
+    def __init__(self, upload_dir: str, max_bytes: Optional[int] = None):
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._hash = hashlib.sha256()
+        fd, self._tmp_path = tempfile.mkstemp(prefix=".upload_", dir=upload_dir)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise UploadTooLarge("File too large")
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def commit(self, original_name: str, mime_type: str) -> StoredUpload:
+        self._file.close()
+        sha = self._hash.hexdigest()
+        ext = MIME_EXTENSIONS.get(mime_type) or os.path.splitext(original_name)[1].lower()
+        path = os.path.join(self.upload_dir, sha + ext)
+        if os.path.exists(path):
+            os.remove(self._tmp_path)
+        else:
+            os.replace(self._tmp_path, path)
+        return StoredUpload(original_name, path, sha, self.size, mime_type)
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class MultipartUpload:
+    """
+    รับ body แบบ multipart/form-data ทีละ chunk (feed) แล้วเขียน part ของไฟล์ลงดิสก์ทันทีผ่าน HashingWriter
+    - ตรวจขนาดสะสมทุก chunk และ magic bytes ที่หัวไฟล์ — ปฏิเสธได้ตั้งแต่ chunk แรก ๆ ไม่ต้องรอ body ทั้งก้อน
+    - ไม่มีสำเนาของไฟล์ในหน่วยความจำหรือใน temp file ของ Starlette (ถือแค่ chunk ปัจจุบัน)
+    ใช้ไฟล์แรกของ field เดียวเท่านั้น part อื่นถูกข้าม (แต่นับรวมใน max_bytes + UPLOAD_FORM_OVERHEAD)
+    """
+
+    def __init__(self, content_type: str, upload_dir: str, max_bytes: int, allowed_mime=None, field: str = "file"):
+        ctype, options = parse_options_header(content_type or "")
+        boundary = options.get(b"boundary")
+        if ctype != b"multipart/form-data" or not boundary:
+            raise ValueError("Expected multipart/form-data upload")
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.allowed_mime = allowed_mime
+        self.field = field.encode("latin-1")
+        self.received = 0
+        self.upload: Optional[StoredUpload] = None
+        self._writer: Optional[HashingWriter] = None
+        self._filename = None
+        self._mime = None
+        self._head = b""
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._in_file = False
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    # ---- callbacks ของ MultipartParser ----
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field, self._header_value = b"", b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        filename = options.get(b"filename")
+        self._in_file = self.upload is None and self._writer is None and options.get(b"name") == self.field
+        if not self._in_file:
+            return
+        self._filename = os.path.basename(filename.decode("utf-8", "replace")) if filename else ""
+        if not self._filename.strip():
+            raise ValueError("No file uploaded or empty filename")
+        self._head = b""
+        self._writer = HashingWriter(self.upload_dir, self.max_bytes)
+
+    def _on_part_data(self, data, start, end):
+        if not self._in_file:
+            return
+        chunk = data[start:end]
+        if self._mime is None:
+            # เก็บหัวไฟล์ไว้จนพอจะดู magic bytes (อาจมาหลาย callback)
+            self._head += chunk
+            if len(self._head) < SNIFF_BYTES:
+                return
+            self._sniff()
+            chunk, self._head = self._head, b""
+        self._writer.write(chunk)
+
+    def _on_part_end(self):
+        if not self._in_file:
+            return
+        self._in_file = False
+        if self._mime is None:
+            # ไฟล์สั้นกว่า SNIFF_BYTES
+            self._sniff()
+            self._writer.write(self._head)
+        self.upload = self._writer.commit(self._filename, self._mime)
+        self._writer = None
+
+    def _sniff(self):
+        mime = sniff_mime(self._head)
+        if mime is None or (self.allowed_mime is not None and mime not in self.allowed_mime):
+            raise UnsupportedUpload(f"Unsupported type: {mime or 'unknown'}")
+        self._mime = mime
+
+    # ---- API ----
+    def feed(self, chunk: bytes):
+        """ส่ง chunk ถัดไปของ body — UploadTooLarge / UnsupportedUpload / ValueError ทันทีที่รู้"""
+        self.received += len(chunk)
+        if self.received > self.max_bytes + UPLOAD_FORM_OVERHEAD:
+            raise UploadTooLarge("File too large")
+        self._parser.write(chunk)
+
+    def finish(self) -> StoredUpload:
+        self._parser.finalize()
+        if self.upload is None:
+            raise ValueError("No file uploaded or empty filename")
+        return self.upload
+
+    def discard(self):
+        """ลบไฟล์ชั่วคราว (เรียกเมื่อ feed/finish ล้ม)"""
+        if self._writer is not None:
+            self._writer.discard()
+            self._writer = None
+
+
+async def receive_multipart(chunks: AsyncIterable[bytes], content_type: str, upload_dir: str, max_bytes: int,
+                            allowed_mime=None, field: str = "file", content_length: Optional[int] = None,
+                            run_sync=None) -> StoredUpload:
+    """
+    อ่าน body ของ request (เช่น request.stream()) แล้วบันทึกไฟล์ของ field ด้วย MultipartUpload
+    content_length เกินขีดจำกัด = ปฏิเสธก่อนอ่าน byte แรก
+    run_sync(fn, *args): รันการเขียนดิสก์นอก event loop (เช่น asyncio.to_thread)
+    """
+    if content_length is not None and content_length > max_bytes + UPLOAD_FORM_OVERHEAD:
+        raise UploadTooLarge("File too large")
+    receiver = MultipartUpload(content_type, upload_dir, max_bytes, allowed_mime, field)
+    try:
+        async for chunk in chunks:
+            if run_sync is None:
+                receiver.feed(chunk)
+            else:
+                await run_sync(receiver.feed, chunk)
+        return receiver.finish()
+    except BaseException:
+        receiver.discard()
+        raise